@@ -7,6 +7,8 @@ import matplotlib.colors as mcolors
 import muonfixedid, chamberlist
 import splitter_regions_Run2
 import mdtCalib_functions
+import efficiency
+import segmentCuts
 
 
 # pre-defined functions
@@ -25,28 +27,6 @@ def convertRtConstants(da):
     return zs, zl, z, splitDriftTime, diffJointPoint
 
 
-# function to check efficiency
-def check_3sigma(df_eff):
-    if df_eff.resi_unbias > 3 * df_eff.res_Sigma:
-        return False
-    else:
-        return True
-
-
-def check_5sigma(df_eff):
-    if df_eff.resi_unbias > 5 * df_eff.res_Sigma:
-        return False
-    else:
-        return True
-
-
-def check_hardware(df_eff):
-    if df_eff.rTrk_unbias > maxRadius:
-        return False
-    else:
-        return True
-
-
 # data = 'run358395_refitOff_region0178_EIL2C11_refittedSegment_refitOff.csv'
 chamber = 'BME4A13'
 run = '437124'
@@ -54,19 +34,11 @@ df = pd.read_csv('/Users/fedorboreiko/PycharmProjects/roottocsv/dataConverted/1_
 
 # apply segment on track and chi2 cut
 # df = df[df.onTrkFlag == True]
+# apply chi2 cut, driftTime cut and nSegHits cut (segmentCuts 'efficiency' preset)
+# flow[1] : segments left after the chi2 cut
 minChi2 = 1000
-df = df[df.seg_chi2 < minChi2]
-print(run, chamber, df.shape[0])
-
-# apply driftTime cut and nSegHits cut
-if chamber[:3] in ['BMG', 'BME']:
-    df['cut_t'] = df['mdt_t'].apply(lambda x: all(0 < float(ss) < 186 for ss in x[1:-1].split(', ')))
-    df = df[df['cut_t']]
-    df = df[df['seg_nMdtHits'] > 6]
-else:
-    df['cut_t'] = df['mdt_t'].apply(lambda x: all(0 < float(ss) < 750 for ss in x[1:-1].split(', ')))
-    df = df[df['cut_t']]
-    df = df[df['seg_nMdtHits'] > 5]
+df, flow = segmentCuts.applyPreset(df, chamber, 'efficiency', chi2=(None, minChi2))
+print(run, chamber, flow[1][1])
 print('all segments after cut : ', df.shape[0])
 
 # load data columns
@@ -94,34 +66,12 @@ print(chamber, splitDriftTime, zs, zl, resolution_constants)
 resSigma = np.polyval(resolution_constants, np.abs(f_new)) / 1000.
 print(resSigma)
 
-# create a new dataframe for calcuating efficiency
-df_eff = pd.DataFrame({'radius': f_r, 'rTrk_new': f_new, 'rTrk_unbias': f_unbias, 'res_Sigma': resSigma,
-                       'resi_unbias': np.abs(resi_unbias)})
-
-#df_eff['sigma3_flag'] = df_eff.apply(check_3sigma, axis=1)
-df_eff['sigma5_flag'] = df_eff.apply(check_5sigma, axis=1)
-df_eff['sigmaHardware_flag'] = df_eff.apply(check_hardware, axis=1)
-
-df_eff.head()
-
-# set radius interval
-startSlice = np.arange(0.1, maxRadius, step)
-stopSlice = np.append(startSlice[1:], maxRadius)
-branchBasket = list(zip(*(startSlice, stopSlice)))
-
-#n3_eff = []
-n5_eff = []
-h_eff = []
-for n in range(len(branchBasket)):
-    radius_filter = (df_eff.rTrk_new < branchBasket[n][1]) & (df_eff.rTrk_new > branchBasket[n][0])
-    #count3 = df_eff.sigma3_flag[radius_filter]
-    # print(n,len(count3),np.sum(count3))
-    #n3_eff.append(100.0 * np.sum(count3) / len(count3))
-    count5 = df_eff.sigma5_flag[radius_filter]
-    n5_eff.append(100.0 * np.sum(count5) / len(count5))
-    count_h = df_eff.sigmaHardware_flag[radius_filter]
-    # print(n,len(count),np.sum(count))
-    h_eff.append(100.0 * np.sum(count_h) / len(count_h))
+# efficiency flags as boolean arrays, counted per radius slice in one pass
+flags = efficiency.efficiencyFlags(resi_unbias, resSigma, f_unbias, maxRadius, nSigma=[3, 5])
+eff = efficiency.binnedEfficiency(flags, f_new, efficiency.radiusSlices(maxRadius, step))
+n3_eff = eff['sigma3']
+n5_eff = eff['sigma5']
+h_eff = eff['hardware']
 
 print(n5_eff, h_eff)
 
@@ -6,14 +6,12 @@ import matplotlib.pyplot as plt
 import muonfixedid, chamberlist
 import splitter_regions_Run2
 import mdtCalib_functions
+import columnarCache
+import segmentCuts
+import efficiency
 
 
 # pre-defined functions
-# function to convert single columns string data to np.array
-def conv(df):
-    return np.hstack(np.array([[float(st) for st in item.strip('[]\s').split(',')] for item in list(df.values)]))
-
-
 # function to convert RT paraments
 def convertRtConstants(da):
     zs = np.array([float(x) for x in da.values[0][5][1:-1].split(', ')])
@@ -24,28 +22,6 @@ def convertRtConstants(da):
     return zs, zl, z, splitDriftTime, diffJointPoint
 
 
-# function to check efficiency
-def check_3sigma(df_eff):
-    if df_eff.resi_unbias > 3 * df_eff.res_Sigma:
-        return False
-    else:
-        return True
-
-
-def check_5sigma(df_eff):
-    if df_eff.resi_unbias > 5 * df_eff.res_Sigma:
-        return False
-    else:
-        return True
-
-
-def check_hardware(df_eff):
-    if df_eff.rTrk_unbias > maxRadius:
-        return False
-    else:
-        return True
-
-
 # data = 'run358395_refitOff_region0178_EIL2C11_refittedSegment_refitOff.csv'
 '''data = ['dataConverted/run437124_region0051_BME4A13.csv',
         'dataConverted/run437124_region0051_BMG2A12.csv',
@@ -105,6 +81,9 @@ datacombined = list(zip(*(data, color)))
 
 run = '437124'
 num = 0
+# plot the binomial error of every radius slice
+showErrors = False
+efficiencyColumns = ['seg_chi2', 'seg_nMdtHits', 'mdt_t', 'mdt_r', 'mdt_resi', 'rTrk_new', 'unbias_rTrk_new']
 
 fig, ax = plt.subplots(figsize=(10, 8))
 plt.subplots_adjust(top=0.93, bottom=0.15, left=0.12, right=0.98, wspace=0.2, hspace=0.2)
@@ -112,35 +91,24 @@ plt.subplots_adjust(top=0.93, bottom=0.15, left=0.12, right=0.98, wspace=0.2, hs
 while num < len(datacombined):
     # get chamber name
     chamber = datacombined[num][0][-11:-4]
-    df = pd.read_csv(datacombined[num][0])
-
-    # apply segment on track and chi2 cut
+    # columnar cache, list columns are parsed once and kept as flat arrays + offsets
+    # only the columns of the cuts and the efficiency are read, chi2 cut applied while reading
     minChi2 = 1000
-    df = df[df.seg_chi2 < minChi2]
-    print(run, chamber, df.shape[0])
-
-    # apply driftTime cut and nSegHits cut
-    if chamber[:3] in ['BMG', 'BME']:
-        df['cut_t'] = df['mdt_t'].apply(lambda x: all(0 < float(ss) < 186 for ss in x[1:-1].split(', ')))
-        df = df[df['cut_t']]
-        df = df[df['seg_nMdtHits'] > 6]
-    else:
-        df['cut_t'] = df['mdt_t'].apply(lambda x: all(0 < float(ss) < 750 for ss in x[1:-1].split(', ')))
-        df = df[df['cut_t']]
-        df = df[df['seg_nMdtHits'] > 5]
-    print('all segments after cut : ', df.shape[0])
+    seg = columnarCache.loadSegments(datacombined[num][0], columns=efficiencyColumns,
+                                     cuts=['seg_chi2 < %g' % minChi2])
+    print(run, chamber, len(seg))
 
-    if df.shape[0] > 500:
+    # apply driftTime cut and nSegHits cut, chi2 cut already applied while reading
+    seg, flow = segmentCuts.applyPreset(seg, chamber, 'efficiency', chi2=None)
+    print('all segments after cut : ', len(seg))
+
+    if len(seg) > 500:
 
         # load data columns
-        unbias = df.unbias_rTrk_new
-        new = df.rTrk_new
-        r = df.mdt_r
-        resi = df.mdt_resi
-        f_unbias = conv(unbias)
-        f_new = conv(new)
-        f_r = conv(r)
-        f_resi = conv(resi)
+        f_unbias = seg.flat('unbias_rTrk_new')
+        f_new = seg.flat('rTrk_new')
+        f_r = seg.flat('mdt_r')
+        f_resi = seg.flat('mdt_resi')
         resi = np.abs(f_r) - np.abs(f_new)
         resi_new = np.abs(f_r) - np.abs(f_new)
         resi_unbias = np.abs(f_r) - np.abs(f_unbias)
@@ -161,27 +129,17 @@ while num < len(datacombined):
         resSigma = np.polyval(resolution_constants, np.abs(f_new)) / 1000.
         # print('resSigma : ', resSigma)
 
-        # create a new dataframe for calculating efficiency
-        df_eff = pd.DataFrame({'radius': f_r, 'rTrk_new': f_new, 'rTrk_unbias': f_unbias, 'res_Sigma': resSigma,
-                               'resi_unbias': np.abs(resi_unbias)})
-        # print('df_eff.shape : ', df_eff.shape)
-
-        df_eff['sigmaHardware_flag'] = df_eff.apply(check_hardware, axis=1)
-
-        df_eff.head()
-
-        # set radius interval
-        startSlice = np.arange(0.1, maxRadius, step)
-        stopSlice = np.append(startSlice[1:], maxRadius)
-        branchBasket = list(zip(*(startSlice, stopSlice)))
-
-        h_eff = []
-        for n in range(len(branchBasket)):
-            radius_filter = (df_eff.rTrk_new < branchBasket[n][1]) & (df_eff.rTrk_new > branchBasket[n][0])
-            count_h = df_eff.sigmaHardware_flag[radius_filter]
-            h_eff.append(100.0 * np.sum(count_h) / len(count_h))
-
-        ax.plot(np.arange(7), h_eff, '^', color=datacombined[num][1], markersize=4, label='{0} chamber'.format(chamber))
+        # efficiency flags as boolean arrays, counted per radius slice in one pass
+        flags = efficiency.efficiencyFlags(resi_unbias, resSigma, f_unbias, maxRadius, nSigma=[])
+        eff = efficiency.binnedEfficiency(flags, f_new, efficiency.radiusSlices(maxRadius, step))
+        h_eff = eff['hardware']
+
+        if showErrors:
+            ax.errorbar(np.arange(7), h_eff, yerr=eff['hardware_err'], fmt='^', color=datacombined[num][1],
+                        markersize=4, label='{0} chamber'.format(chamber))
+        else:
+            ax.plot(np.arange(7), h_eff, '^', color=datacombined[num][1], markersize=4,
+                    label='{0} chamber'.format(chamber))
         num += 1
 
     else:
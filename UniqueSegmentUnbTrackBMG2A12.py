@@ -9,6 +9,9 @@ import mdtfunctions
 import muonfixedid, chamberlist
 import splitter_regions_Run2
 import mdtCalib_functions
+import batchRefit
+import refitCache
+import refitCheckpoint
 
 file = 'dataConverted/run437124_region0104_BMG2C14.csv'
 df = pd.read_csv(file)
@@ -17,9 +20,6 @@ chamber = file[-11:-4]
 df_RtResFit = 'UM6608_RtResFit.csv'
 splitDriftTime, zs, zl, resolution_constants = mdtCalib_functions.getRtRes(df_RtResFit, chamber)
 
-df1 = pd.DataFrame(columns = ['rTrk_new', 'unbias_rTrk_new'], index = np.arange(0, len(df), 1))
-print(df1)
-
 q = 0
 
 '''flag, rTrk_new, track_chi2_new, track_chi2_default, refit_m, refit_b, unbias_rTrk_new = mdtfunctions.refitSegment(422, df, resolution_constants)
@@ -30,33 +30,19 @@ print('unbias_rTrk_new on {}: {}'.format(422, unbias_rTrk_new))'''
 
 
 #df1 = df1.append({'rTrk_new' : rTrk_new, 'unbias_rTrk_new' : unbias_rTrk_new}, ignore_index=True)
-while q < len(df):
-        flag, rTrk_new, track_chi2_new, track_chi2_default, refit_m, refit_b, unbias_rTrk_new = mdtfunctions.refitSegment(q, df, resolution_constants)
-        df1.loc[q] = [rTrk_new, unbias_rTrk_new]
-        #print('On {} : {}'.format(q, rTrk_new))
-        #print('On {} : {}'.format(q, unbias_rTrk_new))
-        q += 1
-print('len before: ', len(df1.unbias_rTrk_new))
-print('len of f1: ', len(df1))
-a = len(df1)
-i = 0
-sum = 0
-while i < a:
-    if str(df1.unbias_rTrk_new[i])[1:6] == "-99.0":
-        df1 = df1.drop(labels=i, axis=0)
-        print('here on: ', i)
-        i += 1
-        sum += 1
-    else:
-        i += 1
-print('sum: ', sum)
-print('len after: ', len(df1.values))
-print('end of looping')
-
-'''print(df1.values[0][0])
-print(type(df1.values[0][0]))
-print(df1.values[0][0][0])'''
-#out = df1.groupby(level=0).agg(list)
-outfinal = pd.concat([df1, df.reindex(df1.index)], axis=1)
-#outfinal = pd.concat([df1, df], axis=1, join="inner")
-outfinal.to_csv('dataConverted/run437124_region0104_BMG2C14.csv')
\ No newline at end of file
+# all segments refitted at once, same results as mdtfunctions.refitSegment(q, df, resolution_constants) for every q
+# refit results are cached (refitCache/), reruns only refit new segments or all segments after a new calibration
+# refit is checkpointed in chunks (refitCheckpoint/), a killed job restarts from the last completed chunk
+flag, rTrk_new, track_chi2_new, track_chi2_default, refit_m, refit_b, unbias_rTrk_new = refitCheckpoint.checkpointedRefitSegments(
+    df, resolution_constants, chamber, 'refitCheckpoint/' + os.path.basename(file)[:-4],
+    refit=refitCache.cachedRefitSegments)
+# typed ragged results and validity mask, segments with failed unbias refit (-99) removed and the refit columns
+# joined to the remaining input rows in one step
+nHits = df.mdt_r.astype(str).str.count(',').values + 1
+refit, valid = batchRefit.refitColumns((flag, rTrk_new, track_chi2_new, track_chi2_default, refit_m, refit_b,
+                                        unbias_rTrk_new), nHits)
+print('len before: ', len(refit))
+print('sum: ', np.sum(~valid))
+outfinal = batchRefit.joinRefit(df, refit, valid)
+print('len after: ', len(outfinal))
+refitCheckpoint.writeCsv(outfinal, 'dataConverted/run437124_region0104_BMG2C14.csv')
\ No newline at end of file
@@ -0,0 +1,428 @@
+import numpy as np
+import pandas as pd
+import mdtCalib_functions
+import columnarCache
+import numbaRefit
+
+
+# batch version of xMdtSegment.applyRefitSegment / applyUnbiasResidual
+# all segments of one chamber are padded into (nSegments, maxHits) arrays (padding = nan)
+# and refitted together, tangent lines / candidate chi2 / final line fit done in array operations
+#
+#  How to use:
+# locY, locZ, radial, rTrk, nHits = batchRefit.padSegments(df, ['mdt_posY', 'mdt_posZ', 'mdt_r', 'mdt_rTrk'])
+# flag, chi2_new, chi2_def, rTrk_new, m, b = batchRefit.applyRefitSegments(locY, locZ, radial, rTrk, nHits,
+#                                                                           resolution_constants, 'BMG2A12', m_def, b_def)
+# biased and unbias refit together, sharing the tangent lines of all hit pairs (faster than the two calls)
+# flag, chi2_new, chi2_def, rTrk_new, m, b, unbias_rTrk_new = batchRefit.applyCombinedRefit(locY, locZ, radial, rTrk,
+#                                                                nHits, resolution_constants, 'BMG2A12', m_def, b_def)
+# or for a full chamber dataframe (same outputs as new_mdtCalib_functions.refitSegment for every row)
+# flag, rTrk_new, chi2_new, chi2_def, m, b, unbias_rTrk_new = batchRefit.refitSegments(df, resolution_constants, 'BMG2A12')
+# typed ragged outputs (SegmentColumns) and validity mask, failed segments removed and joined back to the input
+# refit, valid = batchRefit.refitColumns(batchRefit.refitSegments(df, resolution_constants, 'BMG2A12'), nHits)
+# out = batchRefit.joinRefit(df, refit, valid)      # rTrk_new, unbias_rTrk_new list columns + df columns
+
+
+# function to pad flat values into (nRows, maxEntries) array, padding with fill
+def padFlat(flat, counts, fill=np.nan):
+    counts = np.asarray(counts)
+    width = np.max(counts) if len(counts) > 0 else 0
+    out = np.full((len(counts), width), fill, dtype=float)
+    mask = np.arange(width)[None, :] < counts[:, None]
+    out[mask] = flat
+    return out
+
+
+# function to convert padded array back to list of lists (one list per segment), e.g. for csv output
+def unpadSegments(arr, nHits):
+    return [list(row[:n]) for row, n in zip(arr.tolist(), np.asarray(nHits))]
+
+
+# load list-in-string columns of a segment dataframe into padded arrays, last output is nHits per segment
+def padSegments(df, columns):
+    out = []
+    nHits = None
+    for col in columns:
+        flat, counts = columnarCache.parseListColumn(df[col])
+        if nHits is None:
+            nHits = counts
+        out.append(padFlat(flat, counts))
+    out.append(nHits)
+    return tuple(out)
+
+
+# 4 tangent lines of every consecutive hit pair (nRows, nPairs, 4, 4), nan for pairs beyond the nHits of the row
+def _pairLines(y, z, r, n):
+    lines = mdtCalib_functions.tangentLines(y[:, :-1], z[:, :-1], r[:, :-1], y[:, 1:], z[:, 1:], r[:, 1:])
+    lines[np.arange(y.shape[1] - 1)[None, :] >= (n - 1)[:, None]] = np.nan
+    return lines
+
+
+# m, b of tangent lines (x1, y1, x2, y2) in the last axis
+def _lineMB(lines):
+    m = (lines[..., 3] - lines[..., 1]) / (lines[..., 2] - lines[..., 0])
+    return m, lines[..., 1] - m * lines[..., 0]
+
+
+# chi2 of lines m, b (nRows, ...) w.r.t. the eval hits of each row (nRows, nEval), accumulated hit by hit
+# nan chi2 (bad lines) are set to inf
+def _lineChi2(m, b, evalY, evalZ, evalR, evalSigma, evalN):
+    shape = m.shape
+    m, b = m.reshape(shape[0], -1), b.reshape(shape[0], -1)
+    norm = 1. / np.sqrt(m ** 2 + 1)
+    # padding hits get weight 0
+    evalOK = np.arange(evalY.shape[1])[None, :] < evalN[:, None]
+    y = np.where(evalOK, evalY, 0.)
+    z = np.where(evalOK, evalZ, 0.)
+    r = np.where(evalOK, evalR, 0.)
+    w = np.where(evalOK, 1. / evalSigma ** 2, 0.)
+    chi2 = np.zeros_like(m)
+    for k in range(evalY.shape[1]):
+        rTrk = m * y[:, k, None]
+        rTrk -= z[:, k, None]
+        rTrk += b
+        np.abs(rTrk, out=rTrk)
+        rTrk *= norm
+        np.subtract(r[:, k, None], rTrk, out=rTrk)
+        rTrk *= rTrk
+        rTrk *= w[:, k, None]
+        chi2 += rTrk
+    chi2 /= (evalN - 1)[:, None]
+    chi2[np.isnan(chi2)] = np.inf
+    return chi2.reshape(shape)
+
+
+# minimum chi2 tangent line of each row, first one in (pair, line) order as in the loop version
+# returns flag, m, b and index of the line in the flattened (pair, line) table
+def _bestLine(chi2, m, b, chi2Max):
+    nRows = chi2.shape[0]
+    chi2, m, b = chi2.reshape(nRows, -1), m.reshape(nRows, -1), b.reshape(nRows, -1)
+    best = np.argmin(chi2, axis=1)
+    rows = np.arange(nRows)
+    min_m = m[rows, best]
+    min_b = b[rows, best]
+    flag = (chi2[rows, best] < chi2Max) & (min_m != 0.) & (min_b != 0.)
+    return flag, min_m, min_b, best
+
+
+# approaching points of the hit circles to the min chi2 line : closest of the end points of the pair before
+# and the start points of the pair after
+# q : hits (nRows, nq) to compute, default all hits of the pair table, nan outside the table
+def _approachPoints(lines, min_m, min_b, q=None):
+    nRows, nPairs = lines.shape[:2]
+    if q is None:
+        q = np.broadcast_to(np.arange(nPairs + 1), (nRows, nPairs + 1))
+    rows = np.arange(nRows)[:, None]
+    before = lines[rows, np.clip(q - 1, 0, nPairs - 1)]
+    after = lines[rows, np.clip(q, 0, nPairs - 1)]
+    beforeOK = ((q >= 1) & (q <= nPairs))[..., None]
+    afterOK = ((q >= 0) & (q < nPairs))[..., None]
+    apX = np.concatenate([np.where(beforeOK, before[..., 2], np.nan), np.where(afterOK, after[..., 0], np.nan)],
+                         axis=-1)
+    apY = np.concatenate([np.where(beforeOK, before[..., 3], np.nan), np.where(afterOK, after[..., 1], np.nan)],
+                         axis=-1)
+    d = mdtCalib_functions.distLines(apX, apY, min_m[:, None, None], min_b[:, None, None])
+    index = np.argmin(np.where(np.isnan(d), np.inf, d), axis=2)
+    xxx = np.take_along_axis(apX, index[..., None], axis=2)[..., 0]
+    yyy = np.take_along_axis(apY, index[..., None], axis=2)[..., 0]
+    return xxx, yyy
+
+
+# core of reconStraightLine_minChi2 for a batch of hit sets
+# fit* : hits used for tangent lines (nRows, nFit), eval* : hits used for chi2 (nRows, nEval)
+# returns flag, m, b of the refitted line, vertical line m = inf at x = b
+def _refitKernel(fitY, fitZ, fitR, fitN, evalY, evalZ, evalR, evalSigma, evalN, chi2Max):
+    nRows, width = fitY.shape
+    if width < 2:
+        return np.zeros(nRows, dtype=bool), np.zeros(nRows), np.zeros(nRows)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        lines = _pairLines(fitY, fitZ, fitR, fitN)
+        m, b = _lineMB(lines)
+        chi2 = _lineChi2(m, b, evalY, evalZ, evalR, evalSigma, evalN)
+        flag, min_m, min_b, _ = _bestLine(chi2, m, b, chi2Max)
+        xxx, yyy = _approachPoints(lines, min_m, min_b)
+        # closed form straight line fit of approaching points (same as np.polyfit(xxx, yyy, 1))
+        m_refit, b_refit = mdtCalib_functions.fitLines(xxx, yyy)
+
+    # vertical refitted lines (m = inf, x = b) are valid
+    flag &= ~np.isnan(m_refit) & np.isfinite(b_refit)
+    return flag, m_refit, b_refit
+
+
+# core of the combined refit for a batch of segments (nSeg, maxHits), radial = |mdt_r|
+# the tangent lines of all consecutive hit pairs and their chi2 are computed once and shared by the biased
+# refit and all unbias refits : removing hit j only replaces pairs (j-1, j) and (j, j+1) by the bridge pair
+# (j-1, j+1), and if the min chi2 line is unchanged the final line fit of the full hit set is downdated
+# (approaching points of hits j-1, j, j+1 removed, new ones of hits j-1, j+1 added) instead of refitted
+# returns flag, m, b of the biased refit and padded unbias rTrk
+def _combinedKernel(locY, locZ, radial, nHits, resSigma, maxRadius):
+    nSeg, width = locY.shape
+    unbias_rTrk = np.full((nSeg, width), -99.)
+    unbias_rTrk[np.arange(width)[None, :] >= nHits[:, None]] = np.nan
+    if width < 2:
+        return np.zeros(nSeg, dtype=bool), np.zeros(nSeg), np.zeros(nSeg), unbias_rTrk
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # shared tangent lines (unbias refit uses the unclipped radius) and chi2 w.r.t. all hits
+        lines = _pairLines(locY, locZ, radial, nHits)
+        m, b = _lineMB(lines)
+        chi2 = _lineChi2(m, b, locY, locZ, radial, resSigma, nHits)
+        _, ref_m, ref_b, refBest = _bestLine(chi2, m, b, np.inf)
+        refX, refY = _approachPoints(lines, ref_m, ref_b)
+
+        # biased refit on the radius clipped at maxRadius, only pairs with a clipped hit get new tangent lines
+        clipped = radial > maxRadius
+        pairOK = np.arange(width - 1)[None, :] < (nHits - 1)[:, None]
+        s, p = np.nonzero((clipped[:, :-1] | clipped[:, 1:]) & pairOK)
+        if len(s) > 0:
+            r = np.minimum(radial, maxRadius)
+            linesB, mB, bB, chi2B = lines.copy(), m.copy(), b.copy(), chi2.copy()
+            linesB[s, p] = mdtCalib_functions.tangentLines(locY[s, p], locZ[s, p], r[s, p],
+                                                           locY[s, p + 1], locZ[s, p + 1], r[s, p + 1])
+            mB[s, p], bB[s, p] = _lineMB(linesB[s, p])
+            chi2B[s, p] = _lineChi2(mB[s, p], bB[s, p], locY[s], locZ[s], radial[s], resSigma[s], nHits[s])
+            flag, min_m, min_b, _ = _bestLine(chi2B, mB, bB, 9990.)
+            xxx, yyy = _approachPoints(linesB, min_m, min_b)
+        else:
+            flag, min_m, min_b, _ = _bestLine(chi2, m, b, 9990.)
+            xxx, yyy = refX, refY
+        m_refit, b_refit = mdtCalib_functions.fitLines(xxx, yyy)
+        flag &= ~np.isnan(m_refit) & np.isfinite(b_refit)
+
+        # (segment, removed hit) rows of segments with at least 4 hits
+        seg, hit = np.nonzero((np.arange(width)[None, :] < nHits[:, None]) & (nHits[:, None] >= 4))
+        if width < 4 or len(seg) == 0:
+            return flag, m_refit, b_refit, unbias_rTrk
+        nRows, nPairs = len(seg), width - 1
+        rows = np.arange(nRows)
+
+        # bridge pair (j-1, j+1) tangent lines and chi2, nan if hit j is the first or last hit
+        bridgeLines = np.full((nRows, 4, 4), np.nan)
+        bridge = np.nonzero((hit >= 1) & (hit <= nHits[seg] - 2))[0]
+        sb, jb = seg[bridge], hit[bridge]
+        bridgeLines[bridge] = mdtCalib_functions.tangentLines(locY[sb, jb - 1], locZ[sb, jb - 1], radial[sb, jb - 1],
+                                                              locY[sb, jb + 1], locZ[sb, jb + 1], radial[sb, jb + 1])
+        bridgeM, bridgeB = _lineMB(bridgeLines)
+        bridgeChi2 = np.full((nRows, 4), np.inf)
+        bridgeChi2[bridge] = _lineChi2(bridgeM[bridge], bridgeB[bridge], locY[sb], locZ[sb], radial[sb],
+                                       resSigma[sb], nHits[sb])
+
+        # chi2 table of the remaining hit pairs : pairs before hit j, bridge pair in slot j-1, pairs after
+        slot = np.arange(nPairs - 1)[None, :]
+        pairIdx = np.where(slot < (hit - 1)[:, None], slot, slot + 1)
+        chi2R = chi2[seg[:, None], pairIdx]
+        chi2R[bridge, jb - 1] = bridgeChi2[bridge]
+        best = np.argmin(chi2R.reshape(nRows, -1), axis=1)
+        bestSlot, bestLine = best // 4, best % 4
+        isBridge = bestSlot == hit - 1
+        bestPair = np.where(bestSlot < hit - 1, bestSlot, bestSlot + 1)
+        um = np.where(isBridge, bridgeM[rows, bestLine], m[seg, np.minimum(bestPair, nPairs - 1), bestLine])
+        ub = np.where(isBridge, bridgeB[rows, bestLine], b[seg, np.minimum(bestPair, nPairs - 1), bestLine])
+        uflag = (chi2R[rows, bestSlot, bestLine] < 999.) & (um != 0.) & (ub != 0.)
+
+        # min chi2 line unchanged (same shared pair and line as the full hit set) : downdate the line fit sums,
+        # only hits j-1 and j+1 get new approaching points, from the pairs (j-2, j-1), bridge, (j+1, j+2)
+        same = ~isBridge & (bestPair * 4 + bestLine == refBest[seg])
+        x0, y0 = locY[seg, 0], locZ[seg, 0]
+        refSums = np.stack(mdtCalib_functions.lineSums(refX, refY, None, locY[:, 0], locZ[:, 0]), axis=-1)
+        sums = np.zeros((nRows, 6))
+        d = np.nonzero(same)[0]
+        if len(d) > 0:
+            old = hit[d, None] + np.arange(-1, 2)[None, :]
+            oldOK = (old >= 0) & (old < width)
+            old = np.clip(old, 0, width - 1)
+            oldX = np.where(oldOK, refX[seg[d, None], old], np.nan)
+            oldY = np.where(oldOK, refY[seg[d, None], old], np.nan)
+            near = hit[d, None] + np.array([-2, 1])[None, :]
+            nearOK = ((near >= 0) & (near < nPairs))[..., None, None]
+            near = lines[seg[d, None], np.clip(near, 0, nPairs - 1)]
+            local = np.stack([np.where(nearOK[:, 0], near[:, 0], np.nan), bridgeLines[d],
+                              np.where(nearOK[:, 1], near[:, 1], np.nan)], axis=1)
+            newX, newY = _approachPoints(local, um[d], ub[d], np.broadcast_to(np.array([1, 2]), (len(d), 2)))
+            sums[d] = refSums[seg[d]] \
+                - np.stack(mdtCalib_functions.lineSums(oldX, oldY, None, x0[d], y0[d]), axis=-1) \
+                + np.stack(mdtCalib_functions.lineSums(newX, newY, None, x0[d], y0[d]), axis=-1)
+
+        # min chi2 line changed : approaching points of all remaining hits
+        c = np.nonzero(~same)[0]
+        if len(c) > 0:
+            linesR = lines[seg[c, None], pairIdx[c]]
+            cb = np.nonzero(np.isin(c, bridge))[0]
+            linesR[cb, hit[c[cb]] - 1] = bridgeLines[c[cb]]
+            xxx, yyy = _approachPoints(linesR, um[c], ub[c])
+            sums[c] = np.stack(mdtCalib_functions.lineSums(xxx, yyy, None, x0[c], y0[c]), axis=-1)
+        um, ub = mdtCalib_functions.linesFromSums(sums.T, x0, y0)
+        uflag &= ~np.isnan(um) & np.isfinite(ub)
+        rTrk_j = mdtCalib_functions.distLines(locY[seg, hit], locZ[seg, hit], um, ub)
+        unbias_rTrk[seg, hit] = np.where(uflag, rTrk_j, -99.)
+    return flag, m_refit, b_refit, unbias_rTrk
+
+
+# batch refit, same as xMdtSegment.applyRefitSegment for every segment
+# inputs are padded (nSegments, maxHits) arrays, nHits and default line m_def, b_def per segment
+# returns refitFlag, chi2_refit, chi2_def, rTrk_refit (padded), m_refit, b_refit
+def applyRefitSegments(locY, locZ, radial, rTrk, nHits, resolution_constants, chamber, m_def, b_def,
+                       chunkSize=4096):
+    locY, locZ = np.asarray(locY, dtype=float), np.asarray(locZ, dtype=float)
+    radial, rTrk = np.asarray(radial, dtype=float), np.asarray(rTrk, dtype=float)
+    nHits = np.asarray(nHits)
+    nSeg, width = locY.shape
+
+    # set maxRadius
+    maxRadius = 14.6
+    if chamber[:3] in ['BMG', 'BME']:
+        maxRadius = 7.1
+
+    hitOK = np.arange(width)[None, :] < nHits[:, None]
+    resSigma = np.polyval(resolution_constants, np.abs(radial)) / 1000.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2_def = np.sum(np.where(hitOK, (np.abs(radial) - np.abs(rTrk)) ** 2 / resSigma ** 2, 0.), axis=1) / (
+                nHits - 1)
+    r = np.clip(np.abs(radial), a_min=0, a_max=maxRadius)
+
+    flag = np.zeros(nSeg, dtype=bool)
+    m_refit = np.zeros(nSeg)
+    b_refit = np.zeros(nSeg)
+    for start in range(0, nSeg, chunkSize):
+        sl = slice(start, start + chunkSize)
+        flag[sl], m_refit[sl], b_refit[sl] = _refitKernel(locY[sl], locZ[sl], r[sl], nHits[sl],
+                                                          locY[sl], locZ[sl], np.abs(radial[sl]), resSigma[sl],
+                                                          nHits[sl], 9990.)
+    return _refitResults(locY, locZ, radial, rTrk, hitOK, nHits, resSigma, chi2_def, flag, m_refit, b_refit,
+                         m_def, b_def)
+
+
+# refitted rTrk and chi2 of the refitted lines, default track and chi2 for failed refits
+def _refitResults(locY, locZ, radial, rTrk, hitOK, nHits, resSigma, chi2_def, flag, m_refit, b_refit, m_def, b_def):
+    rTrk_refit = mdtCalib_functions.distLines(locY, locZ, m_refit[:, None], b_refit[:, None])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2_refit = np.sum(np.where(hitOK, (np.abs(radial) - rTrk_refit) ** 2 / resSigma ** 2, 0.), axis=1) / (
+                nHits - 1)
+
+    # failed refit : keep default track and chi2
+    chi2_refit = np.where(flag, chi2_refit, chi2_def)
+    rTrk_refit = np.where(flag[:, None], rTrk_refit, rTrk)
+    rTrk_refit[~hitOK] = np.nan
+    m_refit = np.where(flag, m_refit, m_def)
+    b_refit = np.where(flag, b_refit, b_def)
+    return flag.astype(int), chi2_refit, chi2_def, rTrk_refit, m_refit, b_refit
+
+
+# batch unbias residual, same as xMdtSegment.applyUnbiasResidual for every segment
+# each hit is removed in turn, the track of the remaining hits gives the unbias rTrk of the removed hit
+# returns padded unbias rTrk, -99. for failed hits and segments with less than 4 hits
+def applyUnbiasResiduals(locY, locZ, radial, nHits, resolution_constants, chunkSize=4096):
+    locY, locZ = np.asarray(locY, dtype=float), np.asarray(locZ, dtype=float)
+    radial = np.abs(np.asarray(radial, dtype=float))
+    nHits = np.asarray(nHits)
+    nSeg, width = locY.shape
+    resSigma = np.polyval(resolution_constants, radial) / 1000.
+
+    unbias_rTrk = np.full((nSeg, width), -99.)
+    unbias_rTrk[np.arange(width)[None, :] >= nHits[:, None]] = np.nan
+    if width < 4:
+        return unbias_rTrk
+
+    # (segment, removed hit) rows, remaining hits keep their order
+    seg, hit = np.nonzero((np.arange(width)[None, :] < nHits[:, None]) & (nHits[:, None] >= 4))
+    keep = np.array([[k for k in range(width) if k != j] for j in range(width)])
+
+    for start in range(0, len(seg), chunkSize):
+        s, j = seg[start:start + chunkSize], hit[start:start + chunkSize]
+        cols = keep[j]
+        flag, m, b = _refitKernel(locY[s[:, None], cols], locZ[s[:, None], cols], radial[s[:, None], cols],
+                                  nHits[s] - 1, locY[s], locZ[s], radial[s], resSigma[s], nHits[s], 999.)
+        rTrk_j = mdtCalib_functions.distLines(locY[s, j], locZ[s, j], m, b)
+        unbias_rTrk[s, j] = np.where(flag, rTrk_j, -99.)
+    return unbias_rTrk
+
+
+# backend actually used for backend 'auto' / 'numpy' / 'numba' (rounding differs between the two backends, near-equal
+# candidate lines can then pick a different refit)
+def resolveBackend(backend='auto'):
+    if backend == 'auto':
+        return 'numba' if numbaRefit.available else 'numpy'
+    return backend
+
+
+# combined batch refit : applyRefitSegments and applyUnbiasResiduals in one pass sharing the tangent lines
+# returns refitFlag, chi2_refit, chi2_def, rTrk_refit (padded), m_refit, b_refit, unbias rTrk (padded)
+# backend : 'numpy', 'numba' (numbaRefit, compiled per segment kernel) or 'auto' (numba if installed)
+def applyCombinedRefit(locY, locZ, radial, rTrk, nHits, resolution_constants, chamber, m_def, b_def,
+                       chunkSize=1024, backend='auto'):
+    locY, locZ = np.asarray(locY, dtype=float), np.asarray(locZ, dtype=float)
+    radial, rTrk = np.asarray(radial, dtype=float), np.asarray(rTrk, dtype=float)
+    nHits = np.asarray(nHits)
+    nSeg, width = locY.shape
+
+    # set maxRadius
+    maxRadius = 14.6
+    if chamber[:3] in ['BMG', 'BME']:
+        maxRadius = 7.1
+
+    hitOK = np.arange(width)[None, :] < nHits[:, None]
+    resSigma = np.polyval(resolution_constants, np.abs(radial)) / 1000.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2_def = np.sum(np.where(hitOK, (np.abs(radial) - np.abs(rTrk)) ** 2 / resSigma ** 2, 0.), axis=1) / (
+                nHits - 1)
+
+    backend = resolveBackend(backend)
+    if backend == 'numba':
+        if not numbaRefit.available:
+            raise ImportError('numba backend requested but numba is not installed')
+        flag, m_refit, b_refit, unbias_rTrk = numbaRefit.combinedKernel(
+            np.ascontiguousarray(locY), np.ascontiguousarray(locZ), np.ascontiguousarray(np.abs(radial)),
+            np.ascontiguousarray(nHits, dtype=np.int64), np.ascontiguousarray(resSigma), maxRadius)
+    else:
+        flag = np.zeros(nSeg, dtype=bool)
+        m_refit = np.zeros(nSeg)
+        b_refit = np.zeros(nSeg)
+        unbias_rTrk = np.full((nSeg, width), np.nan)
+        for start in range(0, nSeg, chunkSize):
+            sl = slice(start, start + chunkSize)
+            flag[sl], m_refit[sl], b_refit[sl], unbias_rTrk[sl] = _combinedKernel(locY[sl], locZ[sl],
+                                                                                  np.abs(radial[sl]), nHits[sl],
+                                                                                  resSigma[sl], maxRadius)
+    return _refitResults(locY, locZ, radial, rTrk, hitOK, nHits, resSigma, chi2_def, flag, m_refit, b_refit,
+                         m_def, b_def) + (unbias_rTrk,)
+
+
+# batch refitSegment for a chamber dataframe, same outputs as new_mdtCalib_functions.refitSegment for each row
+def refitSegments(df, resolution_constants, chamber, backend='auto'):
+    locY, locZ, radial, rTrk, nHits = padSegments(df, ['mdt_posY', 'mdt_posZ', 'mdt_r', 'mdt_rTrk'])
+    m_def = df.seg_dirZ.values.astype(float) / df.seg_dirY.values.astype(float)
+    b_def = df.seg_posZ.values.astype(float) - m_def * df.seg_posY.values.astype(float)
+
+    flag, chi2_new, chi2_def, rTrk_new, refit_m, refit_b, unbias_rTrk_new = applyCombinedRefit(
+        locY, locZ, radial, rTrk, nHits, resolution_constants, chamber, m_def, b_def, backend=backend)
+    return flag, rTrk_new, chi2_new, chi2_def, refit_m, refit_b, unbias_rTrk_new
+
+
+# names of the refitSegments outputs, per hit outputs are the ragged columns of refitColumns
+refitNames = ['flag', 'rTrk_new', 'chi2_new', 'chi2_def', 'refit_m', 'refit_b', 'unbias_rTrk_new']
+refitHitNames = ['rTrk_new', 'unbias_rTrk_new']
+
+
+# refitSegments outputs as columnarCache.SegmentColumns (per hit outputs as flat array + offsets, no padding)
+# and validity mask : segments with a successful unbias refit of the first hit (unbias_rTrk_new != -99)
+def refitColumns(results, nHits):
+    nHits = np.asarray(nHits)
+    padded = dict(zip(refitNames, results))
+    hitOK = np.arange(padded['rTrk_new'].shape[1])[None, :] < nHits[:, None]
+    offsets = columnarCache.countsToOffsets(nHits)
+    values = {name: padded[name][hitOK] if name in refitHitNames else np.asarray(padded[name])
+              for name in refitNames}
+    valid = nHits > 0
+    valid[valid] = padded['unbias_rTrk_new'][valid, 0] != -99.
+    return columnarCache.SegmentColumns(refitNames, values, {name: offsets for name in refitHitNames}), valid
+
+
+# valid refit results joined to the rows of the input dataframe in one step, index of df kept
+# columns : refit columns put in front of the df columns, per hit columns as python lists (same csv output as lists)
+def joinRefit(df, refit, valid, columns=('rTrk_new', 'unbias_rTrk_new')):
+    valid = np.asarray(valid, dtype=bool)
+    refit = refit.select(valid)
+    out = pd.DataFrame({name: [x.tolist() for x in refit.lists(name)] if refit.isList(name) else refit[name]
+                        for name in columns}, index=df.index[valid])
+    return pd.concat([out, df[valid]], axis=1)
@@ -0,0 +1,87 @@
+import sys, time
+import numpy as np
+import batchRefit
+import numbaRefit
+
+
+# benchmark of the batch refit backends (batchRefit.applyCombinedRefit, biased + unbias refit)
+# segments/second per core for the NumPy and Numba backends on BMG (sMDT) and MDT geometries,
+# straight tracks through two multilayers of tubes with smeared drift radius (no data file needed)
+#
+#  How to use:
+# python benchRefit.py            (20000 segments per geometry)
+# python benchRefit.py 100000
+# import benchRefit; benchRefit.runBenchmark(nSeg=20000)
+
+# chamber name, tube pitch, tube radius, layers per multilayer, multilayer distance
+geometries = {'BMG': ('BMG2A12', 15.1, 7.1, 4, 120.), 'MDT': ('BIL1A01', 30.035, 14.6, 3, 200.)}
+resolution_constants = np.array([0.009309617147272093, -0.40905983591204315, 6.99468028874082,
+                                 -55.80165565801746, 240.02565308413241])
+
+
+# synthetic padded segments (locY, locZ, radial, rTrk, nHits, m_def, b_def) of a geometry
+def makeSegments(nSeg, geometry='BMG', seed=1):
+    chamber, pitch, radius, nLayers, mlDistance = geometries[geometry]
+    rng = np.random.default_rng(seed)
+    layerZ = np.array([ml * mlDistance + ly * pitch * 0.866 + 20 for ml in range(2) for ly in range(nLayers)])
+    offset = np.array([0 if il % 2 == 0 else pitch / 2 for il in range(len(layerZ))])
+
+    # track y = y0 + t * z, the crossed tube of every layer
+    y0 = rng.uniform(200, 600, nSeg)[:, None]
+    t = rng.uniform(-0.5, 0.5, nSeg)[:, None]
+    tubeY = offset + np.round((y0 + t * layerZ - offset) / pitch) * pitch
+    d = np.abs(tubeY - y0 - t * layerZ) / np.sqrt(1 + t * t)
+    r = np.abs(d + rng.normal(0, 0.1, d.shape))
+    r = np.where(rng.random(d.shape) < 0.9, r, -r)
+
+    # hits inside the tube radius, packed to the left
+    hit = d <= radius
+    nHits = np.sum(hit, axis=1)
+    order = np.argsort(~hit, axis=1, kind='stable')
+    locY, locZ, radial, rTrk = [batchRefit.padFlat(np.take_along_axis(x, order, axis=1)[
+        np.arange(x.shape[1])[None, :] < nHits[:, None]], nHits)
+        for x in (tubeY, np.broadcast_to(layerZ, d.shape), r, d)]
+    keep = nHits >= 2
+    m_def = 1. / t[keep, 0]
+    b_def = -y0[keep, 0] * m_def
+    return chamber, locY[keep], locZ[keep], radial[keep], rTrk[keep], nHits[keep], m_def, b_def
+
+
+# segments/second of one backend, best of nRepeat
+def timeBackend(segments, backend, nRepeat=3):
+    chamber, locY, locZ, radial, rTrk, nHits, m_def, b_def = segments
+    best = np.inf
+    for _ in range(nRepeat):
+        start = time.perf_counter()
+        batchRefit.applyCombinedRefit(locY, locZ, radial, rTrk, nHits, resolution_constants, chamber, m_def, b_def,
+                                      backend=backend)
+        best = min(best, time.perf_counter() - start)
+    return len(nHits) / best
+
+
+# segments/second per core of all available backends and geometries
+# the NumPy backend runs on one core, Numba on numbaRefit threads (also timed with 1 thread)
+def runBenchmark(nSeg=20000, nRepeat=3):
+    results = {}
+    for geometry in geometries:
+        segments = makeSegments(nSeg, geometry)
+        results[(geometry, 'numpy', 1)] = timeBackend(segments, 'numpy', nRepeat)
+        if numbaRefit.available:
+            # compile outside of the timing
+            timeBackend(tuple(x[:10] if isinstance(x, np.ndarray) else x for x in segments), 'numba', 1)
+            nThreads = numbaRefit.numba.get_num_threads()
+            numbaRefit.numba.set_num_threads(1)
+            results[(geometry, 'numba', 1)] = timeBackend(segments, 'numba', nRepeat)
+            numbaRefit.numba.set_num_threads(nThreads)
+            results[(geometry, 'numba', nThreads)] = timeBackend(segments, 'numba', nRepeat) / nThreads
+
+    print('%-4s %-6s %8s %16s' % ('geom', 'backend', 'threads', 'segments/s/core'))
+    for (geometry, backend, nThreads), rate in results.items():
+        print('%-4s %-6s %8d %16.0f' % (geometry, backend, nThreads, rate))
+    if not numbaRefit.available:
+        print('numba not installed, numba backend skipped')
+    return results
+
+
+if __name__ == '__main__':
+    runBenchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
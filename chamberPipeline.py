@@ -0,0 +1,189 @@
+import os, glob
+import numpy as np
+import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+import mdtCalib_functions
+import columnarCache
+import batchRefit
+import efficiency
+import residualFit
+import rootReader
+import rtTable
+import segmentCuts
+
+
+# parallel per-chamber analysis driver
+# every chamber file is one task of a ProcessPoolExecutor : load (columnar cache), cuts, refit if needed,
+# 5sigma/hardware efficiency and residual/resolution per radius slice
+# tasks return small numpy result dicts, all plotting is done in the parent process
+#
+#  How to use:
+# import chamberPipeline
+# results = chamberPipeline.runPipeline(glob.glob('dataConverted/run437124_region*_*.csv'), maxWorkers=32)
+# chamberPipeline.plotEfficiency(results, 'eff5', 'Run437124_5SigmaEfficiency_forall')
+# results = chamberPipeline.runRootPipeline(glob.glob('rootdata/skimmed_ntuple_run437124_lb*_region0051.root'))
+
+
+# chamber type constants, same as the efficiency scripts
+def chamberConstants(chamber):
+    maxRadius, maxDriftTime, step, npad = 14.6, 800.0, 1, 16
+    if chamber[:3] in ['BME', 'BMG']:
+        maxRadius, maxDriftTime, step, npad = 7.1, 200.0, 1, 8
+    return maxRadius, maxDriftTime, step, npad
+
+
+# chamber segment cuts : seg_chi2 < minChi2, all drift times in time window and nHits cut
+# (segmentCuts 'efficiency' preset)
+def applyCuts(seg, chamber, minChi2=1000):
+    seg, flow = segmentCuts.applyPreset(seg, chamber, 'efficiency', chi2=(None, minChi2))
+    return seg
+
+
+# refitted and unbias track radius for all hits (flat arrays), from the file if already refitted
+def refitTracks(seg, chamber, resolution_constants):
+    if 'rTrk_new' in seg and 'unbias_rTrk_new' in seg:
+        return seg.flat('rTrk_new'), seg.flat('unbias_rTrk_new')
+
+    nHits = seg.counts('mdt_r')
+    locY, locZ, radial, rTrk = [batchRefit.padFlat(seg.flat(col), nHits)
+                                for col in ['mdt_posY', 'mdt_posZ', 'mdt_r', 'mdt_rTrk']]
+    m_def = seg['seg_dirZ'] / seg['seg_dirY']
+    b_def = seg['seg_posZ'] - m_def * seg['seg_posY']
+    _, _, _, rTrk_new, _, _, unbias_rTrk_new = batchRefit.applyCombinedRefit(locY, locZ, radial, rTrk, nHits,
+                                                                             resolution_constants, chamber,
+                                                                             m_def, b_def)
+    hitOK = np.arange(locY.shape[1])[None, :] < nHits[:, None]
+    return rTrk_new[hitOK], unbias_rTrk_new[hitOK]
+
+
+# segments of a chamber from a dataConverted csv/npz file, or from ROOT ntuple files (list or .root file)
+def loadChamber(file, chamber):
+    if not isinstance(file, str) or file.endswith('.root'):
+        return rootReader.readChamber(file, chamber)
+    return columnarCache.loadSegments(file)
+
+
+# one chamber task, runs in a worker process
+# chamber : hardname, default taken from the dataConverted file name
+# newRtDb : calibration file to recompute mdt_r from mdt_t with (rtTable), default the radius of the ntuple,
+# its resolution constants then replace the ones of rtDb
+# seg : segments of the chamber already read (SegmentColumns), file is then only reported in the result
+def processChamber(file, chamber=None, rtDb='UM6608_RtResFit.csv', minChi2=1000, minSegments=500, newRtDb=None,
+                   seg=None):
+    if chamber is None:
+        chamber = file[-11:-4]
+    result = {'file': file, 'chamber': chamber, 'nSegments': 0}
+
+    if seg is None:
+        seg = loadChamber(file, chamber)
+    if len(seg) == 0:
+        return result
+    seg = applyCuts(seg, chamber, minChi2)
+    if newRtDb is not None:
+        seg = rtTable.recalibrateSegments(seg, chamber, newRtDb)
+        rtDb = newRtDb
+    result['nSegments'] = len(seg)
+    if len(seg) <= minSegments:
+        return result
+
+    splitDriftTime, zs, zl, resolution_constants = mdtCalib_functions.getRtRes(rtDb, chamber)
+    maxRadius, maxDriftTime, step, npad = chamberConstants(chamber)
+
+    f_r = seg.flat('mdt_r')
+    f_new, f_unbias = refitTracks(seg, chamber, resolution_constants)
+    resi_new = np.abs(f_r) - np.abs(f_new)
+    resi_unbias = np.abs(f_r) - np.abs(f_unbias)
+    resSigma = np.polyval(resolution_constants, np.abs(f_new)) / 1000.
+
+    # efficiency per radius slice
+    edges = efficiency.radiusSlices(maxRadius, step)
+    startSlice, stopSlice = edges[:-1], edges[1:]
+    flags = efficiency.efficiencyFlags(resi_unbias, resSigma, f_unbias, maxRadius, nSigma=[3, 5])
+    eff = efficiency.binnedEfficiency(flags, f_new, edges)
+
+    # residual histograms and fits per radius slice, R = sqrt(sigma_bias * sigma_unbias)
+    sliceIdx = efficiency.sliceIndex(f_new, edges)
+    fit_bias = residualFit.fitResidualSlices(f_new, resi_new, chamber, step, sliceIdx=sliceIdx)
+    fit_unbias = residualFit.fitResidualSlices(f_new, resi_unbias, chamber, step, sliceIdx=sliceIdx)
+    histBias, histUnbias = fit_bias['hist'], fit_unbias['hist']
+    sigmaBias, sigmaUnbias = fit_bias['fits'][:, 9], fit_unbias['fits'][:, 9]
+    res_chamber = residualFit.chamberResolution(resi_new, resi_unbias)
+
+    result.update({'startSlice': startSlice, 'stopSlice': stopSlice, 'nHits': eff['nHits'],
+                   'eff3': eff['sigma3'], 'eff3_err': eff['sigma3_err'], 'eff5': eff['sigma5'],
+                   'eff5_err': eff['sigma5_err'], 'effHardware': eff['hardware'],
+                   'effHardware_err': eff['hardware_err'],
+                   'histBias': histBias, 'histUnbias': histUnbias, 'sigmaBias': sigmaBias,
+                   'sigmaUnbias': sigmaUnbias, 'resolution': np.sqrt(sigmaBias * sigmaUnbias),
+                   'res_chamber': res_chamber})
+    return result
+
+
+# fan chamber files out to a process pool, one chamber per task, results in input order
+def runPipeline(files, maxWorkers=None, **kwargs):
+    files = list(files)
+    if maxWorkers is None:
+        maxWorkers = os.cpu_count()
+    maxWorkers = max(1, min(maxWorkers, len(files)))
+    if maxWorkers == 1:
+        return [processChamber(file, **kwargs) for file in files]
+    with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+        futures = [executor.submit(processChamber, file, **kwargs) for file in files]
+        return [future.result() for future in futures]
+
+
+# same as runPipeline directly from ROOT ntuple files, one task per chamber
+# the files are read once (rootReader.readChambers), every task gets the segments of its chamber
+# chambers : hardnames, default the chambers of the splitter region in the file names, or all chambers found in
+# the files if the file names have no region
+def runRootPipeline(rootFiles, chambers=None, maxWorkers=None, **kwargs):
+    rootFiles = sorted(rootFiles)
+    if chambers is None:
+        chambers = rootReader.regionChambers(rootFiles)
+    segments = rootReader.readChambers(rootFiles, chambers)
+    if chambers is None:
+        chambers = sorted(segments)
+    empty = columnarCache.SegmentColumns([], {}, {})
+    if maxWorkers is None:
+        maxWorkers = os.cpu_count()
+    maxWorkers = max(1, min(maxWorkers, len(chambers)))
+    if maxWorkers == 1:
+        return [processChamber(rootFiles, chamber, seg=segments.get(chamber, empty), **kwargs)
+                for chamber in chambers]
+    with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+        futures = [executor.submit(processChamber, rootFiles, chamber, seg=segments.get(chamber, empty), **kwargs)
+                   for chamber in chambers]
+        return [future.result() for future in futures]
+
+
+# efficiency vs radius of all chambers, key = 'eff3', 'eff5' or 'effHardware'
+def plotEfficiency(results, key, title):
+    color = ['red', 'orange', 'gold', 'lawngreen', 'darkgreen', 'aqua', 'teal', 'slategrey', 'dodgerblue', 'blue',
+             'navy', 'darkviolet']
+    fig, ax = plt.subplots(figsize=(10, 8))
+    plt.subplots_adjust(top=0.93, bottom=0.15, left=0.12, right=0.98, wspace=0.2, hspace=0.2)
+    for num, result in enumerate(results):
+        if key not in result:
+            continue
+        ax.errorbar(np.arange(len(result[key])), result[key], yerr=result[key + '_err'], fmt='^',
+                    color=color[num % len(color)], markersize=4, label='{0} chamber'.format(result['chamber']))
+    ax.set_ylabel('Efficiency %', fontsize=15)
+    ax.set_xlabel('Raidus [mm]', fontsize=15)
+    ax.set_ylim(50, 105)
+    ax.set_yticks(np.arange(50, 101, step=5))
+    ax.grid()
+    ax.legend(fontsize=10)
+    plt.suptitle(title, fontsize=20)
+    plt.savefig(title)
+    return fig, ax
+
+
+if __name__ == '__main__':
+    run = '437124'
+    data = sorted(glob.glob('dataConverted/run%s_region*_*.csv' % run))
+    results = runPipeline(data)
+    for result in results:
+        print(run, result['chamber'], result['nSegments'], result.get('res_chamber'))
+    plotEfficiency(results, 'eff5', 'Run%s_5SigmaEfficiency_forall' % run)
+    plotEfficiency(results, 'effHardware', 'Run%s_HardwareEfficiency_forall' % run)
+    plt.show()
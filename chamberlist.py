@@ -10,6 +10,12 @@
 #  CheckChamber( chamber, ml, layer, tube )   => Check for valid
 #                   chamber name. Returns mdt[] index of chamber
 #  MDTindex( ChName/muonfixedid ) => Returns index in mdt[] for ChName or muonfixedid
+#  MDTindexArray( names )   => Returns mdt[] index array of an array of hardnames/calnames (-1 = unknown)
+#  MDTindexMfid( mfids )    => Returns mdt[] index array of an array of muonfixedids (-1 = no chamber)
+#  MDTvalidTubes( idx, ml, layer, tube ) => Returns bool array, CheckChamber of arrays of mdt[] index, ml, ly, tb
+#  MDTmfidArray( tubeNames ) => Returns muonfixedid array of tube names 'BMG2A12-1-2-3' (-1 = not a tube name)
+#  mdtTable                 => mdt[] as structured numpy array (fields as ChInfo), e.g. mdtTable['ntl_ml1'][idx]
+#  chamber names and (station, phi, eta) are looked up in dictionaries built at import, no scan of mdt[]
 #  MDTmfid( ChName, ml=1, ly=1, tb=1 ) => Returns muonfixedid for ChName.
 #    or MDTmfid( ChName, mllt ) => Returns muonfixedid for ChName.
 #  MDTcheckMfid( mfid )     => Returns MDTindex if mfid is valid; -1 if not
@@ -43,10 +49,17 @@
 #  MDTtubeIndex(ChName, ml,ly,tube )    => Calculate the tube Index by ml,ly,tube
 #  MDTtubeIndex2MLLT(ChName, tubeIndex )    => Calculate the MLLT by tubeIndex
 #  MDTasdIndex(muonfixedid)    => Calculate the ASD index by muonfixedid, #ASD = idx*1000+#Mezz*10+#ASD (1,2,3)
+#  Vectorized versions over tube arrays (idx = mdt[] index array, e.g. from MDTindexArray / MDTindexMfid):
+#  MLLT2Marray( idx, ml, ly, tb )      => mezzNumber array
+#  T2Marray( idx, tube )               => mezzNumber array from tubeNumber
+#  MLLT2MezzChArray( idx, ml, ly, tb ) => tuple of mezzcard type and mezzcard channel arrays
+#  MDTasdIndexArray( muonfixedids )    => ASD index array
+#  mezzLookup()                        => dense [idx, ml, ly, tb] lookup arrays behind them
 #
 #  Number of mezzcards per ML
 #  ntl_ml1(2)/24/nly_ml1(2) or ntl_ml1(2)/(mzt_ml1(2)<3?8:6)
 import sys, muonfixedid
+import numpy as np
 
 
 class ChInfo:
@@ -1265,6 +1278,31 @@ mdt = [
 ]
 MAXCHAMBERS = len(mdt)
 
+# lookup dictionaries built once : hardname and calname -> mdt[] index, (station, phi, eta) -> mdt[] index
+# first entry wins for repeated keys, as the former scan of mdt[]
+chamberNameIndex = {}
+chamberStationIndex = {}
+for _ii, _ch in enumerate(mdt):
+    chamberNameIndex.setdefault(_ch.hardname, _ii)
+    chamberNameIndex.setdefault(_ch.calname, _ii)
+    chamberStationIndex.setdefault((_ch.station, _ch.phi, _ch.eta), _ii)
+
+# mdt[] as structured numpy array, one row per chamber, fields as ChInfo, for vectorized geometry lookups
+# e.g. mdtTable['ntl_ml1'][MDTindexArray(names)]
+mdtTable = np.array([(ch.calname, ch.hardname, ch.eta, ch.phi, ch.station, ch.num_ml, ch.nly_ml1, ch.ntl_ml1,
+                      ch.nly_ml2, ch.ntl_ml2, ch.n_mezz, ch.mz0ml, ch.mzt_ml1, ch.mzt_ml2, ch.installed)
+                     for ch in mdt],
+                    dtype=[('calname', 'U10'), ('hardname', 'U7'), ('eta', 'i4'), ('phi', 'i4'), ('station', 'U3'),
+                           ('num_ml', 'i4'), ('nly_ml1', 'i4'), ('ntl_ml1', 'i4'), ('nly_ml2', 'i4'),
+                           ('ntl_ml2', 'i4'), ('n_mezz', 'i4'), ('mz0ml', 'i4'), ('mzt_ml1', 'i4'), ('mzt_ml2', 'i4'),
+                           ('installed', 'i4')])
+
+# mdt[] index of the station/phi/eta bits of a muonfixedid (bits 13..29), -1 for no chamber
+_mfidChamberBits = 17
+_mfidChamberIndex = np.full(1 << _mfidChamberBits, -1, dtype=np.int32)
+for _key, _ii in chamberStationIndex.items():
+    _mfidChamberIndex[(muonfixedid.ID(*_key) >> 13) & ((1 << _mfidChamberBits) - 1)] = _ii
+
 # List of chambers with cutouts
 cutout_chambers = ['BIR1A11', 'BIR1A15', 'BMS4C02', 'BMS4C04', 'BMS4C06', 'BMS4C08', 'BMS4C10', 'BMS4C16', 'BMS6C02',
                    'BMS6C04', 'BMS6C06', 'BMS6C08', 'BMS6C10', 'BMS6C16', 'BMG2A12', 'BMG2A14', 'BMG2C12', 'BMG2C14',
@@ -1385,15 +1423,58 @@ mezzcardtubes = (-1, 8, 8, 6, 6)
 #  Check for valid chamber name.
 #  Returns mdt[] index of chamber, else -1
 def CheckChamber(chamber, ml, layer, tube):
-    for ii in range(0, MAXCHAMBERS):
-        if (chamber == mdt[ii].hardname or chamber == mdt[ii].calname) and \
-                layer > 0 and tube > 0 and \
-                ((ml == 1 and layer <= mdt[ii].nly_ml1 and tube <= mdt[ii].ntl_ml1) or \
-                 (ml == 2 and layer <= mdt[ii].nly_ml2 and tube <= mdt[ii].ntl_ml2)):
-            return ii;
+    ii = chamberNameIndex.get(chamber, -1) if isinstance(chamber, str) else -1
+    if ii >= 0 and layer > 0 and tube > 0 and \
+            ((ml == 1 and layer <= mdt[ii].nly_ml1 and tube <= mdt[ii].ntl_ml1) or \
+             (ml == 2 and layer <= mdt[ii].nly_ml2 and tube <= mdt[ii].ntl_ml2)):
+        return ii
     return -1
 
 
+#  Vectorized MDTindex of an array of hardnames/calnames, -1 for unknown names
+def MDTindexArray(names):
+    names, inverse = np.unique(np.asarray(names, dtype=str), return_inverse=True)
+    idx = np.array([chamberNameIndex.get(name, -1) for name in names], dtype=np.int32)
+    return idx[inverse.reshape(-1)]
+
+
+#  Vectorized MDTindex of an array of muonfixedids (chamber of the station/phi/eta fields), -1 for no chamber
+def MDTindexMfid(mfids):
+    key = (np.asarray(mfids, dtype=np.int64) >> 13) & ((1 << _mfidChamberBits) - 1)
+    return _mfidChamberIndex[key]
+
+
+#  mdt[] index, ml, ly, tb of a tube name 'BMG2A12-1-2-3' (hardname or calname), (-1, 0, 0, 0) if not a tube name
+def _tubeNameFields(name):
+    parts = name.strip(" '\"").rsplit('-', 3)
+    try:
+        return chamberNameIndex.get(parts[0], -1), int(parts[1]), int(parts[2]), int(parts[3])
+    except (ValueError, IndexError):
+        return -1, 0, 0, 0
+
+
+#  Vectorized muonfixedid of an array of tube names 'BMG2A12-1-2-3' (mdt_tubeInfo hits), int32 array,
+#  -1 for unknown chambers and ml, ly, tb outside the muonfixedid fields, one parse per distinct tube name
+#  tubes outside the chamber geometry (fantom tubes of the database) keep their muonfixedid, see MDTvalidTubes
+def MDTmfidArray(tubeNames):
+    names, inverse = np.unique(np.asarray(tubeNames, dtype=str), return_inverse=True)
+    idx, ml, ly, tb = np.array([_tubeNameFields(name) for name in names], dtype=np.int64).reshape(-1, 4).T
+    geo = mdtTable[np.maximum(idx, 0)]
+    mfid = muonfixedid.ID(geo['station'], geo['phi'], geo['eta'], ml, ly, tb)
+    valid = (idx >= 0) & (ml >= 1) & (ml <= 2) & (ly >= 1) & (ly <= 4) & (tb >= 1) & (tb <= 128)
+    mfid = np.where(valid, mfid, -1).astype(np.int32)
+    return mfid[inverse.reshape(-1)]
+
+
+#  Vectorized CheckChamber of arrays of mdt[] index, ml, layer, tube : True for valid tubes
+def MDTvalidTubes(idx, ml, layer, tube):
+    idx, ml, layer, tube = [np.asarray(x, dtype=np.int64) for x in (idx, ml, layer, tube)]
+    geo = mdtTable[np.maximum(idx, 0)]
+    nly = np.where(ml == 1, geo['nly_ml1'], np.where(ml == 2, geo['nly_ml2'], 0))
+    ntl = np.where(ml == 1, geo['ntl_ml1'], np.where(ml == 2, geo['ntl_ml2'], 0))
+    return (idx >= 0) & (layer > 0) & (tube > 0) & (layer <= nly) & (tube <= ntl)
+
+
 #  Returns index in mdt[] for ChName
 def MDTindex(ChName):
     if type(ChName) is int:  # assume to be an index or muonfixedid if int
@@ -1413,8 +1494,8 @@ def MDTmfid(ChName, ml=1, ly=1, tb=1):
     # if ml > 1000 assume it is an MLLT
     if ml > 1000:
         mllt = ml
-        ml = mllt / 1000
-        ly = (mllt - ml * 1000) / 100
+        ml = mllt // 1000
+        ly = (mllt - ml * 1000) // 100
         tb = mllt - ml * 1000 - ly * 100
     # Check that ChName, ml,ly,tb are valid
     idx = CheckChamber(ChName, ml, ly, tb)
@@ -1604,8 +1685,8 @@ def MDTnTml(ChName, ml):
 # Convert MLLT to ml, ly, tb; Returns tuple ml, ly, tb
 def MLLT2MLLT(ChName, mllt):
     OK = 1
-    ml = mllt / 1000
-    ly = (mllt / 100) % 10
+    ml = mllt // 1000
+    ly = (mllt // 100) % 10
     nt = mllt % 100
     if mllt <= 0 or mllt > 2478:
         OK = 0
@@ -1634,7 +1715,7 @@ def T2MLLT(ChName, tb):
         ml = 2
         tb -= MDTnTml(ChName, 1)  # now tubenum in ML2
 
-    ly = 1 + tb / MDTnTly(ChName, ml)
+    ly = 1 + tb // MDTnTly(ChName, ml)
     if tb % MDTnTly(ChName, ml) == 0: ly -= 1
 
     nt = tb - (ly - 1) * MDTnTly(ChName, ml)  # now tubenum in that layer
@@ -1664,8 +1745,8 @@ def MLLT2M(ChName, mllt):
     imezz = -1
     ml, ly, nt = MLLT2MLLT(ChName, mllt)
     if ml != -1:
-        ntl_mez = 24 / MDTnLml(ChName, ml)
-        imezz = MDTnML(ChName) * ((nt - 1) / ntl_mez)
+        ntl_mez = 24 // MDTnLml(ChName, ml)
+        imezz = MDTnML(ChName) * ((nt - 1) // ntl_mez)
         if ml != MDTmlMZ0(ChName): imezz = imezz + 1
     return imezz
 
@@ -1676,6 +1757,52 @@ def T2M(ChName, tb):
     return MLLT2M(ChName, mllt)
 
 
+#  Mezzcard channel map (mezzchannelmap* table) of a chamber hardname
+def _mezzChannelMap(ChName):
+    # A/C sides are mirror images, use different maps
+    station = ChName[0:3]
+    LS = ChName[2]  # Could be L,S,E,M,R,F,G
+    side = ChName[4]
+    if ChName[0] == 'E' or ChName[1] == 'E':  # Endcap + BEE
+        if side == 'A':
+            return mezzchannelmapEA
+        else:
+            return mezzchannelmapEC
+    else:  # Barrel
+        # BIM1A11 uses C map     BIMxA11 use C map
+        if station == 'BIM' or station == 'BIR':
+            #      if station == 'BIR' and int(ChName[3]) > 2:
+            #        if side == 'A': return mezzchannelmapBIR3
+            #        else:           return mezzchannelmapEA
+
+            if ChName[5:7] == '11':  # BIMxx11, BIRxx11
+                if side == 'A':
+                    return mezzchannelmapBC
+                else:
+                    return mezzchannelmapBA
+            elif side == 'A':
+                return mezzchannelmapBA
+            else:
+                return mezzchannelmapBC
+
+        # BISxx12
+        elif station == 'BIS' and ChName[5:7] == '12':
+            if side == 'A':
+                return mezzchannelmapEC
+            else:
+                return mezzchannelmapEA
+        elif LS == 'S':
+            if side == 'A':
+                return mezzchannelmapEA
+            else:
+                return mezzchannelmapEC
+        else:
+            if side == 'A':
+                return mezzchannelmapBA
+            else:
+                return mezzchannelmapBC
+
+
 #  Find mezzcard type, mezzcard channel for chamber, mllt combination.
 #  cham = Hardware/software name, mdt[] index, or muonfixedid.
 #  If muonfixedid is used, it is use to determine the mllt.
@@ -1734,49 +1861,7 @@ def MLLT2MezzCh(cham, mllt=0):
     tbi = tb % mezzcardtubes[mezztype]
     if tbi == 0: tbi = mezzcardtubes[mezztype]
 
-    mezzchan = -2
-    # A/C sides are mirror images, use different maps
-    station = ChName[0:3]
-    LS = ChName[2]  # Could be L,S,E,M,R,F,G
-    side = ChName[4]
-    if ChName[0] == 'E' or ChName[1] == 'E':  # Endcap + BEE
-        if side == 'A':
-            mezzchan = mezzchannelmapEA[mezztype][ly][tbi]
-        else:
-            mezzchan = mezzchannelmapEC[mezztype][ly][tbi]
-    else:  # Barrel
-        # BIM1A11 uses C map     BIMxA11 use C map
-        if station == 'BIM' or station == 'BIR':
-            #      if station == 'BIR' and int(ChName[3]) > 2:
-            #        if side == 'A': mezzchan = mezzchannelmapBIR3[mezztype][ly][tbi]
-            #        else:           mezzchan = mezzchannelmapEA[mezztype][ly][tbi]
-
-            if ChName[5:7] == '11':  # BIMxx11, BIRxx11
-                if side == 'A':
-                    mezzchan = mezzchannelmapBC[mezztype][ly][tbi]
-                else:
-                    mezzchan = mezzchannelmapBA[mezztype][ly][tbi]
-            elif side == 'A':
-                mezzchan = mezzchannelmapBA[mezztype][ly][tbi]
-            else:
-                mezzchan = mezzchannelmapBC[mezztype][ly][tbi]
-
-        # BISxx12
-        elif station == 'BIS' and ChName[5:7] == '12':
-            if side == 'A':
-                mezzchan = mezzchannelmapEC[mezztype][ly][tbi]
-            else:
-                mezzchan = mezzchannelmapEA[mezztype][ly][tbi]
-        elif LS == 'S':
-            if side == 'A':
-                mezzchan = mezzchannelmapEA[mezztype][ly][tbi]
-            else:
-                mezzchan = mezzchannelmapEC[mezztype][ly][tbi]
-        else:
-            if side == 'A':
-                mezzchan = mezzchannelmapBA[mezztype][ly][tbi]
-            else:
-                mezzchan = mezzchannelmapBC[mezztype][ly][tbi]
+    mezzchan = _mezzChannelMap(ChName)[mezztype][ly][tbi]
     return mezztype, mezzchan
 
 
@@ -1818,8 +1903,8 @@ def MDTtubeIndex(ChName, ml, ly, tube):
 # Calculate MLLT from #TubeIndex
 def MDTtubeIndex2MLLT(ChName, tubeIndex):
     idx = MDTindex(ChName)
-    ml = tubeIndex / (mdt[idx].ntl_ml1 * mdt[idx].nly_ml1) + 1
-    ly = tubeIndex / mdt[idx].ntl_ml1 + 1 - (ml - 1) * mdt[idx].nly_ml1
+    ml = tubeIndex // (mdt[idx].ntl_ml1 * mdt[idx].nly_ml1) + 1
+    ly = tubeIndex // mdt[idx].ntl_ml1 + 1 - (ml - 1) * mdt[idx].nly_ml1
     tb = tubeIndex % mdt[idx].ntl_ml1 + 1
     print(tubeIndex, mdt[idx].ntl_ml1, mdt[idx].nly_ml1, ml, ly, tb, MDTtubeIndex(ChName, ml, ly, tb))
     return ml * 1000 + ly * 100 + tb
@@ -1847,6 +1932,90 @@ def MDTasdIndex(id):
     return asdChannel
 
 
+#  Dense lookup arrays of the mezzcard mapping, indexed [mdt[] index, ml, ly, tb] (ml 0..2, ly 0..4, tb 0..128,
+#  the muonfixedid field ranges), built once on first use:
+#   'mezz'        : mezzNumber as MLLT2M, -1 for invalid tubes
+#   'mezzType'    : mezzcard type as MLLT2MezzCh (1..4), -1 for invalid tubes and mezzcard types 5, 6
+#   'mezzChannel' : mezzcard channel as MLLT2MezzCh (0..23), -1 as mezzType
+#   'asd'         : ASD index as MDTasdIndex, idx*1000 + mezz*10 + #ASD
+_mezzLookup = None
+
+
+def mezzLookup():
+    global _mezzLookup
+    if _mezzLookup is not None:
+        return _mezzLookup
+    nTb = 129  # muonfixedid tube field 1..128
+    I = np.arange(MAXCHAMBERS)[:, None, None, None]
+    ML = np.arange(3)[None, :, None, None]
+    LY = np.arange(5)[None, None, :, None]
+    TB = np.arange(nTb)[None, None, None, :]
+    geo = mdtTable[I]
+    nly = np.where(ML == 1, geo['nly_ml1'], np.where(ML == 2, geo['nly_ml2'], 0))
+    ntl = np.where(ML == 1, geo['ntl_ml1'], np.where(ML == 2, geo['ntl_ml2'], 0))
+    valid = (ML >= 1) & (LY >= 1) & (LY <= nly) & (TB >= 1) & (TB <= ntl)
+
+    # MLLT2M
+    mezz = geo['num_ml'] * ((TB - 1) // (24 // np.maximum(nly, 1))) + (ML != geo['mz0ml'])
+    mezz = np.where(valid, mezz, -1)
+
+    # MLLT2MezzCh
+    mezzType = np.where(ML == 1, geo['mzt_ml1'], geo['mzt_ml2'])
+    typeOK = valid & (mezzType >= 1) & (mezzType <= 4)
+    mezzType = np.where(typeOK, mezzType, 0)
+    nCard = np.array(mezzcardtubes)[mezzType]
+    tbi = TB % np.maximum(nCard, 1)
+    tbi = np.where(tbi == 0, nCard, tbi)
+    maps = np.array([_mezzChannelMap(ch.hardname) for ch in mdt])
+    mezzChannel = np.where(typeOK, maps[I, mezzType, np.where(typeOK, LY, 0), np.clip(tbi, 0, 8)], -1)
+
+    # MDTasdIndex
+    nASD = np.where(mezzChannel >= 0, mezzChannel // 8 + 1, 0)
+    _mezzLookup = {'mezz': mezz.astype(np.int16), 'mezzType': np.where(typeOK, mezzType, -1).astype(np.int16),
+                   'mezzChannel': mezzChannel.astype(np.int16), 'asd': (I * 1000 + mezz * 10 + nASD).astype(np.int32)}
+    return _mezzLookup
+
+
+#  Values of a mezzLookup() array for arrays of mdt[] index, ml, ly, tb; -1 outside the table (e.g. idx = -1)
+def _mezzGather(name, idx, ml, ly, tb):
+    table = mezzLookup()[name]
+    keys = np.broadcast_arrays(*[np.asarray(x, dtype=np.int64) for x in (idx, ml, ly, tb)])
+    inside = np.ones(keys[0].shape, dtype=bool)
+    for key, n in zip(keys, table.shape):
+        inside &= (key >= 0) & (key < n)
+    values = table[tuple(np.where(inside, key, 0) for key in keys)]
+    return np.where(inside, values, -1)
+
+
+#  Vectorized MLLT2M of arrays of mdt[] index, ml, ly, tb : mezzNumber array
+def MLLT2Marray(idx, ml, ly, tb):
+    return _mezzGather('mezz', idx, ml, ly, tb)
+
+
+#  Vectorized T2M of arrays of mdt[] index and tubeNumber [1..<total tubes>] : mezzNumber array
+def T2Marray(idx, tube):
+    idx, tube = np.asarray(idx, dtype=np.int64), np.asarray(tube, dtype=np.int64)
+    geo = mdtTable[np.clip(idx, 0, MAXCHAMBERS - 1)]
+    nml1 = geo['ntl_ml1'] * geo['nly_ml1']
+    ml = np.where(tube > nml1, 2, 1)
+    tb = np.where(ml == 2, tube - nml1, tube)
+    ntl = np.maximum(np.where(ml == 1, geo['ntl_ml1'], geo['ntl_ml2']), 1)
+    ly = (tb - 1) // ntl + 1
+    return MLLT2Marray(idx, ml, ly, tb - (ly - 1) * ntl)
+
+
+#  Vectorized MLLT2MezzCh of arrays of mdt[] index, ml, ly, tb : tuple of mezzcard type and mezzcard channel arrays
+def MLLT2MezzChArray(idx, ml, ly, tb):
+    return _mezzGather('mezzType', idx, ml, ly, tb), _mezzGather('mezzChannel', idx, ml, ly, tb)
+
+
+#  Vectorized MDTasdIndex of an array of muonfixedids, -1 for muonfixedids of no chamber
+def MDTasdIndexArray(mfids):
+    mfids = np.asarray(mfids, dtype=np.int64)
+    return _mezzGather('asd', MDTindexMfid(mfids), muonfixedid.mdtMultilayer(mfids),
+                       muonfixedid.mdtTubeLayer(mfids), muonfixedid.mdtTube(mfids))
+
+
 ########################################################################
 ### This is for testing porpoises
 ########################################################################
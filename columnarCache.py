@@ -0,0 +1,300 @@
+import os
+import numpy as np
+import pandas as pd
+import segmentCuts
+import chamberlist
+
+
+# columnar cache for the dataConverted/*.csv segment files
+# list-in-string columns like '[1.2, 3.4]' are parsed only once and stored as one flat array
+# plus per-segment offsets (segment i = values[offsets[i]:offsets[i+1]]) in a .npz file next to the csv
+# segment level columns are stored as plain arrays
+# the segments are stored in row groups (rowGroupSize segments, every column of every row group is its own .npz
+# member) with min/max statistics of the numeric columns per row group, so loadSegments only reads the columns
+# asked for (projection) and skips row groups in which no segment can pass the cuts (predicate pushdown)
+# the tube names of mdt_tubeInfo ('BMG2A12-1-2-3') are converted once into the integer column mdt_tubeId
+# (muonfixedid of every hit, -1 for invalid tubes), so grouping and joining by tube are integer operations
+#
+#  How to use:
+# columnarCache.convertCsv('dataConverted/run437124_region0051_BMG2A12.csv')  # once, writes ..._BMG2A12.npz
+# seg = columnarCache.loadSegments('dataConverted/run437124_region0051_BMG2A12.csv')  # reads (or builds) the cache
+# seg = seg.select(seg['seg_chi2'] < 1000)
+# f_r = seg.flat('mdt_r')      # same as conv(df.mdt_r)
+# df = seg.toDataFrame()       # pandas dataframe, list columns as one np.array per segment
+# seg = columnarCache.loadSegments(file, columns=['mdt_r', 'rTrk_new', 'unbias_rTrk_new'],
+#                                  cuts=['seg_chi2 < 5', 'seg_nMdtHits > 6', '0 < mdt_t < 186'])
+# ids = seg.flat('mdt_tubeId')                              # muonfixedid per hit
+# idx = chamberlist.MDTindexMfid(ids)                       # chamber (mdt[] index) per hit
+# asd = chamberlist.MDTasdIndexArray(ids)                   # ASD per hit
+
+# cache file format version, older caches are rebuilt from the csv
+cacheFormat = 3
+rowGroupSize = 16384
+
+# integer tube key column, derived from the tube names column at ingestion
+tubeNameColumn = 'mdt_tubeInfo'
+tubeIdColumn = 'mdt_tubeId'
+
+
+# function to convert a column of '[1.2, 3.4]' strings into flat array and number of entries per row
+# string lists like "['BMG2A12-1-1-5', ...]" are returned as flat array of str (quotes removed)
+def parseListColumn(col, dtype=float):
+    s = [str(x).strip('[] ') for x in col.values]
+    counts = np.fromiter((x.count(',') + 1 if x else 0 for x in s), dtype=int, count=len(s))
+    flat = ','.join(x for x in s if x).split(',') if np.any(counts) else []
+    if dtype is str:
+        return np.array([x.strip(" '\"") for x in flat], dtype=str), counts
+    return np.array(flat, dtype=dtype), counts
+
+
+# check if a csv column holds list-in-string data
+def isListColumn(col):
+    if pd.api.types.is_numeric_dtype(col.dtype):
+        return False
+    first = col.dropna()
+    return len(first) > 0 and str(first.iloc[0]).startswith('[')
+
+
+# offsets from number of entries per segment
+def countsToOffsets(counts):
+    return np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+
+# cache file name for a csv file
+def cachePath(file):
+    return os.path.splitext(file)[0] + '.npz'
+
+
+class SegmentColumns:
+    def __init__(self, columns, values, offsets):
+        # columns : column names in csv order
+        # values : dict name -> np.array (segment level array or flat hit level array)
+        # offsets : dict name -> offsets array, only for the list columns
+        self.columns = list(columns)
+        self.values = values
+        self.offsets = offsets
+
+    def __len__(self):
+        if len(self.columns) == 0:
+            return 0
+        name = self.columns[0]
+        if name in self.offsets:
+            return len(self.offsets[name]) - 1
+        return len(self.values[name])
+
+    # segment level array, or flat hit array for list columns
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def __contains__(self, name):
+        return name in self.values
+
+    def isList(self, name):
+        return name in self.offsets
+
+    # flat hit level array of a list column, same as conv(df[name])
+    def flat(self, name):
+        return self.values[name]
+
+    # number of entries of a list column per segment
+    def counts(self, name):
+        return np.diff(self.offsets[name])
+
+    # segment index of every entry of a list column
+    def segmentIndex(self, name):
+        return np.repeat(np.arange(len(self)), self.counts(name))
+
+    # list column as one np.array per segment
+    def lists(self, name):
+        if len(self) == 0:
+            return []
+        return np.split(self.values[name], self.offsets[name][1:-1])
+
+    # keep segments by boolean mask or index array, list columns are sliced without python loops
+    def select(self, rows):
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.nonzero(rows)[0]
+        values, offsets = {}, {}
+        for name in self.columns:
+            if name in self.offsets:
+                offs = self.offsets[name]
+                counts = offs[rows + 1] - offs[rows]
+                newOffs = countsToOffsets(counts)
+                index = np.repeat(offs[rows] - newOffs[:-1], counts) + np.arange(newOffs[-1])
+                values[name] = self.values[name][index]
+                offsets[name] = newOffs
+            else:
+                values[name] = self.values[name][rows]
+        return SegmentColumns(self.columns, values, offsets)
+
+    def toDataFrame(self):
+        return pd.DataFrame({name: self.lists(name) if name in self.offsets else self.values[name]
+                             for name in self.columns})
+
+
+# min and max of numeric values (nan if none), stored per row group for the predicate pushdown
+def _minMax(values):
+    if values.dtype.kind not in 'iuf' or len(values) == 0 or np.all(np.isnan(values.astype(float))):
+        return np.nan, np.nan
+    return np.nanmin(values), np.nanmax(values)
+
+
+# integer tube key column mdt_tubeId (muonfixedid per hit) added to SegmentColumns with mdt_tubeInfo
+def addTubeIds(seg):
+    if tubeNameColumn not in seg or tubeIdColumn in seg or not seg.isList(tubeNameColumn):
+        return seg
+    values = dict(seg.values)
+    values[tubeIdColumn] = chamberlist.MDTmfidArray(seg.flat(tubeNameColumn))
+    offsets = dict(seg.offsets)
+    offsets[tubeIdColumn] = seg.offsets[tubeNameColumn]
+    columns = list(seg.columns)
+    columns.insert(columns.index(tubeNameColumn) + 1, tubeIdColumn)
+    return SegmentColumns(columns, values, offsets)
+
+
+# one-time conversion of a segment csv file into the columnar .npz cache
+# per column and row group g : name@g (values) and name.offsets@g (list columns, offsets inside the row group),
+# numeric columns : name.min / name.max per row group (over the hits for list columns)
+def convertCsv(file, cacheFile=None, groupSize=None):
+    if cacheFile is None:
+        cacheFile = cachePath(file)
+    if groupSize is None:
+        groupSize = rowGroupSize
+    df = pd.read_csv(file)
+    rowGroups = np.append(np.arange(0, len(df), groupSize), len(df)).astype(np.int64)
+    if len(rowGroups) == 1:
+        rowGroups = np.array([0, 0], dtype=np.int64)
+    columns = []
+    for name in df.columns:
+        col = df[name]
+        offsets = None
+        if isListColumn(col):
+            try:
+                values, counts = parseListColumn(col)
+            except ValueError:
+                values, counts = parseListColumn(col, dtype=str)
+            offsets = countsToOffsets(counts)
+        elif pd.api.types.is_numeric_dtype(col.dtype):
+            values = col.values
+        else:
+            values = np.array(col.astype(str), dtype=str)
+        columns.append((name, values, offsets))
+        if name == tubeNameColumn and offsets is not None and tubeIdColumn not in df.columns:
+            columns.append((tubeIdColumn, chamberlist.MDTmfidArray(values), offsets))
+
+    arrays = {'__columns__': np.array([x[0] for x in columns], dtype=str), '__format__': np.array(cacheFormat),
+              '__rowGroups__': rowGroups}
+    for name, values, offsets in columns:
+        stats = []
+        for g in range(len(rowGroups) - 1):
+            start, stop = rowGroups[g], rowGroups[g + 1]
+            if offsets is not None:
+                part = values[offsets[start]:offsets[stop]]
+                arrays['%s.offsets@%d' % (name, g)] = offsets[start:stop + 1] - offsets[start]
+            else:
+                part = values[start:stop]
+            arrays['%s@%d' % (name, g)] = part
+            stats.append(_minMax(part))
+        arrays[name + '.min'] = np.array([x[0] for x in stats], dtype=float)
+        arrays[name + '.max'] = np.array([x[1] for x in stats], dtype=float)
+    np.savez(cacheFile, **arrays)
+    return cacheFile
+
+
+# row groups in which some segment can pass all cuts, from the min/max statistics
+# (all hits have to pass for list columns, so the hit min/max of the row group can be used as well)
+# cuts keeping nan values (keepNan) skip no row group, the min/max ignore the nan values
+def _rowGroupsPassing(data, cuts, nGroups):
+    keep = np.ones(nGroups, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        for cut in cuts:
+            if cut.keepNan or cut.column + '.min' not in data.files:
+                continue
+            low, high = data[cut.column + '.min'], data[cut.column + '.max']
+            if cut.low is not None:
+                keep &= ~((high < cut.low) if cut.closed else (high <= cut.low))
+            if cut.high is not None:
+                keep &= ~((low > cut.high) if cut.closed else (low >= cut.high))
+    return np.nonzero(keep)[0]
+
+
+# columns of one row group
+def _readRowGroup(data, columns, g):
+    values, offsets = {}, {}
+    for name in columns:
+        values[name] = data['%s@%d' % (name, g)]
+        if '%s.offsets@%d' % (name, g) in data.files:
+            offsets[name] = data['%s.offsets@%d' % (name, g)]
+    return SegmentColumns(columns, values, offsets)
+
+
+# cache written before the row groups : one array per column
+def _readLegacy(data, columns):
+    values, offsets = {}, {}
+    for name in columns:
+        values[name] = data[name]
+        if name + '.offsets' in data.files:
+            offsets[name] = data[name + '.offsets']
+    return SegmentColumns(columns, values, offsets)
+
+
+# load the columnar cache, file is the .npz cache or the original csv
+# for a csv file the cache is (re)built if missing, older than the csv or of an older format
+# columns : columns to load (projection), default all columns
+# cuts : segmentCuts.Cut or expressions like 'seg_chi2 < 5', '0 < mdt_t < 186' (all hits for list columns),
+# row groups without passing segments are not read, the cut columns are only loaded to evaluate the cuts
+def loadSegments(file, columns=None, cuts=None):
+    if file.endswith('.npz'):
+        cacheFile = file
+    else:
+        cacheFile = cachePath(file)
+        stale = not os.path.exists(cacheFile) or os.path.getmtime(cacheFile) < os.path.getmtime(file)
+        if not stale:
+            with np.load(cacheFile) as data:
+                stale = '__format__' not in data.files or int(data['__format__']) < cacheFormat
+        if stale:
+            convertCsv(file, cacheFile)
+
+    cuts = [segmentCuts.parseCut(cut) if isinstance(cut, str) else cut for cut in (cuts or [])]
+    with np.load(cacheFile) as data:
+        allColumns = list(data['__columns__'])
+        if columns is None:
+            columns = allColumns
+        missing = [name for name in list(columns) + [cut.column for cut in cuts] if name not in allColumns]
+        if missing:
+            raise KeyError('columns %s not found in %s' % (missing, cacheFile))
+        columns = [name for name in allColumns if name in columns]
+        needed = [name for name in allColumns if name in columns or name in [cut.column for cut in cuts]]
+
+        if '__format__' not in data.files:
+            parts = [_readLegacy(data, needed)]
+        else:
+            groups = _rowGroupsPassing(data, cuts, len(data['__rowGroups__']) - 1)
+            parts = [_readRowGroup(data, needed, g) for g in groups]
+            if len(parts) == 0:
+                # no row group can pass, empty result with the right columns
+                parts = [_readRowGroup(data, needed, 0).select(np.zeros(0, dtype=int))]
+
+    out = []
+    for part in parts:
+        if cuts:
+            mask, _ = segmentCuts.cutMask(part, cuts)
+            part = part.select(mask)
+        out.append(SegmentColumns(columns, {name: part.values[name] for name in columns},
+                                  {name: part.offsets[name] for name in columns if name in part.offsets}))
+    return concatenate(out) if len(out) > 1 else out[0]
+
+
+# concatenate SegmentColumns with the same columns (e.g. chunks of a ROOT file)
+def concatenate(parts):
+    parts = [part for part in parts if len(part.columns) > 0]
+    if len(parts) == 0:
+        return SegmentColumns([], {}, {})
+    columns = parts[0].columns
+    values, offsets = {}, {}
+    for name in columns:
+        values[name] = np.concatenate([part.values[name] for part in parts])
+        if name in parts[0].offsets:
+            offsets[name] = countsToOffsets(np.concatenate([part.counts(name) for part in parts]))
+    return SegmentColumns(columns, values, offsets)
@@ -0,0 +1,67 @@
+import numpy as np
+
+
+# vectorized hit efficiency vs track radius
+# n-sigma flags (resi_unbias <= n * resSigma) and hardware flag (rTrk_unbias <= maxRadius) are boolean arrays,
+# hits are put in the rTrk_new radius slices with np.digitize and counted per slice with np.bincount
+# efficiency [%] and binomial error for all flags in one pass
+#
+#  How to use:
+# import efficiency
+# eff = efficiency.computeEfficiency(f_r, f_new, f_unbias, resolution_constants, chamber, nSigma=[3, 5])
+# eff['sigma5'], eff['sigma5_err'], eff['hardware'], eff['hardware_err']   => arrays, one value per radius slice
+
+
+# radius slice edges of the efficiency plots, (0.1, 1.1), (1.1, 2.1), ... (x, maxRadius)
+def radiusSlices(maxRadius, step=1, start=0.1):
+    return np.append(np.arange(start, maxRadius, step), maxRadius)
+
+
+# radius slice of each hit, -1 outside the slices or on a slice edge (slices are open intervals)
+def sliceIndex(rTrk_new, edges):
+    rTrk_new = np.asarray(rTrk_new)
+    index = np.digitize(rTrk_new, edges) - 1
+    outside = (index < 0) | (index >= len(edges) - 1) | np.isin(rTrk_new, edges)
+    index[outside] = -1
+    return index
+
+
+# efficiency flags of each hit, same as check_3sigma/check_5sigma/check_hardware
+# returns dict 'sigma<n>' for each n in nSigma and 'hardware'
+def efficiencyFlags(resi_unbias, resSigma, rTrk_unbias, maxRadius, nSigma=(3, 5)):
+    resi_unbias = np.abs(resi_unbias)
+    flags = {}
+    for n in nSigma:
+        flags['sigma%g' % n] = ~(resi_unbias > n * resSigma)
+    flags['hardware'] = ~(np.asarray(rTrk_unbias) > maxRadius)
+    return flags
+
+
+# efficiency [%] and binomial error per radius slice for a dict of flags
+# returns dict with 'nHits' per slice and for each flag name : name, name + '_err'
+def binnedEfficiency(flags, rTrk_new, edges):
+    nSlice = len(edges) - 1
+    index = sliceIndex(rTrk_new, edges)
+    inSlice = index >= 0
+    index = index[inSlice]
+    nHits = np.bincount(index, minlength=nSlice)
+    result = {'edges': edges, 'nHits': nHits}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name, flag in flags.items():
+            nPass = np.bincount(index, weights=np.asarray(flag)[inSlice], minlength=nSlice)
+            eff = nPass / nHits
+            result[name] = 100.0 * eff
+            result[name + '_err'] = 100.0 * np.sqrt(eff * (1 - eff) / nHits)
+    return result
+
+
+# full efficiency of a chamber from flat hit arrays (mdt_r, rTrk_new, unbias_rTrk_new)
+def computeEfficiency(f_r, f_new, f_unbias, resolution_constants, chamber, nSigma=(3, 5)):
+    maxRadius, step = 14.6, 1
+    if chamber[:3] in ['BME', 'BMG']:
+        maxRadius, step = 7.1, 1
+    f_r, f_new, f_unbias = np.asarray(f_r), np.asarray(f_new), np.asarray(f_unbias)
+    resi_unbias = np.abs(f_r) - np.abs(f_unbias)
+    resSigma = np.polyval(resolution_constants, np.abs(f_new)) / 1000.
+    flags = efficiencyFlags(resi_unbias, resSigma, f_unbias, maxRadius, nSigma)
+    return binnedEfficiency(flags, f_new, radiusSlices(maxRadius, step))
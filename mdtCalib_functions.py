@@ -7,6 +7,8 @@ import re, glob
 import numpy as np
 import muonfixedid, chamberlist
 import splitter_regions_Run2
+import rtResDatabase
+import rtTable
 import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
 
@@ -215,6 +217,116 @@ def tangentLine(circle1, circle2, plotting):
         return tangent
 
 
+# vectorized tangentLine function, input arrays of circle pairs (x1,y1,r1) (x2,y2,r2) of any (same) shape
+# output [..., 4, 4] : for each pair the 4 lines of tangentLine (line1..line4) as (x1, y1, x2, y2)
+# degenerate cases r1 == r2 == 0, r2 == 0 and r1 == r2 are handled by masks instead of branches
+def tangentLines(x1, y1, r1, x2, y2, r2):
+    x1, y1, r1 = np.asarray(x1, dtype=float), np.asarray(y1, dtype=float), np.asarray(r1, dtype=float)
+    x2, y2, r2 = np.asarray(x2, dtype=float), np.asarray(y2, dtype=float), np.asarray(r2, dtype=float)
+    # make sure r1 >= r2, swap circles otherwise
+    swap = r1 < r2
+    x1, x2 = np.where(swap, x2, x1), np.where(swap, x1, x2)
+    y1, y2 = np.where(swap, y2, y1), np.where(swap, y1, y2)
+    r1, r2 = np.where(swap, r2, r1), np.where(swap, r1, r2)
+
+    # the two tangent points of circle (xc,yc,rc) seen from point (xo,yo)
+    def touch(xc, yc, rc, xo, yo):
+        dx, dy = xo - xc, yo - yc
+        d2 = dx ** 2 + dy ** 2
+        s = rc * np.sqrt(d2 - rc ** 2)
+        rc2 = rc ** 2
+        return (rc2 * dx + dy * s) / d2 + xc, (rc2 * dy - dx * s) / d2 + yc, \
+               (rc2 * dx - dy * s) / d2 + xc, (rc2 * dy + dx * s) / d2 + yc
+
+    lines = np.empty(np.shape(x1) + (4, 4))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # outer tangent lines, general case through outer intersection point
+        xo = (x2 * r1 - x1 * r2) / (r1 - r2)
+        yo = (y2 * r1 - y1 * r2) / (r1 - r2)
+        lines[..., 0, 0], lines[..., 0, 1], lines[..., 1, 0], lines[..., 1, 1] = touch(x1, y1, r1, xo, yo)
+        lines[..., 0, 2], lines[..., 0, 3], lines[..., 1, 2], lines[..., 1, 3] = touch(x2, y2, r2, xo, yo)
+        # inner tangent lines through inner intersection point
+        xi = (x2 * r1 + x1 * r2) / (r1 + r2)
+        yi = (y2 * r1 + y1 * r2) / (r1 + r2)
+        lines[..., 2, 0], lines[..., 2, 1], lines[..., 3, 0], lines[..., 3, 1] = touch(x1, y1, r1, xi, yi)
+        lines[..., 2, 2], lines[..., 2, 3], lines[..., 3, 2], lines[..., 3, 3] = touch(x2, y2, r2, xi, yi)
+
+        # degenerate cases, patched by mask only where they occur
+        both0 = (r1 == 0) & (r2 == 0)
+        equal = (r1 == r2) & ~both0
+        small0 = (r2 == 0) & ~both0
+        if np.any(equal):
+            # parallel outer tangent lines for r1 == r2
+            xe1, ye1, xe2, ye2, re = x1[equal], y1[equal], x2[equal], y2[equal], r1[equal]
+            theta = np.where(xe2 - xe1 == 0, np.pi / 2., np.arctan((ye2 - ye1) / (xe2 - xe1)))
+            sin, cos = re * np.sin(theta), re * np.cos(theta)
+            lines[equal, 0, :] = np.stack([xe1 + sin, ye1 - cos, xe2 + sin, ye2 - cos], axis=-1)
+            lines[equal, 1, :] = np.stack([xe1 - sin, ye1 + cos, xe2 - sin, ye2 + cos], axis=-1)
+        if np.any(small0):
+            # r2 == 0, all lines go through the center of circle 2
+            xs1, ys1, xs2, ys2 = touch(x1[small0], y1[small0], r1[small0], x2[small0], y2[small0])
+            lines[small0, 0, :] = lines[small0, 2, :] = np.stack([xs1, ys1, x2[small0], y2[small0]], axis=-1)
+            lines[small0, 1, :] = lines[small0, 3, :] = np.stack([xs2, ys2, x2[small0], y2[small0]], axis=-1)
+        if np.any(both0):
+            # r1 == r2 == 0, line through both centers
+            lines[both0] = np.stack([x1[both0], y1[both0], x2[both0], y2[both0]], axis=-1)[:, None, :]
+    return lines
+
+
+# weighted least squares sums of point sets for the straight line fit, summed over the last axis
+# w : weights (1/sigma**2), default 1, nan points (padding) get weight 0
+# x0, y0 : origin subtracted before summing (one per point set), keeps the sums well conditioned
+# returns sums (n, S, Sx, Sy, Sxx, Sxy), points can be removed later by subtracting their own sums
+def lineSums(x, y, w=None, x0=0., y0=0.):
+    x = np.asarray(x, dtype=float) - np.asarray(x0, dtype=float)[..., None]
+    y = np.asarray(y, dtype=float) - np.asarray(y0, dtype=float)[..., None]
+    w = np.ones_like(x) if w is None else np.broadcast_to(np.asarray(w, dtype=float), x.shape)
+    ok = np.isfinite(x) & np.isfinite(y) & np.isfinite(w)
+    x, y, w = np.where(ok, x, 0.), np.where(ok, y, 0.), np.where(ok, w, 0.)
+    wx, wy = w * x, w * y
+    return np.sum(ok, axis=-1), np.sum(w, axis=-1), np.sum(wx, axis=-1), np.sum(wy, axis=-1), \
+        np.sum(wx * x, axis=-1), np.sum(wx * y, axis=-1)
+
+
+# closed form line y = m*x + b from lineSums, same as np.polyfit(x, y, 1, w=np.sqrt(w))
+# vertical lines (all x equal) are returned as m = inf and b = x of the line, less than 2 points give nan
+def linesFromSums(sums, x0=0., y0=0.):
+    n, S, Sx, Sy, Sxx, Sxy = sums
+    with np.errstate(divide='ignore', invalid='ignore'):
+        det = S * Sxx - Sx * Sx
+        vertical = det <= 1e-12 * S * Sxx
+        m = np.where(vertical, np.inf, (S * Sxy - Sx * Sy) / det)
+        b = np.where(vertical, Sx / S + x0, (Sy - m * Sx) / S + y0 - m * x0)
+    bad = n < 2
+    return np.where(bad, np.nan, m), np.where(bad, np.nan, b)
+
+
+# batch weighted straight line fit, one line per point set (last axis), e.g. padded (nSegments, nPoints) arrays
+# replaces np.polyfit(x, y, 1) in the refit, see linesFromSums for vertical lines
+def fitLines(x, y, w=None):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if x.ndim == 1 and w is None and len(x) >= 2 and np.isfinite(x.sum() + y.sum()):
+        # single point set of the loop version, centered sums without the batch overhead
+        dx = x - x.mean()
+        Sxx = dx.dot(dx)
+        if Sxx <= 1e-12 * x.dot(x):
+            return np.inf, x.mean()
+        m = dx.dot(y) / Sxx
+        return m, y.mean() - m * x.mean()
+    # first valid point of every set as origin
+    first = np.argmax(np.isfinite(x) & np.isfinite(y), axis=-1)[..., None]
+    x0 = np.take_along_axis(x, first, axis=-1)[..., 0]
+    y0 = np.take_along_axis(y, first, axis=-1)[..., 0]
+    return linesFromSums(lineSums(x, y, w, x0, y0), x0, y0)
+
+
+# distance of points (x,y) to lines y = m*x + b, vertical lines m = inf at x = b (fitLines output)
+def distLines(x, y, m, b):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    vertical = np.isinf(m)
+    with np.errstate(invalid='ignore'):
+        return np.where(vertical, np.abs(x - b), np.abs(m * x - y + b) / np.sqrt(m * m + 1))
+
 # develop the function to calculate rTrk and chi2
 # function to calculate distance to Track y = m*x + b
 def dist(x, y, m, b):
@@ -467,6 +579,12 @@ def fitRtRes(rtData):
     # define the splitBin by checking sMDT or MDT chamber
     calibName = rtData.split('/')[-1][3:-4]
     chamberName = chamberlist.MDThardname(chamberlist.MDTindex(calibName))
+    return (calibName, chamberName) + fitRtPoints(rnp.values, tnp.values, renp.values, chamberName)
+
+
+# RT and resolution polynomial fit of rt points (radius r [mm], drift time t [ns] sorted, resolution rerr [mm])
+# returns splitDriftTime, diffJointPoint, zs, zs_residuals, zs_ndf, zl, zl_residuals, zl_ndf, z, residuals, ndf
+def fitRtPoints(rnp, tnp, renp, chamberName):
     splitBin = 13  # sMDT = 25  MDT = 13
     searchMaxRange = 150
     if (chamberName[:3] in ['BME', 'BMG']):
@@ -490,7 +608,7 @@ def fitRtRes(rtData):
     yyy = np.subtract(np.polyval(zl, xxx), np.polyval(zs, xxx))
     # find the index of change sign element, if no index is found, return the smallest diffJoint
     idx = np.where(yyy[:-1] * yyy[1:] < 0)[0] + 1
-    if idx != []:
+    if len(idx) > 0:
         splitDriftTime = xxx[idx[0]]
         diffJointPoint = yyy[idx[0]]
     else:
@@ -499,27 +617,18 @@ def fitRtRes(rtData):
     # print(chamberName,idx,splitDriftTime,diffJointPoint)
     # get residual mean and std for rt and res, also save splitRadius
 
-    return calibName, chamberName, splitDriftTime, diffJointPoint, zs, zs_residuals, zs_ndf, zl, zl_residuals, zl_ndf, z, residuals, ndf
+    return splitDriftTime, diffJointPoint, zs, zs_residuals, zs_ndf, zl, zl_residuals, zl_ndf, z, residuals, ndf
 
 
 # function to load RT parameters from csv dataframe file
 def getRtRes(rtDb, chamber):
-    # Draw RT function by loading 'UM6608_RtResFit.csv'
-    df_RtResFit = pd.read_csv(rtDb)
-    # da = df_RtResFit[df_RtResFit['chamber'] == 'BIL2A01']
-    da = df_RtResFit[df_RtResFit['chamber'] == chamber]
-    print(da.values)
-
-    zs = np.array([float(x) for x in da.values[0][5][1:-1].split(', ')])
-    zl = np.array([float(x) for x in da.values[0][8][1:-1].split(', ')])
-    z = np.array([float(x) for x in da.values[0][11][1:-1].split(', ')])
-    splitDriftTime = float(da.values[0][3])
-
-    return splitDriftTime, zs, zl, z
+    # RT function constants from 'UM6608_RtResFit.csv', file parsed once per process (rtResDatabase)
+    return rtResDatabase.loadRtDb(rtDb).getRtRes(chamber)
 
 
-def t_to_r(rtDb):
-    pass
+def t_to_r(rtDb, chamber, t):
+    # drift radius of drift times t (piecewise zs/zl RT function of the chamber), from the rtTable lookup table
+    return rtTable.loadRtTables(rtDb, chamber).radius(t, chamber)
 
 
 # draw RT and Resolution functions
@@ -537,7 +646,13 @@ def preProcessSegmentHits(pd_event):
             pd_event[col] = pd_event[col].apply(lambda x: [float(y) for y in x[1:-1].split(', ')])
 
     pd_event_ex = pd.concat([pd_event[i].explode() for i in mdt_cols], axis=1)
-    pd_event_ex[['mdt_chamber', 'mdt_ml', 'mdt_ly', 'mdt_tb']] = pd_event_ex['mdt_tubeInfo'].str.strip("\'").str.split(
-        '-', expand=True, n=4)
+    # tube names converted once into the integer tube key (muonfixedid), chamber/ml/ly/tb decoded from it
+    tubeId = chamberlist.MDTmfidArray(pd_event_ex['mdt_tubeInfo'].values)
+    idx = chamberlist.MDTindexMfid(tubeId)
+    pd_event_ex['mdt_tubeId'] = tubeId
+    pd_event_ex['mdt_chamber'] = np.where(idx >= 0, chamberlist.mdtTable['hardname'][idx], '')
+    pd_event_ex['mdt_ml'] = np.where(tubeId >= 0, muonfixedid.mdtMultilayer(tubeId), -1)
+    pd_event_ex['mdt_ly'] = np.where(tubeId >= 0, muonfixedid.mdtTubeLayer(tubeId), -1)
+    pd_event_ex['mdt_tb'] = np.where(tubeId >= 0, muonfixedid.mdtTube(tubeId), -1)
 
     return pd_event_ex
\ No newline at end of file
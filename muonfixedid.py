@@ -1,7 +1,18 @@
 # module based on MuonIdUnpack.py
 #  unpack numberic MuonId and convert to station Phi phi etc.
+#  all accessors also take numpy integer arrays (int32, uint32, ...) and return arrays of the decoded fields
+#
+#  How to use:
+# ids = muonfixedid.ID(np.array(['BMG', 'BIL']), phi, eta, ml, ly, tb)     # int32 array
+# tb = muonfixedid.mdtTube(ids)
+# fields = muonfixedid.decodeID(ids)                                      # dict of field arrays
+
+import numpy as np
+
 
 #  Get MuonfixedID from chamber parameters
+#  station, phi, eta, ml, ly, tb can also be numpy arrays (station as name strings or stationName numbers),
+#  then all ids are packed at once and returned as int32 array
 def ID(station, phi, eta, ml=1, ly=1, tb=1):
     mfid = -1
     if type(station) is str:
@@ -16,91 +27,137 @@ def ID(station, phi, eta, ml=1, ly=1, tb=1):
         mfid = (loc_station << __kStationNameShift) | (loc_eta << __kStationEtaShift) | (
                     loc_phi << __kStationPhiShift) | (loc_ml << __kMdtMultilayerShift) | (
                            loc_ly << __kMdtTubeLayerShift) | (loc_tb << __kMdtTubeShift) | __kUnusedBits
+    elif isinstance(station, (np.ndarray, list, tuple)):
+        station = np.asarray(station)
+        if station.dtype.kind in 'US':
+            names, inverse = np.unique(station, return_inverse=True)
+            station = np.array([__kStationNameStringsMap[name] + 1 for name in names], dtype=np.int64)[
+                inverse.reshape(station.shape)]
+        fields = [(station, __kStationNameMin, __kStationNameMask, __kStationNameShift),
+                  (eta, __kStationEtaMin, __kStationEtaMask, __kStationEtaShift),
+                  (phi, __kStationPhiMin, __kStationPhiMask, __kStationPhiShift),
+                  (ml, __kMdtMultilayerMin, __kMdtMultilayerMask, __kMdtMultilayerShift),
+                  (ly, __kMdtTubeLayerMin, __kMdtTubeLayerMask, __kMdtTubeLayerShift),
+                  (tb, __kMdtTubeMin, __kMdtTubeMask, __kMdtTubeShift)]
+        mfid = np.int64(__kUnusedBits)
+        for value, vmin, mask, shift in fields:
+            mfid = mfid | (((np.asarray(value, dtype=np.int64) - vmin) & mask) << shift)
+        mfid = mfid.astype(np.int32)
     return mfid
 
 
+# muonfixedid as int, or as int64 array for numpy integer arrays / scalars (int32, uint32, ...), None otherwise
+def _idValue(mfid):
+    if type(mfid) is int:
+        return mfid
+    if isinstance(mfid, (np.ndarray, np.integer)) and np.asarray(mfid).dtype.kind in 'iu':
+        return np.asarray(mfid, dtype=np.int64)
+    return None
+
+
+# all fields of muonfixedids (int or numpy array) : station name string, phi, eta, ml, ly, tb
+def decodeID(mfid):
+    return {'station': stationNameString(mfid), 'phi': stationPhi(mfid), 'eta': stationEta(mfid),
+            'ml': mdtMultilayer(mfid), 'ly': mdtTubeLayer(mfid), 'tb': mdtTube(mfid)}
+
+
 # station name
 def stationNameIndex(mfid):
-    if type(mfid) is int:
+    mfid = _idValue(mfid)
+    if mfid is not None:
         return (mfid >> __kStationNameShift) & __kStationNameMask
     return -1
 
 
 def stationName(mfid):
-    if type(mfid) is int:
+    mfid = _idValue(mfid)
+    if mfid is not None:
         return stationNameIndex(mfid) + __kStationNameMin
     return -1
 
 
 def stationNameString(mfid):
-    if type(mfid) is int:
+    mfid = _idValue(mfid)
+    if mfid is not None:
+        if isinstance(mfid, np.ndarray):
+            return np.array(__kStationNameStrings)[stationName(mfid) - 1]
         return __kStationNameStrings[stationName(mfid) - 1]
     return 'ERROR'
 
 
 # station Phi
 def stationPhiIndex(mfid):
-    if type(mfid) is int:
+    mfid = _idValue(mfid)
+    if mfid is not None:
         return (mfid >> __kStationPhiShift) & __kStationPhiMask
     return -1
 
 
 def stationPhi(mfid):
-    if type(mfid) is int:
+    mfid = _idValue(mfid)
+    if mfid is not None:
         return stationPhiIndex(mfid) + __kStationPhiMin
     return -1
 
 
 # station Eta
 def stationEtaIndex(mfid):
-    if type(mfid) is int:
+    mfid = _idValue(mfid)
+    if mfid is not None:
         return (mfid >> __kStationEtaShift) & __kStationEtaMask
     return -1  # hmm, -1 is a valid eta index
 
 
 def stationEta(mfid):
-    if type(mfid) is int:
+    mfid = _idValue(mfid)
+    if mfid is not None:
         return stationEtaIndex(mfid) + __kStationEtaMin
     return -1
 
 
 # multilayer
 def mdtMultilayerIndex(mfid):
-    if type(mfid) is int:
+    mfid = _idValue(mfid)
+    if mfid is not None:
         return (mfid >> __kMdtMultilayerShift) & __kMdtMultilayerMask
     return -1
 
 
 def mdtMultilayer(mfid):
-    if type(mfid) is int:
+    mfid = _idValue(mfid)
+    if mfid is not None:
         return mdtMultilayerIndex(mfid) + __kMdtMultilayerMin
     return -1
 
 
 # TubeLayer (helper function)
 def mdtTubeLayerIndex(mfid):
-    if type(mfid) is int:
+    mfid = _idValue(mfid)
+    if mfid is not None:
         return (mfid >> __kMdtTubeLayerShift) & __kMdtTubeLayerMask
     return -1
 
 
 # Tube layer within ML.  Counting from 1
 def mdtTubeLayer(mfid):
-    if type(mfid) is int:
+    mfid = _idValue(mfid)
+    if mfid is not None:
         return mdtTubeLayerIndex(mfid) + __kMdtTubeLayerMin
     return -1
 
 
 # TubeNumber (helper function)
 def mdtTubeIndex(mfid):
-    if type(mfid) is int:
+    mfid = _idValue(mfid)
+    if mfid is not None:
         return (mfid >> __kMdtTubeShift) & __kMdtTubeMask
     return -1
 
 
 # Tube number within layer.  Counting from 1
 def mdtTube(mfid):
-    if type(mfid) is int:
+    mfid = _idValue(mfid)
+    if mfid is not None:
         return mdtTubeIndex(mfid) + __kMdtTubeMin
     return -1
 
@@ -108,8 +165,11 @@ def mdtTube(mfid):
 # Decode Tech ID
 # return type of technology: values: 0=MDT 1=CSC 2=TGC 3=RPC -1=Not valid
 def TechID(mfid):
-    if type(mfid) is int:
+    mfid = _idValue(mfid)
+    if mfid is not None:
         techid = ((mfid >> __kTechnologyShift) & __kTechnologyMask) + __kTechnologyMin
+        if isinstance(mfid, np.ndarray):
+            return np.where((techid >= 0) & (techid <= 3), techid, -1)
         if techid >= 0 and techid <= 3: return techid
     return -1
 
@@ -117,6 +177,8 @@ def TechID(mfid):
 # return name of technology: values: MDT CSC TGC RPC UNK (UNK=unknown)
 def cTechID(mfid):
     techname = ['MDT', 'CSC', 'TGC', 'RPC']
+    if isinstance(mfid, np.ndarray):
+        return np.array(techname)[TechID(mfid)]
     techid = ((mfid >> __kTechnologyShift) & __kTechnologyMask) + __kTechnologyMin
     if techid >= 0 and techid <= 3:
         return techname[techid]
@@ -8,11 +8,17 @@ import numpy as np
 import itertools
 import muonfixedid, chamberlist
 import splitter_regions_Run2
+import rtResDatabase
+import rtTable
+import columnarCache
+import efficiency
+import residualFit
 import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
 from scipy import stats
 import xMdtSegment as xSeg
 import mdtfunctions
+from mdtCalib_functions import tangentLines  # vectorized tangentLine for arrays of circle pairs
 
 
 # tangentLine function, input two circles data (x,y,r), output 8 points (4 tangentLine coordinators)
@@ -348,69 +354,11 @@ def singleGaussian(x, peak1, sigma1, mean):
 # fit residual without display option
 def fitResidualFast(x, bins, chamber):
     # x,bins = np.histogram(df.astype('float')*1000,bins = np.arange(-1000,1000,10))
-    binwidth = 2000 / len(x)
-    bins = bins[1:]
-    # calculate mean and std for histogram data
-    mean = np.average(bins, weights=x)
-    std = np.sqrt(np.average((bins - mean) ** 2, weights=x))
-
-    # decide fixed fitting range -1mm to 1mm
-    x_min = -1000
-    x_max = 1000
-
-    # do curve_fit with p0 guessed parameters
-    # guess = [139.82120082,  86.97521981,  0 , 59.09768902 ,214.70392356]
-    # fun3.SetParameters(ampl,rms/4.,mean,ampl/10.,rms*2) # constant,mean,sigma
-    initialGuess = [max(x), std / 2., mean, max(x) / 10, std * 2]
-    popt1, pcov1 = curve_fit(doubleG_fit, bins, x, p0=initialGuess, maxfev=20000)
-    # print ('peak1 : %.3f | sigma1 : %.3f | mean : %.3f | peak2 : %.3f | sigma2 : %.3f'%(tuple(popt1)))
-    # calculate chi2/ndf
-    # remove zero bins to avoid the inf.
-    zeroFilter = np.where(x != 0)
-    chi2 = np.sum((x[zeroFilter] - doubleG_fit(bins[zeroFilter], *popt1)) ** 2 / x[zeroFilter])
-    ndf = len(x[zeroFilter]) - 5
-    chi2ndf = chi2 / ndf
-
-    # plot narrow and wide GaussianFitting
-    # peak1 : 627.809 | sigma1 : 85.241 | mean : 50.451 | peak2 : 494.648 | sigma2 : 174.630
-    peak_n, std_n, mean_n, peak_w, std_w = popt1
-    # swap narrow and wide Gaussian peak and sigma
-    if np.abs(std_n) > np.abs(std_w):
-        tmp = peak_w, std_w
-        peak_w, std_w = peak_n, std_n
-        peak_n, std_n = tmp
-
-    # calculate A1/A2 ratio
-    ratio = abs(peak_n * std_n / (peak_w * std_w))
-
-    # calculate sigma
-    sigma = (peak_n * abs(std_n) + peak_w * abs(std_w)) / (peak_n + peak_w)
-
-    # calculate FWHM sigma
-    y = doubleG_fit(bins, *popt1)
-    Xmax = np.max(y)
-    XmaxIndex = np.argmax(y)
-    xlo = np.argmin(np.abs(y[:XmaxIndex] - np.max(y) / 2.))
-    # print('before tunning xlo :',xlo)
-    if (y[xlo] > Xmax / 2.):
-        xlo = xlo - (y[xlo] - Xmax / 2.) / (y[xlo] - y[xlo - 1])
-    else:
-        xlo = xlo + (Xmax / 2. - y[xlo]) / (y[xlo + 1] - y[xlo])
-    # print('after tunning xlo :',xlo)
-
-    xhi = np.argmin(np.abs(y[XmaxIndex:] - np.max(y) / 2.)) + XmaxIndex
-    # print('before tunning xhi :',xhi)
-    if (y[xhi] > Xmax / 2.):
-        xhi = xhi - (y[xhi] - Xmax / 2.) / (y[xhi - 1] - y[xhi])
-    else:
-        xhi = xhi + (Xmax / 2. - y[xhi]) / (y[xhi] - y[xhi + 1])
+    # double gaussian fit with analytic jacobian, cached per histogram (residualFit)
+    summary, popt = residualFit.fitHistogram(x, bins)
+    print('np.sum(x): {}, mean: {}, std: {}, peak_n: {}, abs(std_n): {}, peak_w: {}, abs(std_w): {}, ratio: {}, mean_n: {}, sigma: {}, fwhm: {}, chi2ndf: {}'.format(*summary))
 
-    # calculate FWHM sigma
-    fwhm = binwidth * (xhi - xlo) / 2.3548
-
-    print('np.sum(x): {}, mean: {}, std: {}, peak_n: {}, abs(std_n): {}, peak_w: {}, abs(std_w): {}, ratio: {}, mean_n: {}, sigma: {}, fwhm: {}, chi2ndf: {}'.format(np.sum(x), mean, std, peak_n, abs(std_n), peak_w, abs(std_w), ratio, mean_n, sigma, fwhm, chi2ndf))
-
-    return (np.sum(x), mean, std, peak_n, abs(std_n), peak_w, abs(std_w), ratio, mean_n, sigma, fwhm, chi2ndf)
+    return summary
 
 
 def fitResidual(x, bins, chamber, axes):
@@ -518,6 +466,26 @@ def fitResidual(x, bins, chamber, axes):
     np.sum(x), mean, std, peak_n, abs(std_n), peak_w, abs(std_w), ratio, mean_n, sigma, fwhm, chi2ndf), axes
 
 
+# draw a residual histogram and its fit done before (residualFit summary and fitted parameters), same plot as
+# fitResidual without fitting again
+def drawResidualFit(x, bins, summary, popt, chamber, axes):
+    binwidth = 2000 / len(x)
+    bins = bins[1:]
+    axes.set_xlabel('Residual [um]', fontsize=15)
+    axes.set_title('%s_residual' % chamber, fontsize=15, color='r')
+    axes.plot(bins + binwidth / 2., x, drawstyle='steps', label='Residual_hist')
+    axes.plot(bins, x, 'b.', label='Residual_point')
+
+    x_n = np.linspace(-1000, 1000, 200)
+    res1 = axes.plot(x_n, doubleG_fit(x_n, *popt), 'r-', label='DoubleGaussianFitting')
+    axes.text(-1010, np.max(x) * 0.52, \
+              "Entries = %d\nMean =  %.2f$\mu$m\nStd Dev = %.2f\n-----------------------\npeak1 = %.2f\n$\sigma_1=%.3f\mu$m\npeak2 = %.2f\n$\sigma_2=%.3f\mu$m\n$A_1/A_2=%.3f$\n$\mu=%.3f\mu$m\n$\sigma_{aw}=%.3f\mu$m\n$\sigma_{fwhm}=%.3f\mu \
+               $m\n$\chi^2$/ndf=%.3f" % tuple(summary), backgroundcolor='linen', fontsize=12)
+    axes.legend()
+    axes.grid(True)
+    return res1, tuple(summary), axes
+
+
 # function for T0/Tmax fit
 # p0 : pedestal , A0 : amplitude, t0 : t0, T : leading edge slope
 # initial parameters p0=[0,np.max(y),0,0.3]
@@ -594,6 +562,12 @@ def fitRtRes(rtData):
     # define the splitBin by checking sMDT or MDT chamber
     calibName = rtData.split('/')[-1][3:-4]
     chamberName = chamberlist.MDThardname(chamberlist.MDTindex(calibName))
+    return (calibName, chamberName) + fitRtPoints(rnp.values, tnp.values, renp.values, chamberName)
+
+
+# RT and resolution polynomial fit of rt points (radius r [mm], drift time t [ns] sorted, resolution rerr [mm])
+# returns splitDriftTime, diffJointPoint, zs, zs_residuals, zs_ndf, zl, zl_residuals, zl_ndf, z, residuals, ndf
+def fitRtPoints(rnp, tnp, renp, chamberName):
     splitBin = 13  # sMDT = 25  MDT = 13
     searchMaxRange = 150
     if (chamberName[:3] in ['BME', 'BMG']):
@@ -617,7 +591,7 @@ def fitRtRes(rtData):
     yyy = np.subtract(np.polyval(zl, xxx), np.polyval(zs, xxx))
     # find the index of change sign element, if no index is found, return the smallest diffJoint
     idx = np.where(yyy[:-1] * yyy[1:] < 0)[0] + 1
-    if idx != []:
+    if len(idx) > 0:
         splitDriftTime = xxx[idx[0]]
         diffJointPoint = yyy[idx[0]]
     else:
@@ -626,26 +600,18 @@ def fitRtRes(rtData):
     # print(chamberName,idx,splitDriftTime,diffJointPoint)
     # get residual mean and std for rt and res, also save splitRadius
 
-    return calibName, chamberName, splitDriftTime, diffJointPoint, zs, zs_residuals, zs_ndf, zl, zl_residuals, zl_ndf, z, residuals, ndf
+    return splitDriftTime, diffJointPoint, zs, zs_residuals, zs_ndf, zl, zl_residuals, zl_ndf, z, residuals, ndf
 
 
 # function to load RT parameters from csv dataframe file
 def getRtRes(rtDb, chamber):
-    # Draw RT function by loading 'UM6608_RtResFit.csv'
-    df_RtResFit = pd.read_csv(rtDb)
-    # da = df_RtResFit[df_RtResFit['chamber'] == 'BIL2A01']
-    da = df_RtResFit[df_RtResFit['chamber'] == chamber]
-
-    zs = np.array([float(x) for x in da.values[0][5][1:-1].split(', ')])
-    zl = np.array([float(x) for x in da.values[0][8][1:-1].split(', ')])
-    z = np.array([float(x) for x in da.values[0][11][1:-1].split(', ')])
-    splitDriftTime = float(da.values[0][3])
+    # RT function constants from 'UM6608_RtResFit.csv', file parsed once per process (rtResDatabase)
+    return rtResDatabase.loadRtDb(rtDb).getRtRes(chamber)
 
-    return splitDriftTime, zs, zl, z
 
-
-def t_to_r(rtDb):
-    pass
+def t_to_r(rtDb, chamber, t):
+    # drift radius of drift times t (piecewise zs/zl RT function of the chamber), from the rtTable lookup table
+    return rtTable.loadRtTables(rtDb, chamber).radius(t, chamber)
 
 
 # draw RT and Resolution functions
@@ -666,8 +632,14 @@ def preProcessSegmentHits(pd_event):
             pd_event[col] = pd_event[col].apply(lambda x: [float(y) for y in x[1:-1].split(', ')])
 
     pd_event_ex = pd.concat([pd_event[i].explode() for i in mdt_cols], axis=1)
-    pd_event_ex[['mdt_chamber', 'mdt_ml', 'mdt_ly', 'mdt_tb']] = pd_event_ex['mdt_tubeInfo'].str.strip("\'").str.split(
-        '-', expand=True, n=4)
+    # tube names converted once into the integer tube key (muonfixedid), chamber/ml/ly/tb decoded from it
+    tubeId = chamberlist.MDTmfidArray(pd_event_ex['mdt_tubeInfo'].values)
+    idx = chamberlist.MDTindexMfid(tubeId)
+    pd_event_ex['mdt_tubeId'] = tubeId
+    pd_event_ex['mdt_chamber'] = np.where(idx >= 0, chamberlist.mdtTable['hardname'][idx], '')
+    pd_event_ex['mdt_ml'] = np.where(tubeId >= 0, muonfixedid.mdtMultilayer(tubeId), -1)
+    pd_event_ex['mdt_ly'] = np.where(tubeId >= 0, muonfixedid.mdtTubeLayer(tubeId), -1)
+    pd_event_ex['mdt_tb'] = np.where(tubeId >= 0, muonfixedid.mdtTube(tubeId), -1)
 
     return pd_event_ex
 
@@ -886,16 +858,23 @@ def convertRtConstants(da):
 
 
 # Efficiency plots
+# df : segment dataframe, or dataConverted file name : only mdt_r, rTrk_new and unbias_rTrk_new of the segments
+# with seg_chi2 < chi2cut are read from the columnar cache
 def drawEfficiency(df, run, chamber, chi2cut, resolution_constants):
     # load data columns
-    unbias = df.mdt_rTrk_unbias
-    new = df.mdt_rTrk_new
-    r = df.mdt_r
-    resi = df.mdt_resi
-    f_unbias = conv(unbias)
-    f_new = conv(new)
-    f_r = conv(r)
-    f_resi = conv(resi)
+    if isinstance(df, str):
+        seg = columnarCache.loadSegments(df, columns=['mdt_r', 'rTrk_new', 'unbias_rTrk_new'],
+                                         cuts=['seg_chi2 < %g' % chi2cut])
+        f_unbias = seg.flat('unbias_rTrk_new')
+        f_new = seg.flat('rTrk_new')
+        f_r = seg.flat('mdt_r')
+    else:
+        unbias = df.mdt_rTrk_unbias
+        new = df.mdt_rTrk_new
+        r = df.mdt_r
+        f_unbias = conv(unbias)
+        f_new = conv(new)
+        f_r = conv(r)
     resi = np.abs(f_r) - np.abs(f_new)
     resi_new = np.abs(f_r) - np.abs(f_new)
     resi_unbias = np.abs(f_r) - np.abs(f_unbias)
@@ -909,35 +888,12 @@ def drawEfficiency(df, run, chamber, chi2cut, resolution_constants):
     resSigma = np.polyval(resolution_constants, np.abs(f_new)) / 1000.
     print(resSigma)
 
-    # create a new dataframe for calcuating efficiency
-    df_eff = pd.DataFrame({'radius': f_r, 'rTrk_new': f_new, 'rTrk_unbias': f_unbias, 'res_Sigma': resSigma,
-                           'resi_unbias': np.abs(resi_unbias)})
-    print(df_eff.shape)
-
-    df_eff['sigma3_flag'] = df_eff.apply(check_3sigma, axis=1)
-    df_eff['sigma5_flag'] = df_eff.apply(check_5sigma, axis=1)
-    df_eff['sigmaHardware_flag'] = df_eff.apply(check_hardware, axis=1)
-
-    df_eff.head()
-
-    # set radius interval
-    startSlice = np.arange(0.1, maxRadius, step)
-    stopSlice = np.append(startSlice[1:], maxRadius)
-    branchBasket = list(zip(*(startSlice, stopSlice)))
-
-    n3_eff = []
-    n5_eff = []
-    h_eff = []
-    for n in range(len(branchBasket)):
-        radius_filter = (df_eff.rTrk_new < branchBasket[n][1]) & (df_eff.rTrk_new > branchBasket[n][0])
-        count3 = df_eff.sigma3_flag[radius_filter]
-        # print(n,len(count3),np.sum(count3))
-        n3_eff.append(100.0 * np.sum(count3) / len(count3))
-        count5 = df_eff.sigma5_flag[radius_filter]
-        n5_eff.append(100.0 * np.sum(count5) / len(count5))
-        count_h = df_eff.sigmaHardware_flag[radius_filter]
-        # print(n,len(count),np.sum(count))
-        h_eff.append(100.0 * np.sum(count_h) / len(count_h))
+    # efficiency flags as boolean arrays, counted per radius slice in one pass
+    flags = efficiency.efficiencyFlags(resi_unbias, resSigma, f_unbias, maxRadius, nSigma=[3, 5])
+    eff = efficiency.binnedEfficiency(flags, f_new, efficiency.radiusSlices(maxRadius, step))
+    n3_eff = eff['sigma3']
+    n5_eff = eff['sigma5']
+    h_eff = eff['hardware']
 
     print(n3_eff, n5_eff, h_eff)
 
@@ -956,13 +912,14 @@ def drawEfficiency(df, run, chamber, chi2cut, resolution_constants):
 
     ax.grid()
     ax.legend(fontsize=20)
-    plt.suptitle('Run%s_%s_Efficiency_chi2cut%s' % (run, chamber, minChi2), fontsize=20)
+    plt.suptitle('Run%s_%s_Efficiency_chi2cut%s' % (run, chamber, chi2cut), fontsize=20)
 
-    plt.savefig('Run%s_%s_Efficiency_chi2cut%d.png' % (run, chamber, minChi2))
+    plt.savefig('Run%s_%s_Efficiency_chi2cut%d.png' % (run, chamber, chi2cut))
 
 
 # function to plot the resolution
-def plotResolution(df, chamber):
+# fits : residualFit.chamberFits of the chamber residuals if already done (not fitted again)
+def plotResolution(df, chamber, fits=None):
     # load df and prepare the data array
     unbias = df.unbias_rTrk_new
     new = df.rTrk_new
@@ -985,58 +942,12 @@ def plotResolution(df, chamber):
 
     print('lengths of resi_def uncut: ', len(resi_def))
 
-    # fit chamber reisudal and calculate chamber R = sqrt(bias*unbias)
-    # x,bins = np.histogram(f_resi*1000,bins = np.arange(-1000,1000,20))
-    # mdtCalib_functions.fitResidualFast(x,bins,chamber)
-    x, bins = np.histogram(resi_new * 1000, bins=np.arange(-1000, 1000, 20))
-    fit_bias = fitResidualFast(x, bins, chamber)
-
-    x, bins = np.histogram(resi_unbias * 1000, bins=np.arange(-1000, 1000, 20))
-    fit_unbias = fitResidualFast(x, bins, chamber)
-
-    sigma_fit = fit_bias[9]
-    sigma_hit = fit_unbias[9]
-    R = np.sqrt(sigma_fit * sigma_hit)
-    res_chamber = sigma_fit, sigma_hit, R
+    # fit chamber residual and all radius slices (one histogram2d pass, warm started and cached fits)
+    # chamber R = sqrt(bias*unbias)
+    res_chamber, res, def_w, bias_w, unbias_w = residualFit.resolutionVsRadius(f_r, f_new, f_unbias, resi_def, chamber,
+                                                                               fits=fits)
     print("sigma_fit", "sigma_hit", "R")
-    print(sigma_fit, sigma_hit, R)
-
-    # fit residual in radius slice
-    maxRadius, maxDriftTime, step, npad = 14.6, 800.0, 1, 16
-    # splitBin = 13  # sMDT = 25  MDT = 13
-    if (chamber[:3] in ['BME', 'BMG']):
-        maxRadius, maxDriftTime, step, npad = 7.1, 200.0, 1, 8
-
-    # test radius slice filter
-    startSlice = np.arange(0.1, maxRadius, step)
-    stopSlice = np.append(startSlice[1:], maxRadius)
-    # startSlice+=1
-    # startEvt[0] =0
-    branchBasket = list(zip(*(startSlice, stopSlice)))
-    # print(branchBasket)
-    print('len of branchBasket: ', len(branchBasket))
-    def_w = []
-    bias_w = []
-    unbias_w = []
-    for n in range(len(branchBasket)):
-        radius_filter = (f_new < branchBasket[n][1]) & (f_new > branchBasket[n][0])
-        print('lengths of resi_def : ', len(resi_def[radius_filter]), 'cut number: ', n)
-        x, bins = np.histogram(resi_def[radius_filter] * 1000, bins=np.arange(-1000, 1000, 20))
-        fit_result = fitResidualFast(x, bins, chamber)
-        # print(n,fit_result[1][8],fit_result[1][9])
-        def_w.append(fit_result[9])
-
-        x1, bins1 = np.histogram(resi_new[radius_filter] * 1000, bins=np.arange(-1000, 1000, 20))
-        fit_result1 = fitResidualFast(x1, bins1, chamber)
-        # print(n,fit_result[1][8],fit_result[1][9])
-        bias_w.append(fit_result1[9])
-
-        x2, bins2 = np.histogram(resi_unbias[radius_filter] * 1000, bins=np.arange(-1000, 1000, 20))
-        fit_result2 = fitResidualFast(x2, bins2, chamber)
-        # print(n,fit_result2[1][8],fit_result2[1][9])
-        unbias_w.append(fit_result2[9])
-
-    res = np.sqrt(np.array(bias_w) * np.array(unbias_w))
+    print(*res_chamber)
 
     return res_chamber, res, def_w, bias_w, unbias_w
 
@@ -1044,17 +955,15 @@ def plotResolution(df, chamber):
 # function to draw reference resolution plots
 def drawReferenceRtResolution(ax, chamber):
     # draw reference resolution
-    df_RtResFit = pd.read_csv('UM6608_RtResFit.csv')
-    df_RtResFit_old = pd.read_csv('UM5666_RtResFit.csv')
+    rtDb_new = rtResDatabase.loadRtDb('UM6608_RtResFit.csv')
+    rtDb_old = rtResDatabase.loadRtDb('UM5666_RtResFit.csv')
     # referenceChamber = 'EEL1A01'
     maxR = 15
     if chamber[:3] in ['BMG', 'BME']:
         #        referenceChamber = 'BME4A13'
         maxR = 7.5
-    MDT_new = df_RtResFit[df_RtResFit['chamber'] == chamber]
-    MDT_old = df_RtResFit_old[df_RtResFit_old['chamber'] == chamber]
-    MDT_newConstants = convertRtConstants(MDT_new)
-    MDT_oldConstants = convertRtConstants(MDT_old)
+    MDT_newConstants = rtDb_new.convertRtConstants(chamber)
+    MDT_oldConstants = rtDb_old.convertRtConstants(chamber)
 
     xxx = np.linspace(0, maxR, 1000)
     res_new = ax.plot(xxx, np.polyval(MDT_newConstants[2], xxx), color='red', lw = 1)
@@ -1091,16 +1000,17 @@ def drawResolution(df, run, chamber):
     ax2 = plt.subplot(grid[1, 0])
     ax = plt.subplot(grid[0:, 1:])
 
-    x, bins = np.histogram(resi_new * 1000, bins=np.arange(-1000, 1000, 20))
-    _, fit_bias, _ = fitResidual(x, bins, chamber, ax1)
+    # chamber residual histograms fitted once (residualFit), drawn here and reused by plotResolution
+    fits = residualFit.chamberFits(resi_new, resi_unbias)
+    _, fit_bias, _ = drawResidualFit(fits['hist'][0], fits['bins'], fits['fits'][0], fits['popt'][0], chamber, ax1)
     ax1.set_title('%s Bias_residual(Fit residual)' % chamber)
 
-    x, bins = np.histogram(resi_unbias * 1000, bins=np.arange(-1000, 1000, 20))
-    _, fit_unbias, _ = fitResidual(x, bins, chamber, ax2)
+    _, fit_unbias, _ = drawResidualFit(fits['hist'][1], fits['bins'], fits['fits'][1], fits['popt'][1], chamber,
+                                       ax2)
     ax2.set_title('%s Unbias_residual(Hit residual)' % chamber)
 
     if df.shape[0] > 0:
-        res_chamber, resolution, def_w, bias_w, unbias_w = plotResolution(df, chamber)
+        res_chamber, resolution, def_w, bias_w, unbias_w = plotResolution(df, chamber, fits)
         print(resolution, def_w, bias_w, unbias_w)
 
         # if resolution == 0 : continue
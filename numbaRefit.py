@@ -0,0 +1,174 @@
+import math
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# optional Numba backend of the batch refit (batchRefit.applyCombinedRefit(..., backend='numba'))
+# the candidate line scan of reconStraightLine_minChi2 (4 tangent lines per hit pair, distance to all hits, chi2,
+# min chi2 line, closest approaching points, line fit) is compiled in nopython mode and run one segment per
+# prange iteration, biased refit and all unbias refits (one per removed hit) of a segment in the same iteration
+# when Numba is not installed available is False and batchRefit stays on the NumPy kernels
+#
+#  How to use:
+# import numbaRefit
+# if numbaRefit.available:
+#     flag, m, b, unbias_rTrk = numbaRefit.combinedKernel(locY, locZ, np.abs(radial), nHits, resSigma, 7.1)
+
+available = numba is not None
+
+if available:
+    njit, prange = numba.njit, numba.prange
+else:
+    # kernels are plain python without Numba, only defined so the module can be imported
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+    prange = range
+
+
+# tangent points of circle (xc,yc,rc) seen from point (xo,yo), same as mdtCalib_functions.tangentLines touch
+@njit(cache=True, error_model='numpy')
+def _touch(xc, yc, rc, xo, yo):
+    dx, dy = xo - xc, yo - yc
+    d2 = dx ** 2 + dy ** 2
+    s = rc * np.sqrt(d2 - rc ** 2)
+    rc2 = rc ** 2
+    return (rc2 * dx + dy * s) / d2 + xc, (rc2 * dy - dx * s) / d2 + yc, \
+        (rc2 * dx - dy * s) / d2 + xc, (rc2 * dy + dx * s) / d2 + yc
+
+
+# the 4 tangent lines of one circle pair into out (4, 4), same as mdtCalib_functions.tangentLines
+@njit(cache=True, error_model='numpy')
+def _tangentPair(x1, y1, r1, x2, y2, r2, out):
+    # make sure r1 >= r2, swap circles otherwise
+    if r1 < r2:
+        x1, y1, r1, x2, y2, r2 = x2, y2, r2, x1, y1, r1
+
+    # outer tangent lines through outer intersection point, inner ones through inner intersection point
+    xo = (x2 * r1 - x1 * r2) / (r1 - r2)
+    yo = (y2 * r1 - y1 * r2) / (r1 - r2)
+    out[0, 0], out[0, 1], out[1, 0], out[1, 1] = _touch(x1, y1, r1, xo, yo)
+    out[0, 2], out[0, 3], out[1, 2], out[1, 3] = _touch(x2, y2, r2, xo, yo)
+    xi = (x2 * r1 + x1 * r2) / (r1 + r2)
+    yi = (y2 * r1 + y1 * r2) / (r1 + r2)
+    out[2, 0], out[2, 1], out[3, 0], out[3, 1] = _touch(x1, y1, r1, xi, yi)
+    out[2, 2], out[2, 3], out[3, 2], out[3, 3] = _touch(x2, y2, r2, xi, yi)
+
+    # degenerate cases
+    if r1 == 0 and r2 == 0:
+        for l in range(4):
+            out[l, 0], out[l, 1], out[l, 2], out[l, 3] = x1, y1, x2, y2
+    elif r1 == r2:
+        theta = np.pi / 2. if x2 - x1 == 0 else math.atan((y2 - y1) / (x2 - x1))
+        sin, cos = r1 * math.sin(theta), r1 * math.cos(theta)
+        out[0, 0], out[0, 1], out[0, 2], out[0, 3] = x1 + sin, y1 - cos, x2 + sin, y2 - cos
+        out[1, 0], out[1, 1], out[1, 2], out[1, 3] = x1 - sin, y1 + cos, x2 - sin, y2 + cos
+    elif r2 == 0:
+        xs1, ys1, xs2, ys2 = _touch(x1, y1, r1, x2, y2)
+        out[0, 0], out[0, 1], out[0, 2], out[0, 3] = xs1, ys1, x2, y2
+        out[2, 0], out[2, 1], out[2, 2], out[2, 3] = xs1, ys1, x2, y2
+        out[1, 0], out[1, 1], out[1, 2], out[1, 3] = xs2, ys2, x2, y2
+        out[3, 0], out[3, 1], out[3, 2], out[3, 3] = xs2, ys2, x2, y2
+
+
+# reconStraightLine_minChi2 of the hits idx[:nFit] of one segment (tangent lines with radius r),
+# chi2 w.r.t. the first nEval hits of y, z, evalR with weights w, lines : (maxHits - 1, 4, 4) work array
+# returns flag, m, b of the refitted line, vertical line m = inf at x = b (mdtCalib_functions.fitLines)
+@njit(cache=True, error_model='numpy')
+def _refitHits(y, z, r, idx, nFit, evalR, w, nEval, chi2Max, lines):
+    if nFit < 2:
+        return False, 0., 0.
+    for p in range(nFit - 1):
+        i, k = idx[p], idx[p + 1]
+        _tangentPair(y[i], z[i], r[i], y[k], z[k], r[k], lines[p])
+
+    # min chi2 tangent line, first one in (pair, line) order
+    min_chi2, min_m, min_b = np.inf, np.nan, np.nan
+    for p in range(nFit - 1):
+        for l in range(4):
+            m = (lines[p, l, 3] - lines[p, l, 1]) / (lines[p, l, 2] - lines[p, l, 0])
+            b = lines[p, l, 1] - m * lines[p, l, 0]
+            norm = 1. / np.sqrt(m ** 2 + 1)
+            chi2 = 0.
+            for k in range(nEval):
+                rTrk = abs(m * y[k] - z[k] + b) * norm
+                chi2 += (evalR[k] - rTrk) ** 2 * w[k]
+            chi2 /= nEval - 1
+            if chi2 < min_chi2:
+                min_chi2, min_m, min_b = chi2, m, b
+    flag = (min_chi2 < chi2Max) and (min_m != 0.) and (min_b != 0.)
+    norm = 1. / np.sqrt(min_m ** 2 + 1)
+
+    # closest approaching point of each hit circle, straight line fit from the sums (origin first point)
+    n, Sx, Sy, Sxx, Sxy, x0, y0 = 0, 0., 0., 0., 0., np.nan, np.nan
+    for h in range(nFit):
+        best, bx, by = np.inf, np.nan, np.nan
+        for c in range(8):
+            p, l = (h - 1, c) if c < 4 else (h, c - 4)
+            if p < 0 or p >= nFit - 1:
+                continue
+            px, py = (lines[p, l, 2], lines[p, l, 3]) if c < 4 else (lines[p, l, 0], lines[p, l, 1])
+            d = abs(min_m * px - py + min_b) * norm
+            if d < best:
+                best, bx, by = d, px, py
+        if not (np.isfinite(bx) and np.isfinite(by)):
+            continue
+        if n == 0:
+            x0, y0 = bx, by
+        dx, dy = bx - x0, by - y0
+        n += 1
+        Sx += dx
+        Sy += dy
+        Sxx += dx * dx
+        Sxy += dx * dy
+    if n < 2:
+        return False, np.nan, np.nan
+    det = n * Sxx - Sx * Sx
+    if det <= 1e-12 * n * Sxx:
+        return flag, np.inf, Sx / n + x0
+    m_refit = (n * Sxy - Sx * Sy) / det
+    b_refit = (Sy - m_refit * Sx) / n + y0 - m_refit * x0
+    flag = flag and np.isfinite(m_refit) and np.isfinite(b_refit)
+    return flag, m_refit, b_refit
+
+
+# same as batchRefit._combinedKernel, one segment per prange iteration, radial = |mdt_r|
+# returns flag, m, b of the biased refit and padded unbias rTrk
+@njit(cache=True, parallel=True, error_model='numpy')
+def combinedKernel(locY, locZ, radial, nHits, resSigma, maxRadius):
+    nSeg, width = locY.shape
+    flag = np.zeros(nSeg, dtype=np.bool_)
+    m_refit = np.zeros(nSeg)
+    b_refit = np.zeros(nSeg)
+    unbias_rTrk = np.full((nSeg, width), np.nan)
+    for s in prange(nSeg):
+        n = nHits[s]
+        y, z, r = locY[s], locZ[s], radial[s]
+        w = 1. / resSigma[s] ** 2
+        lines = np.empty((max(width - 1, 1), 4, 4))
+        idx = np.arange(width)
+        rClip = np.minimum(r, maxRadius)
+        flag[s], m_refit[s], b_refit[s] = _refitHits(y, z, rClip, idx, n, r, w, n, 9990., lines)
+
+        # unbias refit, each hit removed in turn
+        for j in range(n):
+            unbias_rTrk[s, j] = -99.
+        if n < 4:
+            continue
+        keep = np.empty(width, dtype=idx.dtype)
+        for j in range(n):
+            q = 0
+            for k in range(n):
+                if k != j:
+                    keep[q] = k
+                    q += 1
+            f, m, b = _refitHits(y, z, r, keep, n - 1, r, w, n, 999., lines)
+            if f:
+                unbias_rTrk[s, j] = abs(y[j] - b) if np.isinf(m) else abs(m * y[j] - z[j] + b) / np.sqrt(m * m + 1)
+    return flag, m_refit, b_refit, unbias_rTrk
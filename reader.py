@@ -5,6 +5,7 @@ import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
 import mdtfunctions
 import new_mdtCalib_functions
+import segmentCuts
 
 
 
@@ -15,18 +16,9 @@ run = '437124'
 print('initial shape: ', df.shape[0])
 
 chi2Cut = 5
-df = df[~(df.seg_chi2 > chi2Cut)]
-
-print('all chamber segments : ', df.shape[0])
-# apply driftTime cut and nSegHits cut
-if chamber[:3] in ['BMG', 'BME']:
-    df['cut_t'] = df['mdt_t'].apply(lambda x : all(-5 < float(ss) < 195 for ss in x[1:-1].split(', ')))
-    df = df[df['cut_t']]
-    df = df[df['seg_nMdtHits'] > 6]
-else:
-    df['cut_t'] = df['mdt_t'].apply(lambda x : all(-5 < float(ss) < 750 for ss in x[1:-1].split(', ')))
-    df = df[df['cut_t']]
-    df = df[df['seg_nMdtHits'] > 5]
+# chi2 cut, driftTime cut and nSegHits cut (segmentCuts 'reader' preset)
+df, flow = segmentCuts.applyPreset(df, chamber, 'reader', chi2=(None, chi2Cut))
+print('all chamber segments : ', flow[1][1])
 print('all segments after cut : ', df.shape[0])
 
 # load resolution functions
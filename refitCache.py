@@ -0,0 +1,143 @@
+import os, hashlib
+import numpy as np
+import pandas as pd
+import batchRefit
+
+
+# content addressed cache of the refit results (batchRefit.refitSegments outputs)
+# one cache file per chamber and hash of the refit constants (resolution polynomial, maxRadius, refit backend), so
+# a new calibration file only invalidates the chambers whose constants changed, and numba and numpy results (rounding
+# differs, near-equal candidate lines can pick a different refit) are never mixed
+# segments are identified by event number and tube set, but entries are keyed by a hash of the identity and all
+# refit inputs (hit positions, mdt_r, mdt_rTrk, default track) : a change of any input, e.g. only mdt_rTrk, gives
+# a new entry and the segment is refitted, the old entry of the same identity is dropped unless still used
+#
+#  How to use:
+# import refitCache
+# flag, rTrk_new, chi2_new, chi2_def, m, b, unbias_rTrk_new = refitCache.cachedRefitSegments(df, resolution_constants,
+#                                                                                            'BMG2C14')
+#       => same outputs as batchRefit.refitSegments, cache files in refitCache/BMG2C14_<hash>.npz
+
+# refit code version, part of the constants hash so changed refit code does not reuse old results
+refitVersion = 1
+
+# columns identifying a segment, and columns of the refit inputs
+identityColumns = ['event_eventNumber', 'mdt_tubeInfo']
+inputColumns = ['mdt_posY', 'mdt_posZ', 'mdt_r', 'mdt_rTrk', 'seg_posY', 'seg_posZ', 'seg_dirY', 'seg_dirZ']
+
+# per segment outputs and padded per hit outputs of the cache file
+segmentOutputs = ['flag', 'chi2_new', 'chi2_def', 'refit_m', 'refit_b']
+hitOutputs = ['rTrk_new', 'unbias_rTrk_new']
+
+
+# hash of the constants used by the refit of a chamber, backend : refit backend ('auto' resolved)
+def constantsHash(resolution_constants, chamber, backend='auto'):
+    maxRadius = 14.6
+    if chamber[:3] in ['BMG', 'BME']:
+        maxRadius = 7.1
+    data = np.asarray(resolution_constants, dtype=float).tobytes() + np.float64(maxRadius).tobytes()
+    data += batchRefit.resolveBackend(backend).encode()
+    return hashlib.sha1(data + str(refitVersion).encode()).hexdigest()[:16]
+
+
+# cache file of a chamber refitted with resolution_constants
+def cacheFile(chamber, resolution_constants, cacheDir='refitCache', backend='auto'):
+    return os.path.join(cacheDir, '%s_%s.npz' % (chamber, constantsHash(resolution_constants, chamber, backend)))
+
+
+# 64 bit content key (segment identity + refit inputs) and segment identity (event number + tube set) of every row
+# without tube names (mdt_tubeInfo) the tube set is given by the tube positions
+def segmentKeys(df):
+    identity = [col for col in identityColumns if col in df]
+    if 'mdt_tubeInfo' not in df:
+        identity += ['mdt_posY', 'mdt_posZ']
+    columns = df[list(dict.fromkeys(identity + inputColumns))].astype(str)
+    key = pd.util.hash_pandas_object(columns, index=False).values
+    identity = pd.util.hash_pandas_object(columns[identity], index=False).values
+    return key, identity
+
+
+# cache content as dict of arrays sorted by key, empty if no cache file
+def loadCache(file):
+    if not os.path.exists(file):
+        return None
+    with np.load(file) as data:
+        return {name: data[name] for name in data.files}
+
+
+# write cache atomically (temporary file + rename), so killed jobs never leave a broken cache
+def saveCache(file, cache):
+    os.makedirs(os.path.dirname(file) or '.', exist_ok=True)
+    tmp = file + '.tmp.npz'
+    np.savez(tmp, **cache)
+    os.replace(tmp, file)
+
+
+# cache entries (flat per hit outputs) of refitted segments
+def _cacheEntries(key, identity, nHits, results):
+    flag, rTrk_new, chi2_new, chi2_def, refit_m, refit_b, unbias_rTrk_new = results
+    hitOK = np.arange(rTrk_new.shape[1])[None, :] < nHits[:, None]
+    return {'key': key, 'identity': identity, 'nHits': nHits, 'flag': flag, 'chi2_new': chi2_new,
+            'chi2_def': chi2_def, 'refit_m': refit_m, 'refit_b': refit_b, 'rTrk_new': rTrk_new[hitOK],
+            'unbias_rTrk_new': unbias_rTrk_new[hitOK]}
+
+
+# merge new entries into the cache sorted by key, old entries of changed segments (same identity) are dropped
+# unless their key is still used (usedKeys)
+def _mergeCache(cache, entries, usedKeys):
+    if cache is None:
+        merged = entries
+    else:
+        keep = ~np.isin(cache['key'], entries['key']) & (~np.isin(cache['identity'], entries['identity'])
+                                                         | np.isin(cache['key'], usedKeys))
+        oldHit = np.repeat(keep, cache['nHits'])
+        merged = {name: np.concatenate([cache[name][oldHit if name in hitOutputs else keep], entries[name]])
+                  for name in entries}
+    # per hit outputs follow their segment
+    order = np.argsort(merged['key'], kind='stable')
+    counts = merged['nHits'][order]
+    starts = np.concatenate([[0], np.cumsum(merged['nHits'])])[order]
+    hitOrder = np.repeat(starts - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts) + np.arange(np.sum(counts))
+    return {name: merged[name][hitOrder if name in hitOutputs else order] for name in merged}
+
+
+# batchRefit.refitSegments with the cache : only new segments and segments with changed inputs are refitted
+def cachedRefitSegments(df, resolution_constants, chamber, cacheDir='refitCache', backend='auto'):
+    backend = batchRefit.resolveBackend(backend)
+    if len(df) == 0:
+        return batchRefit.refitSegments(df, resolution_constants, chamber, backend)
+    file = cacheFile(chamber, resolution_constants, cacheDir, backend)
+    cache = loadCache(file)
+    key, identity = segmentKeys(df)
+    nHits = df.mdt_posY.astype(str).str.count(',').values + 1
+
+    # cache lookup
+    found = np.zeros(len(df), dtype=bool)
+    if cache is not None and len(cache['key']) > 0:
+        row = np.clip(np.searchsorted(cache['key'], key), 0, len(cache['key']) - 1)
+        found = (cache['key'][row] == key) & (cache['nHits'][row] == nHits)
+
+    # refit missing segments, once per key
+    missing = np.nonzero(~found)[0]
+    print('refit', len(missing), 'of', len(df), 'segments, cache', file)
+    if len(missing) > 0:
+        newKey, first = np.unique(key[missing], return_index=True)
+        rows = missing[first]
+        results = batchRefit.refitSegments(df.iloc[rows], resolution_constants, chamber, backend)
+        cache = _mergeCache(cache, _cacheEntries(newKey, identity[rows], nHits[rows], results), key)
+        saveCache(file, cache)
+    row = np.searchsorted(cache['key'], key)
+
+    # outputs of all rows from the cache
+    width = np.max(nHits)
+    offsets = np.concatenate([[0], np.cumsum(cache['nHits'])])
+    hitIdx = offsets[row][:, None] + np.arange(width)[None, :]
+    hitOK = np.arange(width)[None, :] < nHits[:, None]
+    out = {}
+    for name in hitOutputs:
+        out[name] = np.full((len(df), width), np.nan)
+        out[name][hitOK] = cache[name][hitIdx[hitOK]]
+    for name in segmentOutputs:
+        out[name] = cache[name][row]
+    return out['flag'], out['rTrk_new'], out['chi2_new'], out['chi2_def'], out['refit_m'], out['refit_b'], \
+        out['unbias_rTrk_new']
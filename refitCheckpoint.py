@@ -0,0 +1,149 @@
+import os, json, hashlib
+import numpy as np
+import pandas as pd
+import batchRefit
+import refitCache
+
+
+# checkpointed, resumable refit of a chamber dataframe
+# the rows are refitted in chunks, every finished chunk is written to its own .npz file in workDir and recorded
+# in a small manifest (manifest.json : job key, chunk ranges, file checksums), both written atomically
+# a restarted job (same input, constants and chunk size) skips the recorded chunks and only refits the rest,
+# the assembled outputs are the same arrays as an uninterrupted run, so the final output is byte-identical
+# the refit backend ('auto' resolved to numba or numpy) is part of the job key and of the manifest, resuming a job
+# of workDir with another backend raises instead of mixing chunks of both backends
+#
+#  How to use:
+# import refitCheckpoint
+# flag, rTrk_new, chi2_new, chi2_def, m, b, unbias_rTrk_new = refitCheckpoint.checkpointedRefitSegments(
+#     df, resolution_constants, 'BMG2C14', 'refitCheckpoint/run437124_region0104_BMG2C14')
+#       => same outputs as batchRefit.refitSegments, refit=refitCache.cachedRefitSegments to use the refit cache
+# refitCheckpoint.writeCsv(outfinal, 'dataConverted/run437124_region0104_BMG2C14.csv')   # atomic to_csv
+
+manifestName = 'manifest.json'
+
+# order of the refitSegments outputs in the chunk files, padded per hit outputs
+outputNames = ['flag', 'rTrk_new', 'chi2_new', 'chi2_def', 'refit_m', 'refit_b', 'unbias_rTrk_new']
+paddedOutputs = ['rTrk_new', 'unbias_rTrk_new']
+
+
+# key of a refit job : refit inputs of all rows, refit constants, refit backend and chunk size
+def jobKey(df, resolution_constants, chamber, chunkSize, backend='auto'):
+    columns = [col for col in refitCache.inputColumns if col in df]
+    rows = pd.util.hash_pandas_object(df[columns].astype(str), index=False).values
+    data = rows.tobytes() + refitCache.constantsHash(resolution_constants, chamber, backend).encode() + str(
+        chunkSize).encode()
+    return hashlib.sha1(data).hexdigest()
+
+
+def fileChecksum(file):
+    with open(file, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+# write through a temporary file, flushed to disk and renamed, a killed job leaves the old file or the new one,
+# never a partial one
+def _atomicWrite(file, write):
+    tmp = file + '.tmp'
+    write(tmp)
+    with open(tmp, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, file)
+
+
+# manifest of workDir, new empty manifest if missing or of another job
+# raises ValueError if workDir holds completed chunks of the refit backend other than backend (resolved)
+def loadManifest(workDir, key, nRows, backend='auto'):
+    backend = batchRefit.resolveBackend(backend)
+    file = os.path.join(workDir, manifestName)
+    if os.path.exists(file):
+        with open(file) as f:
+            manifest = json.load(f)
+        if manifest.get('backend', backend) != backend and manifest.get('chunks'):
+            raise ValueError('%s : refit started with backend %s, cannot resume with backend %s (pass backend=%r or '
+                             'use a new workDir)' % (workDir, manifest['backend'], backend, manifest['backend']))
+        if manifest.get('key') == key and manifest.get('nRows') == nRows:
+            manifest['backend'] = backend
+            return manifest
+    return {'key': key, 'nRows': nRows, 'backend': backend, 'chunks': []}
+
+
+def saveManifest(workDir, manifest):
+    def write(tmp):
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=1)
+    _atomicWrite(os.path.join(workDir, manifestName), write)
+
+
+# chunks of the manifest whose files are still there and unchanged, by start row
+def completedChunks(workDir, manifest):
+    done = {}
+    for chunk in manifest['chunks']:
+        file = os.path.join(workDir, chunk['file'])
+        if os.path.exists(file) and fileChecksum(file) == chunk['sha1']:
+            done[chunk['start']] = chunk
+    return done
+
+
+def saveChunk(file, results, nHits):
+    arrays = dict(zip(outputNames, results))
+    arrays['nHits'] = nHits
+    def write(tmp):
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+    _atomicWrite(file, write)
+
+
+def loadChunk(file):
+    with np.load(file) as data:
+        return [data[name] for name in outputNames]
+
+
+# concatenate chunk outputs, padded per hit outputs padded to the widest chunk (nan)
+def assembleChunks(parts):
+    width = max([part[outputNames.index(name)].shape[1] for part in parts for name in paddedOutputs] + [0])
+    out = []
+    for k, name in enumerate(outputNames):
+        arrays = [part[k] for part in parts]
+        if name in paddedOutputs:
+            arrays = [np.pad(x, ((0, 0), (0, width - x.shape[1])), constant_values=np.nan) for x in arrays]
+        out.append(np.concatenate(arrays))
+    return tuple(out)
+
+
+# batchRefit.refitSegments in checkpointed chunks of chunkSize rows, resumed from the completed chunks of workDir
+# refit : refit function of a dataframe chunk with the refitSegments signature and outputs
+# backend : refit backend passed to refit ('auto', 'numpy' or 'numba'), recorded in the manifest
+def checkpointedRefitSegments(df, resolution_constants, chamber, workDir, chunkSize=10000,
+                              refit=batchRefit.refitSegments, backend='auto'):
+    backend = batchRefit.resolveBackend(backend)
+    if len(df) == 0:
+        return refit(df, resolution_constants, chamber, backend=backend)
+    os.makedirs(workDir, exist_ok=True)
+    key = jobKey(df, resolution_constants, chamber, chunkSize, backend)
+    manifest = loadManifest(workDir, key, len(df), backend)
+    done = completedChunks(workDir, manifest)
+    manifest['chunks'] = [done[start] for start in sorted(done)]
+    nHits = df.mdt_posY.astype(str).str.count(',').values + 1
+
+    parts = []
+    for start in range(0, len(df), chunkSize):
+        stop = min(start + chunkSize, len(df))
+        file = os.path.join(workDir, 'chunk_%09d_%09d.npz' % (start, stop))
+        if start in done and done[start]['stop'] == stop:
+            parts.append(loadChunk(file))
+            continue
+        print('refit chunk', start, stop, 'of', len(df))
+        results = refit(df.iloc[start:stop], resolution_constants, chamber, backend=backend)
+        saveChunk(file, results, nHits[start:stop])
+        manifest['chunks'].append({'start': start, 'stop': stop, 'file': os.path.basename(file),
+                                   'sha1': fileChecksum(file)})
+        saveManifest(workDir, manifest)
+        parts.append(loadChunk(file))
+    return assembleChunks(parts)
+
+
+# DataFrame.to_csv through a temporary file, the output file is complete or not replaced
+def writeCsv(df, file, **kwargs):
+    _atomicWrite(file, lambda tmp: df.to_csv(tmp, **kwargs))
+    return file
@@ -0,0 +1,223 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from scipy.optimize import curve_fit
+import mdtCalib_functions
+import efficiency
+
+
+# residual fit service for the resolution plots
+# residuals of all radius slices are histogrammed in one 2D pass, the slices are fitted with the
+# double gaussian (analytic jacobian), each slice starting from the parameters of its neighbour slice
+# fit results are cached per histogram (bounded LRU, fitCacheSize entries), so plotting the same histogram again
+# never refits
+#
+#  How to use:
+# import residualFit
+# res_chamber, res, def_w, bias_w, unbias_w = residualFit.resolutionVsRadius(f_r, f_new, f_unbias, resi_def, chamber)
+# fits = residualFit.fitResidualSlices(f_new, resi_new, chamber)   # fits['hist'], fits['fits']
+# res_chamber = residualFit.chamberResolution(resi_new, resi_unbias)  # chamber resolution of all hits
+# fits = residualFit.chamberFits(resi_new, resi_unbias)   # chamber histograms and fits, to draw without refitting
+
+residualBins = np.arange(-1000, 1000, 20)
+
+# order of the fit summary, same as new_mdtCalib_functions.fitResidualFast output
+summaryNames = ['nEntries', 'mean', 'std', 'peak_n', 'std_n', 'peak_w', 'std_w', 'ratio', 'mean_n', 'sigma', 'fwhm',
+                'chi2ndf']
+
+# per process fit cache : hash of histogram and starting parameters -> (summary, popt), least recently used
+# entries dropped above fitCacheSize (a chamber uses ~50 entries)
+fitCacheSize = 1024
+_fitCache = OrderedDict()
+
+
+# analytic jacobian of mdtCalib_functions.doubleG_fit, shape (len(x), 5)
+def doubleG_jac(x, peak1, sigma1, mean, peak2, sigma2):
+    t1 = (x - mean) / sigma1
+    g1 = np.exp(-0.5 * t1 * t1)
+    t2 = (x - mean) / sigma2
+    g2 = np.exp(-0.5 * t2 * t2)
+    return np.stack([g1, peak1 * g1 * t1 * t1 / sigma1, peak1 * g1 * t1 / sigma1 + peak2 * g2 * t2 / sigma2,
+                     g2, peak2 * g2 * t2 * t2 / sigma2], axis=-1)
+
+
+# starting parameters of fitResidualFast
+def initialGuess(x, bins):
+    mean = np.average(bins, weights=x)
+    std = np.sqrt(np.average((bins - mean) ** 2, weights=x))
+    return [max(x), std / 2., mean, max(x) / 10, std * 2]
+
+
+# fit summary of a fitted histogram, same quantities as fitResidualFast
+def fitSummary(x, bins, popt):
+    binwidth = 2000 / len(x)
+    mean = np.average(bins, weights=x)
+    std = np.sqrt(np.average((bins - mean) ** 2, weights=x))
+
+    # chi2/ndf without zero bins
+    zeroFilter = np.where(x != 0)
+    chi2 = np.sum((x[zeroFilter] - mdtCalib_functions.doubleG_fit(bins[zeroFilter], *popt)) ** 2 / x[zeroFilter])
+    ndf = len(x[zeroFilter]) - 5
+    chi2ndf = chi2 / ndf if ndf > 0 else np.nan
+
+    # swap narrow and wide Gaussian peak and sigma
+    peak_n, std_n, mean_n, peak_w, std_w = popt
+    if np.abs(std_n) > np.abs(std_w):
+        peak_n, std_n, peak_w, std_w = peak_w, std_w, peak_n, std_n
+    ratio = abs(peak_n * std_n / (peak_w * std_w))
+    sigma = (peak_n * abs(std_n) + peak_w * abs(std_w)) / (peak_n + peak_w)
+
+    # FWHM sigma, linear interpolation of the half maximum crossing
+    y = mdtCalib_functions.doubleG_fit(bins, *popt)
+    Xmax = np.max(y)
+    XmaxIndex = np.argmax(y)
+    fwhm = np.nan
+    if 0 < XmaxIndex < len(y) - 1:
+        xlo = np.argmin(np.abs(y[:XmaxIndex] - Xmax / 2.))
+        if y[xlo] > Xmax / 2.:
+            xlo = xlo - (y[xlo] - Xmax / 2.) / (y[xlo] - y[xlo - 1])
+        else:
+            xlo = xlo + (Xmax / 2. - y[xlo]) / (y[xlo + 1] - y[xlo])
+        xhi = np.argmin(np.abs(y[XmaxIndex:] - Xmax / 2.)) + XmaxIndex
+        if y[xhi] > Xmax / 2.:
+            xhi = xhi - (y[xhi] - Xmax / 2.) / (y[xhi - 1] - y[xhi])
+        else:
+            xhi = xhi + (Xmax / 2. - y[xhi]) / (y[xhi] - y[xhi + 1])
+        fwhm = binwidth * (xhi - xlo) / 2.3548
+
+    return (np.sum(x), mean, std, peak_n, abs(std_n), peak_w, abs(std_w), ratio, mean_n, sigma, fwhm, chi2ndf)
+
+
+# double gaussian fit of one residual histogram (x, bin edges), cached
+# p0 : starting parameters (e.g. from a neighbour slice), default is the fitResidualFast guess
+# returns fit summary tuple and fitted parameters, nan if empty histogram or failed fit
+def fitHistogram(x, bins, p0=None):
+    x = np.asarray(x, dtype=float)
+    bins = np.asarray(bins, dtype=float)
+    # the fit depends on the warm start, so p0 is part of the key
+    start = np.asarray(p0, dtype=float).tobytes() if p0 is not None else b''
+    key = hashlib.sha1(x.tobytes() + bins.tobytes() + start).hexdigest()
+    if key in _fitCache:
+        _fitCache.move_to_end(key)
+        return _fitCache[key]
+
+    nanResult = (tuple([np.sum(x)] + [np.nan] * (len(summaryNames) - 1)), np.full(5, np.nan))
+    if np.sum(x) <= 0:
+        return nanResult
+    centers = bins[1:]
+    popt = None
+    for guess in ([p0] if p0 is not None else []) + [initialGuess(x, centers)]:
+        try:
+            with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+                popt, _ = curve_fit(mdtCalib_functions.doubleG_fit, centers, x, p0=guess, jac=doubleG_jac,
+                                    maxfev=20000)
+            break
+        except (RuntimeError, ValueError):
+            popt = None
+    if popt is None:
+        result = nanResult
+    else:
+        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            result = (fitSummary(x, centers, popt), popt)
+    _fitCache[key] = result
+    if len(_fitCache) > fitCacheSize:
+        _fitCache.popitem(last=False)
+    return result
+
+
+# residual histograms of all radius slices in one pass, shape (nSlices, nBins)
+# residuals in mm, histogrammed in um like the resolution plots (uniform bins, last edge included as np.histogram)
+# 2D histogram as one np.bincount of the combined (slice, bin) index, much faster than np.histogram2d
+# sliceIdx : efficiency.sliceIndex(radius, edges) if already known
+def sliceHistograms(radius, residuals, edges, bins=residualBins, sliceIdx=None):
+    if sliceIdx is None:
+        sliceIdx = efficiency.sliceIndex(radius, edges)
+    nSlice, nBins = len(edges) - 1, len(bins) - 1
+    values = np.asarray(residuals) * 1000
+    with np.errstate(invalid='ignore'):
+        binIdx = np.floor((values - bins[0]) / (bins[1] - bins[0])).astype(np.int64)
+    binIdx[values == bins[-1]] = nBins - 1
+    ok = (sliceIdx >= 0) & (binIdx >= 0) & (binIdx < nBins) & np.isfinite(values)
+    hist = np.bincount(sliceIdx[ok] * nBins + binIdx[ok], minlength=nSlice * nBins)
+    return hist.reshape(nSlice, nBins)
+
+
+# fit all radius slices, warm started from the neighbour slice, going out from the fullest slice
+# returns dict : 'hist' (nSlices, nBins), 'fits' (nSlices, 12) summaries
+# chamberFit : also 'chamber', summary of all slices summed (only hits inside the slices, see chamberResolution)
+def fitResidualSlices(radius, residuals, chamber, step=1, bins=residualBins, sliceIdx=None, chamberFit=False):
+    maxRadius = 14.6
+    if chamber[:3] in ['BME', 'BMG']:
+        maxRadius = 7.1
+    edges = efficiency.radiusSlices(maxRadius, step)
+    hist = sliceHistograms(radius, residuals, edges, bins, sliceIdx)
+    nSlice = hist.shape[0]
+
+    fits = np.full((nSlice, len(summaryNames)), np.nan)
+    popts = [None] * nSlice
+    start = int(np.argmax(np.sum(hist, axis=1)))
+    order = [start] + [n for k in range(1, nSlice) for n in (start - k, start + k) if 0 <= n < nSlice]
+    for n in order:
+        p0 = None
+        neighbour = n + 1 if n < start else n - 1
+        if n != start and popts[neighbour] is not None and np.all(np.isfinite(popts[neighbour])):
+            # scale the neighbour peaks to this histogram
+            p0 = np.array(popts[neighbour])
+            p0[[0, 3]] *= np.max(hist[n]) / max(np.max(hist[neighbour]), 1)
+        summary, popt = fitHistogram(hist[n], bins, p0)
+        fits[n] = summary
+        popts[n] = popt
+
+    result = {'edges': edges, 'hist': hist, 'fits': fits}
+    if chamberFit:
+        result['chamber'] = fitHistogram(np.sum(hist, axis=0), bins)[0]
+    return result
+
+
+# residual histograms (um) of all hits of a chamber and their fits, biased (resi_new) and unbiased residuals
+# returns dict : 'bins', 'hist' (2, nBins), 'fits' (2, 12) summaries, 'popt' (2, 5) fitted parameters
+def chamberFits(resi_new, resi_unbias, bins=residualBins):
+    hist, fits, popts = [], [], []
+    for residuals in (resi_new, resi_unbias):
+        x, _ = np.histogram(np.asarray(residuals) * 1000, bins=bins)
+        summary, popt = fitHistogram(x, bins)
+        hist.append(x)
+        fits.append(summary)
+        popts.append(popt)
+    return {'bins': bins, 'hist': np.array(hist), 'fits': np.array(fits, dtype=float), 'popt': np.array(popts)}
+
+
+# chamber resolution of all hits, as new_mdtCalib_functions.plotResolution : (sigma_fit, sigma_hit, R)
+# sigma of the biased and unbiased residual fits (summary index 9), R = sqrt(sigma_fit * sigma_hit)
+# fits : chamberFits of the same residuals if already done
+def chamberResolution(resi_new, resi_unbias, bins=residualBins, fits=None):
+    if fits is None:
+        fits = chamberFits(resi_new, resi_unbias, bins)
+    sigma = fits['fits'][:, 9]
+    return sigma[0], sigma[1], np.sqrt(sigma[0] * sigma[1])
+
+
+# chamber and radius slice resolution, same outputs as new_mdtCalib_functions.plotResolution
+# sigma = fit summary index 9, R = sqrt(sigma_bias * sigma_unbias)
+# fits : chamberFits of the residuals if already done (e.g. drawn by new_mdtCalib_functions.drawResolution)
+def resolutionVsRadius(f_r, f_new, f_unbias, resi_def, chamber, step=1, fits=None):
+    f_r, f_new, f_unbias = np.asarray(f_r), np.asarray(f_new), np.asarray(f_unbias)
+    resi_new = np.abs(f_r) - np.abs(f_new)
+    resi_unbias = np.abs(f_r) - np.abs(f_unbias)
+
+    maxRadius = 14.6
+    if chamber[:3] in ['BME', 'BMG']:
+        maxRadius = 7.1
+    sliceIdx = efficiency.sliceIndex(f_new, efficiency.radiusSlices(maxRadius, step))
+    fit_def = fitResidualSlices(f_new, resi_def, chamber, step, sliceIdx=sliceIdx)
+    fit_bias = fitResidualSlices(f_new, resi_new, chamber, step, sliceIdx=sliceIdx)
+    fit_unbias = fitResidualSlices(f_new, resi_unbias, chamber, step, sliceIdx=sliceIdx)
+
+    # chamber fit on all hits (not only the ones in the radius slices)
+    res_chamber = chamberResolution(resi_new, resi_unbias, fits=fits)
+
+    def_w = list(fit_def['fits'][:, 9])
+    bias_w = list(fit_bias['fits'][:, 9])
+    unbias_w = list(fit_unbias['fits'][:, 9])
+    res = np.sqrt(np.array(bias_w) * np.array(unbias_w))
+    return res_chamber, res, def_w, bias_w, unbias_w
@@ -0,0 +1,99 @@
+import numpy as np
+import awkward as ak
+import uproot
+import columnarCache
+import transformer
+
+
+# direct reading of the skimmed calibration ntuples (ROOT files) with uproot, no csv export step
+# tree entries are segments, jagged branches (mdt_*, chamber) have one value per hit
+# files are read in chunks with uproot.iterate, jagged branches stay flat arrays + offsets
+# (columnarCache.SegmentColumns), so the segment pipeline gets the same input as from the csv cache
+# (including the integer tube key column mdt_tubeId, columnarCache.addTubeIds)
+#
+#  How to use:
+# import rootReader
+# for seg in rootReader.iterateSegments(glob.glob('rootdata/skimmed_ntuple_run437124_lb*_region0051.root')):
+#     ...                                                   # one SegmentColumns per chunk
+# chambers = rootReader.readChambers(files)                 # dict hardname -> SegmentColumns
+# seg = rootReader.readChamber(files, 'BMG2A12')
+
+
+# name of the first tree (TTree or RNTuple) in a ROOT file
+def findTree(file):
+    with uproot.open(file) as f:
+        for name, classname in f.classnames().items():
+            if classname in ['TTree', 'ROOT::RNTuple']:
+                return name.split(';')[0]
+    raise ValueError('no TTree found in %s' % file)
+
+
+# convert one uproot/awkward chunk into SegmentColumns
+def chunkToSegments(arrays):
+    columns = list(arrays.fields)
+    values, offsets = {}, {}
+    for name in columns:
+        arr = arrays[name]
+        if arr.ndim > 1:
+            counts = ak.to_numpy(ak.num(arr, axis=1))
+            flat = ak.flatten(arr, axis=1)
+            offsets[name] = columnarCache.countsToOffsets(counts)
+        else:
+            flat = arr
+        try:
+            values[name] = ak.to_numpy(flat)
+        except (ValueError, TypeError):
+            # strings (e.g. chamber, mdt_tubeInfo)
+            values[name] = np.array(ak.to_list(flat), dtype=str)
+    return columnarCache.addTubeIds(columnarCache.SegmentColumns(columns, values, offsets))
+
+
+# chamber hardname of every segment, from the first hit of the chamber (or mdt_chamber) branch
+def segmentChambers(seg):
+    name = 'chamber' if 'chamber' in seg else 'mdt_chamber'
+    if not seg.isList(name):
+        return np.asarray(seg[name], dtype=str)
+    offs = seg.offsets[name]
+    first = np.full(len(seg), '', dtype=seg[name].dtype)
+    nonEmpty = offs[1:] > offs[:-1]
+    first[nonEmpty] = seg[name][offs[:-1][nonEmpty]]
+    return first
+
+
+# iterate over segment chunks of the ROOT files
+# tree : tree name, default is the first TTree of the first file; branches : list of branch names, default all
+def iterateSegments(files, tree=None, branches=None, stepSize='100 MB'):
+    files = sorted(files) if not isinstance(files, str) else [files]
+    if tree is None:
+        tree = findTree(files[0])
+    for arrays in uproot.iterate([{file: tree} for file in files], expressions=branches, step_size=stepSize,
+                                 library='ak'):
+        yield chunkToSegments(arrays)
+
+
+# read segments of all chambers, chunk by chunk, returns dict hardname -> SegmentColumns
+# chambers : hardnames to keep, default all chambers found in the files
+def readChambers(files, chambers=None, tree=None, branches=None, stepSize='100 MB'):
+    parts = {}
+    for seg in iterateSegments(files, tree, branches, stepSize):
+        names = segmentChambers(seg)
+        for chamber in np.unique(names):
+            if chambers is not None and chamber not in chambers:
+                continue
+            parts.setdefault(str(chamber), []).append(seg.select(names == chamber))
+    return {chamber: columnarCache.concatenate(part) for chamber, part in parts.items()}
+
+
+# segments of one chamber
+def readChamber(files, chamber, tree=None, branches=None, stepSize='100 MB'):
+    segments = readChambers(files, [chamber], tree, branches, stepSize)
+    return segments.get(chamber, columnarCache.SegmentColumns([], {}, {}))
+
+
+# chambers of the splitter region in the file names, as transformer.splitFiles
+def regionChambers(files):
+    files = sorted(files) if not isinstance(files, str) else [files]
+    run, region = transformer.runRegionFromFile(files[0])
+    if region is None:
+        return None
+    return transformer.regionChambers(region)
@@ -0,0 +1,158 @@
+import numpy as np
+import mdtCalib_functions
+import rtResDatabase
+import rtTable
+import batchRefit
+import chamberPipeline
+
+
+# RT autocalibration of a chamber from its own segments
+# iteration : drift radius r(t) from the current RT function (rtTable), straight line fit of every segment to the
+# drift circles, residuals r - |d| histogrammed vs drift time, RT points corrected by the mean residual of each time
+# bin and refitted with the fitRtRes polynomial model (mdtCalib_functions.fitRtPoints), until the RT function
+# changes by less than tolerance
+# the padded hit arrays stay in memory for all iterations, only r is recomputed, and the line fit of every segment
+# starts from its line of the previous iteration (first iteration : the segment line of the ntuple), which fixes
+# the left/right ambiguity of the hits, so each iteration is a few closed form weighted line fits of all segments
+#
+#  How to use:
+# import rtAutocal
+# result = rtAutocal.autocalibrate(seg, 'BMG2A12', 'UM6608_RtResFit.csv')     # seg after chamberPipeline.applyCuts
+# result['fit']          # same outputs as mdtCalib_functions.fitRtRes
+# rtAutocal.autocalibrateFiles(glob.glob('dataConverted/run437124_region*_*.csv'), 'UM6608_RtResFit.csv',
+#                              'Run437124_RtResFit.csv')                       # *_RtResFit.csv of all chambers
+
+# number of RT points (time bins), same as the rt files of fitRtRes
+nRtPoints = 100
+
+
+# drift time window of the RT points, same as the chamberPipeline.applyCuts time cut
+def timeWindow(chamber):
+    if chamber[:3] in ['BMG', 'BME']:
+        return 186.
+    return 750.
+
+
+# padded hit arrays of the segments of a chamber, kept for all iterations
+# starting line y = a * z + c of every segment from the segment position and direction
+def prepareSegments(seg):
+    nHits = seg.counts('mdt_t')
+    data = {name: batchRefit.padFlat(seg.flat(col), nHits)
+            for name, col in [('y', 'mdt_posY'), ('z', 'mdt_posZ'), ('t', 'mdt_t')]}
+    data['hitOK'] = np.arange(data['t'].shape[1])[None, :] < nHits[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        data['a'] = seg['seg_dirY'] / seg['seg_dirZ']
+    data['c'] = seg['seg_posY'] - data['a'] * seg['seg_posZ']
+    return data
+
+
+# line fit y = a * z + c of all segments to the drift circles (y, z, r), warm started from the lines (a, c)
+# the sign s of every hit (side of the line) is taken from the current line and the circles are replaced by the
+# points y - s * r * sqrt(1 + a^2) on the line, hits more than maxPull sigma away from the line are not used
+# returns a, c and signed distance d of all hits to the fitted line
+def fitSegmentLines(y, z, r, sigma, a, c, nIter=3, maxPull=5.):
+    a, c = a.copy(), c.copy()
+    for _ in range(nIter):
+        norm = np.sqrt(1 + a ** 2)[:, None]
+        d = (y - a[:, None] * z - c[:, None]) / norm
+        s = np.where(d < 0, -1., 1.)
+        with np.errstate(invalid='ignore'):
+            w = np.where(np.abs(np.abs(d) - r) < maxPull * sigma, 1. / sigma ** 2, 0.)
+        aNew, cNew = mdtCalib_functions.fitLines(z, y - s * r * norm, w)
+        ok = np.isfinite(aNew) & np.isfinite(cNew)
+        a, c = np.where(ok, aNew, a), np.where(ok, cNew, c)
+    d = (y - a[:, None] * z - c[:, None]) / np.sqrt(1 + a ** 2)[:, None]
+    return a, c, d
+
+
+# mean and standard deviation of the residuals per time bin, mean and std recomputed within 3 std of the first pass
+# empty bins give nan
+def binnedResiduals(t, residuals, tEdges):
+    nBins = len(tEdges) - 1
+    idx = np.clip(np.searchsorted(tEdges, t, side='right') - 1, 0, nBins - 1)
+    mean, std = np.full(nBins, np.nan), np.full(nBins, np.nan)
+    use = np.isfinite(residuals)
+    for _ in range(2):
+        n = np.bincount(idx[use], minlength=nBins)
+        s1 = np.bincount(idx[use], weights=residuals[use], minlength=nBins)
+        s2 = np.bincount(idx[use], weights=residuals[use] ** 2, minlength=nBins)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(n > 0, s1 / n, np.nan)
+            std = np.where(n > 1, np.sqrt(np.maximum(s2 / n - mean ** 2, 0)), np.nan)
+        cut = 3 * np.where(np.isfinite(std) & (std > 0), std, np.inf)
+        use = np.isfinite(residuals) & (np.abs(residuals - mean[idx]) < cut[idx])
+    return mean, std, n
+
+
+# RT points of the next iteration : r(t) of the time bin centers corrected by the mean residual, resolution from
+# the residual width, bins with less than minHits hits keep the current RT and resolution
+# the hits are part of the line fit, residual width scaled by sqrt(nHits / (nHits - 2)) (mean hits per segment)
+def correctedRtPoints(tables, t, residuals, tEdges, meanHits, minHits=20):
+    tCenter = (tEdges[:-1] + tEdges[1:]) / 2.
+    rOld = tables.radius(tCenter, 0)
+    mean, std, n = binnedResiduals(t, residuals, tEdges)
+    ok = (n >= minHits) & np.isfinite(mean) & np.isfinite(std)
+    r = np.maximum(np.where(ok, rOld - mean, rOld), 0)
+    rerr = np.where(ok, std * np.sqrt(meanHits / (meanHits - 2.)), tables.sigma(rOld, 0))
+    return r, tCenter, rerr
+
+
+# iterative RT autocalibration of the segments of one chamber, starting from the RT function of rtDb
+# stops when the RT function changes by less than tolerance [mm] in the time window, or after maxIter iterations
+# returns dict : 'fit' (same outputs as mdtCalib_functions.fitRtRes), 'converged', 'nIter', 'change' per iteration
+# verbose : print the RT change of every iteration
+def autocalibrate(seg, chamber, rtDb, maxIter=10, tolerance=0.002, minHits=20, verbose=False):
+    db = rtResDatabase.loadRtDb(rtDb)
+    row = db.index(chamber)
+    calibName = str(db.calibName[row])
+    splitDriftTime, zs, zl, z = db.getRtRes(chamber)
+
+    data = prepareSegments(seg)
+    hitOK = data['hitOK']
+    y = np.where(hitOK, data['y'], np.nan)
+    zPos, t = data['z'], data['t']
+    a, c = data['a'], data['c']
+    tEdges = np.linspace(0, timeWindow(chamber), nRtPoints + 1)
+    tCenter = (tEdges[:-1] + tEdges[1:]) / 2.
+    meanHits = np.mean(np.sum(hitOK, axis=1))
+
+    fit, changes, converged = None, [], False
+    for it in range(maxIter):
+        tables = rtTable.RtTables([chamber], [splitDriftTime], zs[None, :], zl[None, :], z[None, :])
+        r = np.where(hitOK, tables.radius(t, 0), np.nan)
+        sigma = np.where(hitOK, tables.sigma(r, 0), np.nan)
+        a, c, d = fitSegmentLines(y, zPos, r, sigma, a, c)
+
+        residuals = (r - np.abs(d))[hitOK]
+        rPoints, tPoints, rerrPoints = correctedRtPoints(tables, t[hitOK], residuals, tEdges, meanHits, minHits)
+        fit = mdtCalib_functions.fitRtPoints(rPoints, tPoints, rerrPoints, chamber)
+        splitDriftTime, zs, zl, z = fit[0], fit[2], fit[5], fit[8]
+
+        # change of the RT function in the time window
+        rNew = rtTable.piecewiseRt(tCenter, splitDriftTime, zs, zl)
+        changes.append(float(np.max(np.abs(rNew - tables.radius(tCenter, 0)))))
+        if verbose:
+            print('autocalibration', chamber, 'iteration', it, 'max RT change [mm]', changes[-1])
+        if changes[-1] < tolerance:
+            converged = True
+            break
+
+    return {'fit': (calibName, chamber) + tuple(fit), 'converged': converged, 'nIter': len(changes),
+            'change': np.array(changes)}
+
+
+# autocalibration of the chambers of dataConverted/ROOT files (chamberPipeline.loadChamber, applyCuts), results
+# written to outFile in the *_RtResFit.csv format, chambers with minSegments or less segments are skipped
+def autocalibrateFiles(files, rtDb, outFile, chambers=None, minChi2=1000, minSegments=500, **kwargs):
+    files = list(files)
+    if chambers is None:
+        chambers = [file[-11:-4] for file in files]
+    fits = []
+    for file, chamber in zip(files, chambers):
+        seg = chamberPipeline.applyCuts(chamberPipeline.loadChamber(file, chamber), chamber, minChi2)
+        if len(seg) <= minSegments:
+            print('autocalibration', chamber, 'skipped,', len(seg), 'segments')
+            continue
+        fits.append(autocalibrate(seg, chamber, rtDb, **kwargs)['fit'])
+    rtResDatabase.writeRtDb(outFile, fits)
+    return fits
@@ -0,0 +1,135 @@
+import os
+import numpy as np
+import pandas as pd
+import columnarCache
+
+
+# RT / resolution constants database of the *_RtResFit.csv calibration files (UM6608_RtResFit.csv, ...)
+# each file is parsed once per process into typed arrays (one row per chamber), indexed by chamber (hardname)
+# and calibName, and stored in a binary .npz sidecar in a cache directory (rtDbCache/ next to the csv) so later
+# processes skip the csv parsing
+#
+#  How to use:
+# import rtResDatabase
+# db = rtResDatabase.loadRtDb('UM6608_RtResFit.csv')
+# splitDriftTime, zs, zl, z = db.getRtRes('BMG2A12')     # same as mdtCalib_functions.getRtRes
+# db.getRtRes('BMG_6_1')                                  # calibName works too
+# db.para_res[db.index(['BMG2A12', 'BMG4A12'])]          # (nChambers, 5) resolution polynomials
+# db = rtResDatabase.loadRtDb('UM6608_RtResFit.csv', cacheDir='/tmp/rtDbCache')   # sidecar in another directory
+# rtResDatabase.writeRtDb('Run437124_RtResFit.csv', fits)  # fits : list of mdtCalib_functions.fitRtRes outputs
+
+# list columns of the calibration file, stored as (nChambers, nPar) arrays
+listColumns = ['para_smallRt', 'residual_smallRt', 'para_largeRt', 'residual_largeRt', 'para_res', 'residual_res']
+scalarColumns = ['splitDriftTime', 'diffJointPoint', 'ndf_smallRt', 'ndf_largeRt', 'ndf_res']
+
+# per process memo : absolute csv path -> (csv mtime, RtResConstants)
+_rtDbCache = {}
+
+
+class RtResConstants:
+    def __init__(self, calibName, chamber, values):
+        self.calibName = np.asarray(calibName, dtype=str)
+        self.chamber = np.asarray(chamber, dtype=str)
+        self.values = values
+        for name in listColumns + scalarColumns:
+            setattr(self, name, values[name])
+        # chamber hardname and calibName -> row
+        self.rows = {name: i for i, name in enumerate(self.calibName)}
+        self.rows.update({name: i for i, name in enumerate(self.chamber)})
+
+    def __len__(self):
+        return len(self.chamber)
+
+    def __contains__(self, chamber):
+        return chamber in self.rows
+
+    # row of a chamber (hardname or calibName), or array of rows for a list of chambers
+    def index(self, chamber):
+        try:
+            if isinstance(chamber, str):
+                return self.rows[chamber]
+            return np.array([self.rows[name] for name in chamber], dtype=int)
+        except KeyError as e:
+            raise KeyError('chamber %s not found in RT database' % e.args[0])
+
+    # same outputs as mdtCalib_functions.getRtRes
+    def getRtRes(self, chamber):
+        i = self.index(chamber)
+        return float(self.splitDriftTime[i]), self.para_smallRt[i].copy(), self.para_largeRt[i].copy(), \
+            self.para_res[i].copy()
+
+    # same outputs as new_mdtCalib_functions.convertRtConstants
+    def convertRtConstants(self, chamber):
+        i = self.index(chamber)
+        return self.para_smallRt[i].copy(), self.para_largeRt[i].copy(), self.para_res[i].copy(), \
+            float(self.splitDriftTime[i]), float(self.diffJointPoint[i])
+
+    def save(self, file):
+        np.savez(file, calibName=self.calibName, chamber=self.chamber, **self.values)
+
+
+# parse a calibration csv file, polynomial lists are left padded with 0 if of different length
+def parseRtDb(rtDb):
+    df = pd.read_csv(rtDb)
+    values = {}
+    for name in listColumns:
+        flat, counts = columnarCache.parseListColumn(df[name])
+        width = np.max(counts) if len(counts) > 0 else 0
+        arr = np.zeros((len(counts), width))
+        arr[np.arange(width)[None, :] >= (width - counts)[:, None]] = flat
+        values[name] = arr
+    for name in scalarColumns:
+        values[name] = df[name].values
+    return RtResConstants(df['calibName'].values, df['chamber'].values, values)
+
+
+# column order of the fitRtRes outputs in the calibration file
+fitColumns = ['calibName', 'chamber', 'splitDriftTime', 'diffJointPoint', 'para_smallRt', 'residual_smallRt',
+              'ndf_smallRt', 'para_largeRt', 'residual_largeRt', 'ndf_largeRt', 'para_res', 'residual_res', 'ndf_res']
+
+
+# list column entry as written in the calibration files, '[1.2, 3.4]'
+def formatList(values):
+    return '[' + ', '.join(repr(float(x)) for x in np.atleast_1d(values)) + ']'
+
+
+# write fitRtRes outputs (one tuple per chamber) as a calibration csv file readable by loadRtDb
+def writeRtDb(rtDb, fits):
+    df = pd.DataFrame([list(fit) for fit in fits], columns=fitColumns)
+    for name in listColumns:
+        df[name] = [formatList(x) for x in df[name]]
+    for name in ['splitDriftTime', 'diffJointPoint']:
+        df[name] = df[name].astype(float)
+    df.to_csv(rtDb)
+    return rtDb
+
+
+# binary sidecar file name of a calibration csv file, cacheDir relative to the directory of the csv
+def sidecarPath(rtDb, cacheDir='rtDbCache'):
+    directory = os.path.join(os.path.dirname(os.path.abspath(rtDb)), cacheDir)
+    return os.path.join(directory, os.path.splitext(os.path.basename(rtDb))[0] + '.npz')
+
+
+# load the RT constants of a calibration csv file, memoized per process
+# the binary sidecar is used if newer than the csv, and (re)written otherwise
+def loadRtDb(rtDb, cacheDir='rtDbCache'):
+    path = os.path.abspath(rtDb)
+    mtime = os.path.getmtime(path)
+    cached = _rtDbCache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    sidecar = sidecarPath(path, cacheDir)
+    if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= mtime:
+        with np.load(sidecar) as data:
+            db = RtResConstants(data['calibName'], data['chamber'],
+                                {name: data[name] for name in listColumns + scalarColumns})
+    else:
+        db = parseRtDb(path)
+        try:
+            os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+            db.save(sidecar)
+        except OSError:
+            pass
+    _rtDbCache[path] = (mtime, db)
+    return db
@@ -0,0 +1,174 @@
+import os
+import numpy as np
+import rtResDatabase
+import columnarCache
+import chamberlist
+
+
+# r(t) and sigma(r) lookup tables of the *_RtResFit.csv calibration files
+# the piecewise RT function of each chamber (zs for t < splitDriftTime, zl otherwise, as mdtCalib_functions.getRtRes)
+# and the resolution polynomial are evaluated once on a fine uniform grid, hits are converted by linear interpolation
+# of the table row of their chamber, so millions of hits of many chambers are one vectorized gather, no np.polyval
+# t grid : 0 .. maxDriftTime (200 ns sMDT, 800 ns MDT), r grid : 0 .. maxRadius, values outside are clamped
+# with the default grids the interpolation error is < 1e-5 mm (well below the diffJointPoint of the RT functions)
+#
+#  How to use:
+# import rtTable
+# tables = rtTable.loadRtTables('UM6608_RtResFit.csv', ['BMG2A12', 'BIL1A01'])
+# r = tables.radius(t, 'BMG2A12')                        # same as piecewise np.polyval(zs/zl, t)
+# sigma = tables.sigma(r, tables.index(hitChambers))     # per hit chamber rows, sigma in mm
+# seg = rtTable.recalibrateSegments(seg, 'BMG2A12', 'UM5666_RtResFit.csv')   # new mdt_r and mdt_resSigma columns
+
+# per process memo : (absolute csv path, chambers, grid sizes) -> (csv mtime, RtTables)
+_tableCache = {}
+
+
+# drift time window and tube radius of a chamber type, same as chamberPipeline.chamberConstants
+def tableRange(chamber):
+    if chamber[:3] in ['BME', 'BMG']:
+        return 200.0, 7.1
+    return 800.0, 14.6
+
+
+# piecewise RT function of one chamber, r = zs(t) for t < splitDriftTime and zl(t) otherwise
+def piecewiseRt(t, splitDriftTime, zs, zl):
+    t = np.asarray(t, dtype=float)
+    return np.where(t < splitDriftTime, np.polyval(zs, t), np.polyval(zl, t))
+
+
+# linear interpolation in the uniform grid rows table[row] (start x0[row], step dx[row]), clamped at the ends
+# nan inputs (e.g. padding of padded hit arrays) give nan
+def _interpolate(table, x0, dx, x, row):
+    n = table.shape[1]
+    pos = np.clip((np.asarray(x, dtype=float) - x0[row]) / dx[row], 0, n - 1)
+    valid = np.isfinite(pos)
+    pos = np.where(valid, pos, 0.)
+    i = np.minimum(pos.astype(np.int64), n - 2)
+    frac = pos - i
+    flat = table.reshape(-1)
+    i = i + row * n
+    return np.where(valid, flat[i] + frac * (flat[i + 1] - flat[i]), np.nan)
+
+
+class RtTables:
+    # chamber : hardnames, one table row per chamber, other arguments (nChambers, ...) arrays as in RtResConstants
+    def __init__(self, chamber, splitDriftTime, para_smallRt, para_largeRt, para_res, nT=4001, nR=2001):
+        self.chamber = np.asarray(chamber, dtype=str)
+        self.rows = {name: i for i, name in enumerate(self.chamber)}
+        ranges = np.array([tableRange(name) for name in self.chamber]).reshape(-1, 2)
+        self.tMax, self.rMax = ranges[:, 0], ranges[:, 1]
+        self.dt = self.tMax / (nT - 1)
+        self.dr = self.rMax / (nR - 1)
+        self.t0 = np.zeros(len(self.chamber))
+        self.r0 = np.zeros(len(self.chamber))
+
+        # grids of all chambers at once, polynomials evaluated with Horner's scheme along the coefficient axis
+        tGrid = np.linspace(0, 1, nT)[None, :] * self.tMax[:, None]
+        rGrid = np.linspace(0, 1, nR)[None, :] * self.rMax[:, None]
+        rs, rl, res = np.zeros_like(tGrid), np.zeros_like(tGrid), np.zeros_like(rGrid)
+        for k in range(para_smallRt.shape[1]):
+            rs = rs * tGrid + para_smallRt[:, k, None]
+        for k in range(para_largeRt.shape[1]):
+            rl = rl * tGrid + para_largeRt[:, k, None]
+        for k in range(para_res.shape[1]):
+            res = res * rGrid + para_res[:, k, None]
+        self.rTable = np.where(tGrid < np.asarray(splitDriftTime, dtype=float)[:, None], rs, rl)
+        self.sigmaTable = res / 1000.
+
+    def __len__(self):
+        return len(self.chamber)
+
+    def __contains__(self, chamber):
+        return chamber in self.rows
+
+    # table row of a chamber hardname, or array of rows for a list/array of hardnames (e.g. one per hit)
+    def index(self, chamber):
+        try:
+            if isinstance(chamber, str):
+                return self.rows[chamber]
+            names, inverse = np.unique(np.asarray(chamber, dtype=str), return_inverse=True)
+            return np.array([self.rows[name] for name in names], dtype=int)[inverse.reshape(-1)]
+        except KeyError as e:
+            raise KeyError('chamber %s not found in RT tables' % e.args[0])
+
+    # rows of chamber given as hardname, row number or array of per hit rows
+    def _rows(self, chamber):
+        if isinstance(chamber, str):
+            return self.index(chamber)
+        chamber = np.asarray(chamber)
+        if chamber.dtype.kind in 'US':
+            return self.index(chamber)
+        return chamber.astype(np.int64)
+
+    # drift radius [mm] of drift times t [ns]
+    def radius(self, t, chamber):
+        return _interpolate(self.rTable, self.t0, self.dt, t, self._rows(chamber))
+
+    # resolution [mm] at drift radius r (sign ignored), same as np.polyval(para_res, np.abs(r)) / 1000.
+    def sigma(self, r, chamber):
+        return _interpolate(self.sigmaTable, self.r0, self.dr, np.abs(r), self._rows(chamber))
+
+
+# lookup tables of the chambers of a calibration file, memoized per process
+# chambers : hardnames or calibNames, default all chambers of the file
+def loadRtTables(rtDb, chambers=None, nT=4001, nR=2001):
+    db = rtResDatabase.loadRtDb(rtDb)
+    path = os.path.abspath(rtDb)
+    mtime = os.path.getmtime(path)
+    if chambers is None:
+        chambers = db.chamber
+    chambers = [chambers] if isinstance(chambers, str) else list(chambers)
+    key = (path, tuple(chambers), nT, nR)
+    cached = _tableCache.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    rows = db.index(chambers)
+    tables = RtTables(chambers, db.splitDriftTime[rows], db.para_smallRt[rows], db.para_largeRt[rows],
+                      db.para_res[rows], nT, nR)
+    _tableCache[key] = (mtime, tables)
+    return tables
+
+
+# mdt_r of a SegmentColumns recomputed from mdt_t with the RT functions of rtDb, sign of the old mdt_r is kept,
+# and mdt_resSigma : resolution sigma(r) [mm] of rtDb at the new radius
+# chamber : hardname, or None to take the chamber of every hit from mdt_tubeId (mdt_tubeInfo if no mdt_tubeId),
+# hits whose tube id or name gives no chamber, or a chamber without RT function in rtDb, get mdt_r = nan
+# refit columns of the file (rTrk_new, unbias_rTrk_new) depend on the old radius and are dropped
+def recalibrateSegments(seg, chamber, rtDb):
+    t = np.asarray(seg.flat('mdt_t'), dtype=float)
+    db = rtResDatabase.loadRtDb(rtDb)
+    if chamber is None:
+        if columnarCache.tubeIdColumn in seg:
+            idx = chamberlist.MDTindexMfid(seg.flat(columnarCache.tubeIdColumn))
+            hitChamber = np.where(idx >= 0, chamberlist.mdtTable['hardname'][idx], '')
+        else:
+            hitChamber = np.char.partition(seg.flat('mdt_tubeInfo').astype(str), '-')[:, 0]
+        names, inverse = np.unique(hitChamber, return_inverse=True)
+        known = np.array([name in chamberlist.chamberNameIndex and name in db for name in names], dtype=bool)
+        valid = known[inverse.reshape(-1)]
+        r = np.full(len(t), np.nan)
+        sigma = np.full(len(t), np.nan)
+        if np.any(valid):
+            tables = loadRtTables(rtDb, names[known])
+            rows = tables.index(hitChamber[valid])
+            r[valid] = tables.radius(t[valid], rows)
+            sigma[valid] = tables.sigma(r[valid], rows)
+    else:
+        if chamber not in db:
+            raise KeyError('chamber %s not found in RT database %s' % (chamber, rtDb))
+        tables = loadRtTables(rtDb, chamber)
+        r = tables.radius(t, chamber)
+        sigma = tables.sigma(r, chamber)
+    if 'mdt_r' in seg:
+        r = np.where(seg.flat('mdt_r') < 0, -r, r)
+
+    columns = [name for name in seg.columns if name not in ['rTrk_new', 'unbias_rTrk_new']]
+    values = {name: seg.values[name] for name in columns}
+    offsets = {name: seg.offsets[name] for name in columns if name in seg.offsets}
+    for name, value in [('mdt_r', r), ('mdt_resSigma', sigma)]:
+        values[name] = value
+        if name not in columns:
+            columns.append(name)
+            offsets[name] = seg.offsets['mdt_t']
+    return columnarCache.SegmentColumns(columns, values, offsets)
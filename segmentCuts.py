@@ -0,0 +1,149 @@
+import re
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import columnarCache
+
+
+# segment cut engine with named cut presets per chamber type (sMDT BMG/BME, MDT)
+# a cut keeps the segments with low < value < high (closed=True : low <= value <= high, None = no limit)
+# nan values fail the cut, keepNan=True keeps them (cuts written as ~(value > high))
+# for list columns (mdt_t, ...) all hits of the segment have to be inside, evaluated on the flat hit array with
+# np.minimum.reduceat / np.maximum.reduceat over the segment offsets, no per segment python loop
+# works on columnarCache.SegmentColumns and on dataConverted dataframes (list-in-string columns)
+# every cut is evaluated once on all segments, the cut flow reports the segments left after each cut in order
+#
+#  How to use:
+# import segmentCuts
+# seg, flow = segmentCuts.applyPreset(seg, 'BMG2A12', 'efficiency')       # seg : SegmentColumns or DataFrame
+# segmentCuts.printCutFlow(flow)
+# cuts = segmentCuts.presetCuts('BIL1A01', 'efficiency', chi2=(None, 500))  # preset with changed limits
+# seg, flow = segmentCuts.applyPreset(seg, 'BMG2A12', 'efficiency', chi2=None)  # preset without the chi2 cut
+# mask, flow = segmentCuts.cutMask(seg, cuts)
+# cut = segmentCuts.parseCut('0 < mdt_t < 186')              # cut expression, as in columnarCache.loadSegments
+
+Cut = namedtuple('Cut', ['name', 'column', 'low', 'high', 'closed', 'keepNan'], defaults=[False, False])
+
+# cut presets of the analysis scripts, per chamber type
+cutPresets = {
+    # efficiency and resolution scripts (5SigmaEfficiencyForAll.py, EfficiencyPlotting.py, chamberPipeline)
+    'efficiency': {
+        'sMDT': [Cut('chi2', 'seg_chi2', None, 1000), Cut('driftTime', 'mdt_t', 0, 186),
+                 Cut('nHits', 'seg_nMdtHits', 6, None)],
+        'MDT': [Cut('chi2', 'seg_chi2', None, 1000), Cut('driftTime', 'mdt_t', 0, 750),
+                Cut('nHits', 'seg_nMdtHits', 5, None)],
+    },
+    # reader.py : tight chi2 cut and wide drift time window, segments with nan chi2 are kept (~(chi2 > 5))
+    'reader': {
+        'sMDT': [Cut('chi2', 'seg_chi2', None, 5, True, True), Cut('driftTime', 'mdt_t', -5, 195),
+                 Cut('nHits', 'seg_nMdtHits', 6, None)],
+        'MDT': [Cut('chi2', 'seg_chi2', None, 5, True, True), Cut('driftTime', 'mdt_t', -5, 750),
+                Cut('nHits', 'seg_nMdtHits', 5, None)],
+    },
+}
+
+
+# cut from an expression 'column < value', 'column > value' or 'low < column < high' (<= / >= : closed cut)
+def parseCut(expr):
+    match = re.fullmatch(r'\s*(?:([-+.\deE]+)\s*(<=?)\s*)?(\w+)\s*([<>]=?)\s*([-+.\deE]+)\s*', expr)
+    if match is None:
+        raise ValueError('cannot parse cut expression %r' % expr)
+    low, lowOp, column, op, value = match.groups()
+    if low is not None and op[0] != '<':
+        raise ValueError('cannot parse cut expression %r' % expr)
+    ops = [x for x in (lowOp, op) if x is not None]
+    if len(set(x.endswith('=') for x in ops)) > 1:
+        raise ValueError('mixed < and <= in cut expression %r' % expr)
+    closed = ops[0].endswith('=')
+    if op[0] == '<':
+        return Cut(expr.strip(), column, float(low) if low is not None else None, float(value), closed)
+    return Cut(expr.strip(), column, float(value), None, closed)
+
+
+# chamber type of the cut presets
+def chamberType(chamber):
+    if chamber[:3] in ['BMG', 'BME']:
+        return 'sMDT'
+    return 'MDT'
+
+
+# cuts of a preset for a chamber, limits : cut name -> (low, high) replacing the preset limits, or None to drop the
+# cut (e.g. already applied by columnarCache.loadSegments)
+def presetCuts(chamber, preset='efficiency', **limits):
+    cuts = []
+    for cut in cutPresets[preset][chamberType(chamber)]:
+        if cut.name in limits and limits[cut.name] is None:
+            continue
+        if cut.name in limits:
+            cut = cut._replace(low=limits[cut.name][0], high=limits[cut.name][1])
+        cuts.append(cut)
+    return cuts
+
+
+# segment level values, or flat hit values and offsets of a list column
+def _columnValues(seg, column):
+    if isinstance(seg, pd.DataFrame):
+        if columnarCache.isListColumn(seg[column]):
+            flat, counts = columnarCache.parseListColumn(seg[column])
+            return flat, columnarCache.countsToOffsets(counts)
+        return seg[column].values.astype(float), None
+    if seg.isList(column):
+        return seg.flat(column), seg.offsets[column]
+    return np.asarray(seg[column], dtype=float), None
+
+
+# min and max of every segment of a flat hit array, segments without hits give +inf / -inf
+def segmentMinMax(flat, offsets):
+    counts = np.diff(offsets)
+    nSeg = len(counts)
+    lo, hi = np.full(nSeg, np.inf), np.full(nSeg, -np.inf)
+    filled = counts > 0
+    if np.any(filled):
+        # reduceat over the non-empty segments only, empty segments would give the next segment's value
+        starts = offsets[:-1][filled]
+        lo[filled] = np.minimum.reduceat(flat, starts)
+        hi[filled] = np.maximum.reduceat(flat, starts)
+    return lo, hi
+
+
+# segments passing one cut (all hits for list columns)
+def cutPass(seg, cut):
+    values, offsets = _columnValues(seg, cut.column)
+    if offsets is None:
+        lo = hi = values
+    else:
+        lo, hi = segmentMinMax(values, offsets)
+    keep = np.ones(len(lo), dtype=bool)
+    with np.errstate(invalid='ignore'):
+        if cut.low is not None:
+            keep &= (lo >= cut.low) if cut.closed else (lo > cut.low)
+        if cut.high is not None:
+            keep &= (hi <= cut.high) if cut.closed else (hi < cut.high)
+    if cut.keepNan:
+        keep |= np.isnan(lo) | np.isnan(hi)
+    return keep
+
+
+# mask of the segments passing all cuts and cut flow : list of (cut name, segments left), first entry all segments
+def cutMask(seg, cuts):
+    mask = np.ones(len(seg), dtype=bool)
+    flow = [('all', len(seg))]
+    for cut in cuts:
+        mask &= cutPass(seg, cut)
+        flow.append((cut.name, int(np.sum(mask))))
+    return mask, flow
+
+
+# segments passing the cuts of a preset and the cut flow, limits as in presetCuts
+def applyPreset(seg, chamber, preset='efficiency', **limits):
+    mask, flow = cutMask(seg, presetCuts(chamber, preset, **limits))
+    if isinstance(seg, pd.DataFrame):
+        return seg[mask], flow
+    return seg.select(mask), flow
+
+
+def printCutFlow(flow, title=''):
+    total = flow[0][1]
+    print('cut flow', title)
+    for name, n in flow:
+        print('  %-12s %10d  %6.2f %%' % (name, n, 100. * n / total if total > 0 else 0.))
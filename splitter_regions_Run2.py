@@ -4,13 +4,21 @@
 # Contents:
 #  numregions          => Number of regions (208)
 #  regionlist[iregion] => has list of chambers in region iregion [1:208]
-#  getregion(chamber)  => Return region number of given chamber
+#  getregion(chamber)  => Return region number of given chamber (calname or hardname, 0 = no region)
+#  getregions(chambers) => Return region number array of an array/column of calnames or hardnames
+#  chamberRegion       => dict calname/hardname -> region, built once at import
+#  indexRegion         => numpy array chamberlist.mdt[] index -> region
+#  regionChamberIndex[iregion] => numpy array of the chamberlist.mdt[] indices of the chambers in region iregion
 #    
 #  How to use:
 # import splitter_regions_Run2
 # splitter_regions_Run2.getregion('BEE_8_-1')   => returns 204
 # splitter_regions_Run2.regionlist[20]
 #       => returns list: ('BIL_4_3', 'BIL_4_4', 'BML_4_3', 'BML_4_4', 'BOL_4_3', 'BOL_4_4')
+# splitter_regions_Run2.getregions(df.chamber)   => region of every row, one dictionary lookup per distinct name
+
+import numpy as np
+import chamberlist
 
 numregions = 208
 regionlist = '', \
@@ -223,9 +231,28 @@ regionlist = '', \
                ('BEE_5_-2', 'BEE_5_-1', 'BEE_6_-2', 'BEE_6_-1', 'EIL_5_-1', 'EIL_6_-1'), \
                ('BEE_7_-2', 'BEE_7_-1', 'BEE_8_-2', 'BEE_8_-1', 'EIL_7_-1', 'EIL_8_-1')        
 
+#  Inverted index of regionlist, first region wins for chambers listed twice
+chamberRegion = {}
+indexRegion = np.zeros(chamberlist.MAXCHAMBERS, dtype=np.int32)
+regionChamberIndex = [np.zeros(0, dtype=np.int32)]
+for iregion in range(1,numregions+1):
+  idx = []
+  for calname in regionlist[iregion]:
+    chamberRegion.setdefault(calname, iregion)
+    ii = chamberlist.chamberNameIndex.get(calname, -1)
+    if ii >= 0:
+      chamberRegion.setdefault(chamberlist.mdt[ii].hardname, iregion)
+      if indexRegion[ii] == 0:
+        indexRegion[ii] = iregion
+      idx.append(ii)
+  regionChamberIndex.append(np.array(idx, dtype=np.int32))
+
 #  Return region of given chamber
 def getregion(chamber):
-  for iregion in range(1,numregions+1):
-    if chamber in regionlist[iregion]:
-      return iregion
-  return 0  
+  return chamberRegion.get(chamber, 0)
+
+#  Return region array of an array (numpy, pandas column, list) of chamber names
+def getregions(chambers):
+  names, inverse = np.unique(np.asarray(chambers, dtype=str), return_inverse=True)
+  regions = np.array([chamberRegion.get(name, 0) for name in names], dtype=np.int32)
+  return regions[inverse.reshape(-1)]
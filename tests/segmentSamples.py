@@ -0,0 +1,75 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+repoDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+# calibration file of the repository copied to directory, so caches written next to it stay out of the tree
+def copyRtDb(directory, name='UM6608_RtResFit.csv'):
+    file = os.path.join(str(directory), name)
+    shutil.copy(os.path.join(repoDir, name), file)
+    return file
+
+
+def formatList(values):
+    return '[' + ', '.join(repr(float(v)) for v in values) + ']'
+
+
+# synthetic segments of one chamber in the dataConverted format (list-in-string columns), one row per segment
+# straight tracks through 2 multilayers (sMDT : 4 layers of 15.1 mm tubes, MDT : 3 layers of 30 mm tubes),
+# drift radius smeared by 0.1 mm, ntuple track (mdt_rTrk) slightly off the true one
+# radiusToTime : function r [mm] -> t [ns] giving mdt_t, default uniform times in the time window
+def makeSegments(nSeg, chamber='BMG2A12', seed=1, radiusToTime=None, sigma=0.1):
+    rng = np.random.default_rng(seed)
+    sMDT = chamber[:3] in ['BMG', 'BME']
+    pitch, radius, nLayers, mlGap = (15.1, 7.1, 4, 120.) if sMDT else (30.035, 14.6, 3, 200.)
+    layerZ = [ml * mlGap + ly * pitch * 0.866 + 20. for ml in range(2) for ly in range(nLayers)]
+    rows = []
+    for s in range(nSeg):
+        y0, slope = rng.uniform(200, 600), rng.uniform(-0.5, 0.5)
+        slopeTrk, y0Trk = slope + rng.normal(0, 0.002), y0 + rng.normal(0, 0.05)
+        hits = {name: [] for name in ['posY', 'posZ', 'r', 'rTrk', 't', 'tube']}
+        for layer, z in enumerate(layerZ):
+            offset = 0. if layer % 2 == 0 else pitch / 2
+            tube = np.round((y0 + slope * z - offset) / pitch)
+            y = offset + tube * pitch
+            d = abs(y - y0 - slope * z) / np.sqrt(1 + slope * slope)
+            if d > radius - 0.05:
+                continue
+            r = np.clip(d + rng.normal(0, sigma), 0., radius)
+            hits['posY'].append(y)
+            hits['posZ'].append(z)
+            hits['r'].append(r if rng.uniform() < 0.9 else -r)
+            hits['rTrk'].append(abs(y - y0Trk - slopeTrk * z) / np.sqrt(1 + slopeTrk * slopeTrk))
+            hits['t'].append(radiusToTime(d) if radiusToTime is not None else rng.uniform(0, 180 if sMDT else 700))
+            hits['tube'].append('%s-%d-%d-%d' % (chamber, layer // nLayers + 1, layer % nLayers + 1, int(tube) + 1))
+        nHits = len(hits['posY'])
+        if nHits < 3:
+            continue
+        # track y = y0Trk + slopeTrk * z : direction (slopeTrk, 1), position (y0Trk, 0)
+        rows.append({'event_eventNumber': s, 'chamber': str([chamber] * nHits), 'seg_nMdtHits': nHits,
+                     'seg_chi2': rng.uniform(0, 20), 'seg_dirY': slopeTrk, 'seg_dirZ': 1.0, 'seg_posY': y0Trk,
+                     'seg_posZ': 0.0, 'mdt_posY': formatList(hits['posY']), 'mdt_posZ': formatList(hits['posZ']),
+                     'mdt_r': formatList(hits['r']), 'mdt_rTrk': formatList(hits['rTrk']),
+                     'mdt_t': formatList(hits['t']), 'mdt_chamber': str([chamber] * nHits),
+                     'mdt_tubeInfo': str(hits['tube'])})
+    return pd.DataFrame(rows)
+
+
+# dataConverted dataframe as uproot tree branches : jagged per hit branches, per segment scalars
+def treeBranches(df):
+    import awkward as ak
+    branches = {}
+    for name in df.columns:
+        col = df[name]
+        if not pd.api.types.is_numeric_dtype(col) and col.str.startswith('[').all():
+            if name in ['chamber', 'mdt_chamber', 'mdt_tubeInfo']:
+                branches[name] = ak.Array([[x.strip(" '") for x in v[1:-1].split(',')] for v in col])
+            else:
+                branches[name] = ak.Array([[float(x) for x in v[1:-1].split(',')] for v in col])
+        else:
+            branches[name] = col.values
+    return branches
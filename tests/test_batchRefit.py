@@ -0,0 +1,78 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import batchRefit
+import numbaRefit
+import rtResDatabase
+import segmentSamples
+import xMdtSegment
+
+backends = ['numpy', pytest.param('numba', marks=pytest.mark.skipif(not numbaRefit.available,
+                                                                    reason='numba not installed'))]
+
+
+# resolution constants of the chamber and the row by row results of new_mdtCalib_functions.refitSegment
+# (applyRefitSegment and applyUnbiasResidual of xMdtSegment for every segment)
+@pytest.fixture(scope='module', params=['BMG2A12', 'BIL1A01'])
+def rowRefit(request, tmp_path_factory):
+    chamber = request.param
+    df = segmentSamples.makeSegments(60, chamber, seed=3).reset_index(drop=True)
+    rtDb = segmentSamples.copyRtDb(tmp_path_factory.mktemp('rtDb'))
+    resolution_constants = rtResDatabase.loadRtDb(rtDb).getRtRes(chamber)[3]
+
+    seg = xMdtSegment.xMdtSegment(df)
+    rows = []
+    for q in range(len(df)):
+        flag, chi2_new, chi2_def, rTrk_new, xline = seg.applyRefitSegment(q, resolution_constants)
+        m, b = xline.getMB()
+        rows.append((flag, rTrk_new, chi2_new, chi2_def, m, b, seg.applyUnbiasResidual(q, resolution_constants)))
+    return df, chamber, resolution_constants, rows
+
+
+def assertSameRefit(results, rows, nHits):
+    flag, rTrk_new, chi2_new, chi2_def, m, b, unbias_rTrk_new = results
+    for q, row in enumerate(rows):
+        n = nHits[q]
+        assert flag[q] == row[0]
+        np.testing.assert_allclose(rTrk_new[q, :n], row[1], rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose([chi2_new[q], chi2_def[q], m[q], b[q]], row[2:6], rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(unbias_rTrk_new[q, :n], row[6], rtol=1e-9, atol=1e-9)
+
+
+# combined refit (shared tangent lines, downdated sums for the unbias refits) of both backends, same as the row loop
+@pytest.mark.parametrize('backend', backends)
+def test_refitSegments_matches_rows(rowRefit, backend):
+    df, chamber, resolution_constants, rows = rowRefit
+    results = batchRefit.refitSegments(df, resolution_constants, chamber, backend=backend)
+    assertSameRefit(results, rows, df.seg_nMdtHits.values)
+    assert np.any(results[6][:, 0] != -99.)
+
+
+# separate batch refits (applyRefitSegments and applyUnbiasResiduals), same as the row loop
+def test_separate_refits_match_rows(rowRefit):
+    df, chamber, resolution_constants, rows = rowRefit
+    locY, locZ, radial, rTrk, nHits = batchRefit.padSegments(df, ['mdt_posY', 'mdt_posZ', 'mdt_r', 'mdt_rTrk'])
+    m_def = df.seg_dirZ.values / df.seg_dirY.values
+    b_def = df.seg_posZ.values - m_def * df.seg_posY.values
+
+    flag, chi2_new, chi2_def, rTrk_new, m, b = batchRefit.applyRefitSegments(
+        locY, locZ, radial, rTrk, nHits, resolution_constants, chamber, m_def, b_def)
+    unbias_rTrk_new = batchRefit.applyUnbiasResiduals(locY, locZ, radial, nHits, resolution_constants)
+    assertSameRefit((flag, rTrk_new, chi2_new, chi2_def, m, b, unbias_rTrk_new), rows, nHits)
+
+
+def test_resolveBackend_auto(monkeypatch):
+    assert batchRefit.resolveBackend('auto') == ('numba' if numbaRefit.available else 'numpy')
+    assert batchRefit.resolveBackend('numpy') == 'numpy'
+
+    # without numba 'auto' falls back to the numpy kernels, an explicit 'numba' request fails
+    monkeypatch.setattr(numbaRefit, 'available', False)
+    assert batchRefit.resolveBackend('auto') == 'numpy'
+    with pytest.raises(ImportError):
+        batchRefit.applyCombinedRefit(np.zeros((1, 3)), np.zeros((1, 3)), np.zeros((1, 3)), np.zeros((1, 3)), [3],
+                                      [0., 0.1], 'BMG2A12', np.ones(1), np.zeros(1), backend='numba')
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+uproot = pytest.importorskip('uproot')
+
+import chamberPipeline
+import rootReader
+import segmentSamples
+
+
+# ntuple files of two chambers without splitter region in the names
+@pytest.fixture
+def rootFiles(tmp_path):
+    df = pd.concat([segmentSamples.makeSegments(120, 'BMG2A12', seed=1),
+                    segmentSamples.makeSegments(80, 'BMG4A12', seed=2)]).sample(frac=1, random_state=0)
+    files = []
+    for i, part in enumerate([df.iloc[:100], df.iloc[100:]]):
+        file = str(tmp_path / ('skimmed_ntuple_run437124_lb%04d.root' % i))
+        with uproot.recreate(file) as f:
+            f['segments'] = segmentSamples.treeBranches(part)
+        files.append(file)
+    return files
+
+
+def test_runRootPipeline_without_region(rootFiles, tmp_path, monkeypatch):
+    rtDb = segmentSamples.copyRtDb(tmp_path)
+    assert rootReader.regionChambers(rootFiles) is None
+
+    # the files are read once for all chambers
+    reads = []
+    iterate = rootReader.iterateSegments
+    monkeypatch.setattr(rootReader, 'iterateSegments', lambda *args, **kwargs: reads.append(1) or iterate(*args,
+                                                                                                          **kwargs))
+    results = chamberPipeline.runRootPipeline(rootFiles, maxWorkers=1, rtDb=rtDb, minSegments=10)
+    assert len(reads) == 1
+    assert [result['chamber'] for result in results] == ['BMG2A12', 'BMG4A12']
+
+    # same results as the tasks reading their chamber themselves
+    monkeypatch.setattr(rootReader, 'iterateSegments', iterate)
+    for result in results:
+        expected = chamberPipeline.processChamber(rootFiles, result['chamber'], rtDb=rtDb, minSegments=10)
+        assert result['nSegments'] == expected['nSegments'] > 10
+        for key in ['eff5', 'effHardware', 'sigmaBias', 'sigmaUnbias']:
+            np.testing.assert_array_equal(result[key], expected[key])
+
+
+def test_runRootPipeline_chambers(rootFiles, tmp_path):
+    rtDb = segmentSamples.copyRtDb(tmp_path)
+    results = chamberPipeline.runRootPipeline(rootFiles, ['BMG4A12', 'BIL1A01'], maxWorkers=1, rtDb=rtDb,
+                                              minSegments=10)
+    assert [result['chamber'] for result in results] == ['BMG4A12', 'BIL1A01']
+    assert results[0]['nSegments'] > 10 and results[1]['nSegments'] == 0
@@ -0,0 +1,79 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import chamberPipeline
+import columnarCache
+import rtAutocal
+import rtResDatabase
+import rtTable
+import segmentSamples
+
+chamber = 'BMG2A12'
+
+
+# true RT function (UM6608_RtResFit.csv), start calibration file with the RT function of the chamber scaled by 4 %
+# and a dataConverted file of segments with drift times from the true RT function (radius smeared by 80 um)
+@pytest.fixture(scope='module')
+def calibration(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('autocal')
+    rtDb = segmentSamples.copyRtDb(directory)
+    splitDriftTime, zs, zl, _ = rtResDatabase.loadRtDb(rtDb).getRtRes(chamber)
+
+    csv = pd.read_csv(rtDb, index_col=0)
+    row = csv.index[csv.chamber == chamber][0]
+    for name, para in [('para_smallRt', zs), ('para_largeRt', zl)]:
+        csv.loc[row, name] = rtResDatabase.formatList(1.04 * para)
+    start = str(directory / 'start_RtResFit.csv')
+    csv.to_csv(start)
+
+    tGrid = np.linspace(0, 200, 4001)
+    rGrid = rtTable.piecewiseRt(tGrid, splitDriftTime, zs, zl)
+    rng = np.random.default_rng(7)
+    df = segmentSamples.makeSegments(3000, chamber, seed=5,
+                                     radiusToTime=lambda d: np.interp(d + rng.normal(0, 0.08), rGrid, tGrid))
+    file = str(directory / ('run437124_region0051_%s.csv' % chamber))
+    df.to_csv(file, index=False)
+    return {'true': (splitDriftTime, zs, zl), 'start': start, 'file': file, 'directory': directory}
+
+
+# largest difference of two RT functions (splitDriftTime, zs, zl)
+def rtError(rt, true, t):
+    return np.max(np.abs(rtTable.piecewiseRt(t, *rt) - rtTable.piecewiseRt(t, *true)))
+
+
+# the perturbed RT function converges back to the true one (tube wall region t > 170 ns left out, hits close to
+# the wall are missing in the synthetic segments)
+def test_autocalibrate_converges(calibration):
+    seg = chamberPipeline.applyCuts(columnarCache.loadSegments(calibration['file']), chamber)
+    t = np.linspace(0, 170, 171)
+    assert rtError(rtResDatabase.loadRtDb(calibration['start']).getRtRes(chamber)[:3], calibration['true'], t) > 0.2
+
+    result = rtAutocal.autocalibrate(seg, chamber, calibration['start'])
+    assert result['converged'] and result['nIter'] < 10
+    assert result['change'][-1] < 0.002
+    fit = result['fit']
+    assert rtError((fit[2], fit[4], fit[7]), calibration['true'], t) < 0.015
+
+
+# fits written by autocalibrateFiles in the *_RtResFit.csv format and read back by rtResDatabase
+def test_autocalibrateFiles_round_trip(calibration):
+    outFile = str(calibration['directory'] / 'Run437124_RtResFit.csv')
+    fits = rtAutocal.autocalibrateFiles([calibration['file']], calibration['start'], outFile)
+    assert len(fits) == 1 and fits[0][:2] == ('BMG_6_1', chamber)
+
+    db = rtResDatabase.loadRtDb(outFile)
+    assert list(db.chamber) == [chamber]
+    splitDriftTime, zs, zl, z = db.getRtRes('BMG_6_1')
+    assert splitDriftTime == fits[0][2]
+    for loaded, fitted in [(zs, fits[0][4]), (zl, fits[0][7]), (z, fits[0][10])]:
+        np.testing.assert_array_equal(loaded, fitted)
+
+    t = np.linspace(0, 186, 187)
+    np.testing.assert_allclose(rtTable.loadRtTables(outFile, chamber).radius(t, chamber),
+                               rtTable.piecewiseRt(t, splitDriftTime, zs, zl), atol=1e-5)
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import rtResDatabase
+import segmentSamples
+
+
+# the binary sidecar goes to the cache directory, not next to the csv, and a new process reads the same constants
+def test_loadRtDb_sidecar(tmp_path, monkeypatch):
+    rtDb = segmentSamples.copyRtDb(tmp_path)
+    db = rtResDatabase.loadRtDb(rtDb)
+    assert os.path.exists(tmp_path / 'rtDbCache' / 'UM6608_RtResFit.npz')
+    assert not os.path.exists(tmp_path / 'UM6608_RtResFit.npz')
+
+    monkeypatch.setattr(rtResDatabase, '_rtDbCache', {})
+    monkeypatch.setattr(rtResDatabase, 'parseRtDb', None)
+    cached = rtResDatabase.loadRtDb(rtDb)
+    np.testing.assert_array_equal(cached.chamber, db.chamber)
+    for name in rtResDatabase.listColumns + rtResDatabase.scalarColumns:
+        np.testing.assert_array_equal(cached.values[name], db.values[name])
+
+    # other cache directory, relative to the directory of the csv
+    monkeypatch.undo()
+    rtResDatabase._rtDbCache.pop(os.path.abspath(rtDb), None)
+    rtResDatabase.loadRtDb(rtDb, cacheDir='otherCache')
+    assert os.path.exists(tmp_path / 'otherCache' / 'UM6608_RtResFit.npz')
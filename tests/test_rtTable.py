@@ -0,0 +1,84 @@
+import os
+import shutil
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import columnarCache
+import rtResDatabase
+import rtTable
+
+repoDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+# calibration file copied to tmp_path, the rtResDatabase cache (rtDbCache/) is written next to it
+@pytest.fixture
+def rtDb(tmp_path):
+    file = str(tmp_path / 'UM6608_RtResFit.csv')
+    shutil.copy(os.path.join(repoDir, 'UM6608_RtResFit.csv'), file)
+    return file
+
+
+# two segments of BMG2A12 hits, the second hit of the second segment is not a tube of any chamber
+def makeSegments():
+    tubeNames = np.array(['BMG2A12-1-1-10', 'BMG2A12-1-2-10', 'BMG2A12-2-1-11', 'XXX9Z99-1-1-1', 'BMG2A12-2-2-11'])
+    values = {'mdt_t': np.array([20., 55., 110., 80., 150.]), 'mdt_r': np.array([1., -2., 3., -4., 5.]),
+              'mdt_tubeInfo': tubeNames}
+    offsets = {name: np.array([0, 3, 5]) for name in values}
+    return columnarCache.SegmentColumns(['mdt_t', 'mdt_r', 'mdt_tubeInfo'], values, offsets)
+
+
+@pytest.mark.parametrize('tubeIds', [True, False])
+def test_recalibrateSegments_invalid_tube(rtDb, tubeIds):
+    seg = makeSegments()
+    if tubeIds:
+        seg = columnarCache.addTubeIds(seg)
+        assert seg.flat(columnarCache.tubeIdColumn)[3] == -1
+
+    r = rtTable.recalibrateSegments(seg, None, rtDb).flat('mdt_r')
+    expected = rtTable.recalibrateSegments(seg, 'BMG2A12', rtDb).flat('mdt_r')
+
+    valid = np.array([True, True, True, False, True])
+    assert np.isnan(r[3])
+    np.testing.assert_array_equal(r[valid], expected[valid])
+    np.testing.assert_array_equal(np.sign(r[valid]), [1, -1, 1, 1])
+
+
+# calibration file without the RT function of BMG4A12
+@pytest.fixture
+def partialRtDb(tmp_path):
+    file = str(tmp_path / 'partial_RtResFit.csv')
+    with open(os.path.join(repoDir, 'UM6608_RtResFit.csv')) as f:
+        lines = [line for line in f if ',BMG4A12,' not in line]
+    with open(file, 'w') as f:
+        f.writelines(lines)
+    return file
+
+
+def test_recalibrateSegments_missing_chamber(partialRtDb):
+    seg = makeSegments()
+    seg.values['mdt_tubeInfo'] = np.array(['BMG2A12-1-1-10', 'BMG2A12-1-2-10', 'BMG4A12-2-1-11', 'BMG2A12-1-1-1',
+                                           'BMG4A12-2-2-11'])
+
+    # hits of the chamber missing from the calibration file get nan, the others are recalibrated
+    recalibrated = rtTable.recalibrateSegments(seg, None, partialRtDb)
+    r, sigma = recalibrated.flat('mdt_r'), recalibrated.flat('mdt_resSigma')
+    valid = np.array([True, True, False, True, False])
+    assert np.all(np.isnan(r[~valid])) and np.all(np.isnan(sigma[~valid]))
+    expected = rtTable.recalibrateSegments(seg, 'BMG2A12', partialRtDb).flat('mdt_r')
+    np.testing.assert_array_equal(r[valid], expected[valid])
+
+    with pytest.raises(KeyError, match='BMG4A12'):
+        rtTable.recalibrateSegments(seg, 'BMG4A12', partialRtDb)
+
+
+# resolution of the new radius, same as np.polyval(para_res, |r|) of the calibration file
+def test_recalibrateSegments_sigma(rtDb):
+    seg = rtTable.recalibrateSegments(makeSegments(), 'BMG2A12', rtDb)
+    assert seg.counts('mdt_resSigma').tolist() == [3, 2]
+    para_res = rtResDatabase.loadRtDb(rtDb).getRtRes('BMG2A12')[3]
+    np.testing.assert_allclose(seg.flat('mdt_resSigma'), np.polyval(para_res, np.abs(seg.flat('mdt_r'))) / 1000.,
+                               rtol=1e-5)
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import columnarCache
+import segmentCuts
+import segmentSamples
+
+
+# chi2 cut pushed into the reader and dropped from the preset, same segments as the full preset
+def test_applyPreset_chi2_pushed_down(tmp_path):
+    df = segmentSamples.makeSegments(200, 'BMG2A12', seed=4)
+    df['mdt_t'] = [segmentSamples.formatList(np.random.default_rng(i).uniform(-10, 200, n))
+                   for i, n in enumerate(df.seg_nMdtHits)]
+    file = str(tmp_path / 'run437124_region0051_BMG2A12.csv')
+    df.to_csv(file, index=False)
+
+    seg, flow = segmentCuts.applyPreset(columnarCache.loadSegments(file), 'BMG2A12', 'efficiency', chi2=(None, 10))
+    read = columnarCache.loadSegments(file, cuts=['seg_chi2 < 10'])
+    pushed, pushedFlow = segmentCuts.applyPreset(read, 'BMG2A12', 'efficiency', chi2=None)
+
+    assert [name for name, n in pushedFlow] == ['all', 'driftTime', 'nHits']
+    assert len(read) == flow[1][1] < flow[0][1]
+    assert pushedFlow[1:] == flow[2:] and len(pushed) == len(seg) > 0
+    np.testing.assert_array_equal(pushed['event_eventNumber'], seg['event_eventNumber'])
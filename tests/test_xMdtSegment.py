@@ -0,0 +1,93 @@
+import itertools
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mdtCalib_functions
+import xMdtSegment
+import xStraightLine as xSL
+
+
+# sMDT (BMG) like segment : nHits hits in alternating layers around a straight track, outliers random radii
+def makeSegment(nHits, seed, outliers=0):
+    rng = np.random.default_rng(seed)
+    locZ = 20. + np.arange(nHits) * 13.1 + (np.arange(nHits) >= nHits // 2) * 80.
+    locY = 400. + (np.arange(nHits) % 2) * 7.55 + rng.normal(0, 3., nHits)
+    m, b = rng.uniform(2., 20.) * rng.choice([-1, 1]), rng.uniform(-100., 100.)
+    b = 200. - m * 400. + b
+    rTrk = mdtCalib_functions.distLines(locY, locZ, m, b)
+    radial = np.clip(np.abs(rTrk + rng.normal(0, 0.3, nHits)), 0, 7.1)
+    radial[rng.integers(0, nHits, outliers)] = rng.uniform(0, 7.1, outliers)
+    resSigma = np.full(nHits, 0.1)
+    return (locY, locZ, radial, rTrk, np.full(nHits, -1)), resSigma
+
+
+# all 4 tangent lines of every hit pair, no chi2 preselection
+def candidateLines(seg):
+    points = list(zip(seg[0], seg[1], np.abs(seg[2])))
+    return [mdtCalib_functions.tangentLine(points[n - 1], points[n], 0) for n in range(1, len(points))]
+
+
+# chi2 of the best combination, old itertools.product loop
+def productMinChi2(cand_line, seg, resSigma):
+    best = np.inf
+    for reconPoint in itertools.product(*cand_line):
+        line = xSL.xStraightLine()
+        line.setPoints(reconPoint)
+        line.points2line()
+        chi2, _ = line.dist2line_mb(seg, resSigma)
+        if np.isfinite(chi2):
+            best = min(best, chi2)
+    return best
+
+
+@pytest.fixture(scope='module')
+def segment():
+    df = pd.DataFrame({'chamber': ["['BMG2A12']"], 'seg_nMdtHits': [0], 'mdt_r': ['[]'], 'mdt_posY': ['[]'],
+                       'mdt_posZ': ['[]']})
+    return xMdtSegment.xMdtSegment(df)
+
+
+# segments with outliers (8 hits : seeds missed by a 256 wide beam) have > 256 combinations, same best chi2 as
+# itertools.product
+@pytest.mark.parametrize('nHits,seed,outliers', [(6, 1, 0), (7, 3, 1), (8, 5, 0), (8, 66, 2), (8, 75, 2), (8, 76, 2)])
+def test_searchCandidateLines_matches_product(segment, nHits, seed, outliers):
+    seg, resSigma = makeSegment(nHits, seed, outliers)
+    cand_line = candidateLines(seg)
+    assert 4 ** len(cand_line) > 256
+
+    reconPoint, chi2 = segment.searchCandidateLines(cand_line, seg, resSigma)
+    line = xSL.xStraightLine()
+    line.setPoints(reconPoint)
+    line.points2line()
+    refit_chi2, _ = line.dist2line_mb(seg, resSigma)
+
+    expected = productMinChi2(cand_line, seg, resSigma)
+    assert chi2 == pytest.approx(expected, rel=1e-9, abs=1e-12)
+    assert refit_chi2 == pytest.approx(expected, rel=1e-9, abs=1e-12)
+
+
+# above exhaustiveLimit (branch and bound, first best chi2 from a narrow beam) same best chi2 as itertools.product
+@pytest.mark.parametrize('nHits,seed,outliers', [(7, 3, 1), (8, 66, 2), (8, 75, 2), (8, 76, 2)])
+@pytest.mark.parametrize('beamWidth,exhaustiveLimit', [(1, 4), (4, 16), (256, 64)])
+def test_searchCandidateLines_above_limit(segment, nHits, seed, outliers, beamWidth, exhaustiveLimit):
+    seg, resSigma = makeSegment(nHits, seed, outliers)
+    cand_line = candidateLines(seg)
+    _, chi2 = segment.searchCandidateLines(cand_line, seg, resSigma, beamWidth, exhaustiveLimit)
+    assert chi2 == pytest.approx(productMinChi2(cand_line, seg, resSigma), rel=1e-9, abs=1e-12)
+
+
+# 10 hits (262144 combinations) with the default limits, same as all combinations evaluated at once
+@pytest.mark.parametrize('seed,outliers', [(1, 0), (2, 1), (3, 2)])
+def test_searchCandidateLines_10_hits(segment, seed, outliers):
+    seg, resSigma = makeSegment(10, seed, outliers)
+    cand_line = candidateLines(seg)
+    reconPoint, chi2 = segment.searchCandidateLines(cand_line, seg, resSigma)
+    _, expected = segment.searchCandidateLines(cand_line, seg, resSigma, exhaustiveLimit=4 ** len(cand_line))
+    assert len(reconPoint) == len(cand_line)
+    assert chi2 == pytest.approx(expected, rel=1e-9, abs=1e-12)
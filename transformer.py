@@ -1,60 +1,99 @@
-import uproot3 as uproot
-import csv
+import os, re, glob
 import pandas as pd
-import sys,os, time
-import re
-import numpy as np
-import matplotlib.pyplot as plt
-import muonfixedid, chamberlist
+import chamberlist
 import splitter_regions_Run2
 
 
-data = ['rootdata/skimmed_ntuple_run437124_lb0000_0005_region0051.csv',
-        'rootdata/skimmed_ntuple_run437124_lb0003_0014_region0051.csv',
-        'rootdata/skimmed_ntuple_run437124_lb0013_0018_region0051.csv',
-        'rootdata/skimmed_ntuple_run437124_lb0019_0025_region0051.csv',
-        'rootdata/skimmed_ntuple_run437124_lb0023_0035_region0051.csv',
-        'rootdata/skimmed_ntuple_run437124_lb0026_0032_region0051.csv',
-        'rootdata/skimmed_ntuple_run437124_lb0033_0044_region0051.csv',
-        'rootdata/skimmed_ntuple_run437124_lb0037_0047_region0051.csv',
-        'rootdata/skimmed_ntuple_run437124_lb0048_0052_region0051.csv',
-        'rootdata/skimmed_ntuple_run437124_lb0053_0057_region0051.csv',
-        'rootdata/skimmed_ntuple_run437124_lb0058_0062_region0051.csv',
-        'rootdata/skimmed_ntuple_run437124_lb0063_0067_region0051.csv',
-        'rootdata/skimmed_ntuple_run437124_lb0068_0072_region0051.csv']
-
-t1 = open('dataConverted/run437124_region0051_BME4A13.csv', 'w', newline="")
-t2 = open('dataConverted/run437124_region0051_BMG2A12.csv', 'w', newline="")
-t3 = open('dataConverted/run437124_region0051_BMG4A12.csv', 'w', newline="")
-t4 = open('dataConverted/run437124_region0051_BMG6A12.csv', 'w', newline="")
-
-out1 = csv.writer(t1)
-out2 = csv.writer(t2)
-out3 = csv.writer(t3)
-out4 = csv.writer(t4)
-
-dfmain = pd.read_csv(data[0])
-out1.writerow(dfmain.columns)
-out2.writerow(dfmain.columns)
-out3.writerow(dfmain.columns)
-out4.writerow(dfmain.columns)
-
-i = 0
-
-while i < len(data):
-        print('file number: ', i)
-        df = pd.read_csv(data[i])
-        chamberlist = df.chamber
-        j = 0
-        while j < len(df):
-                if chamberlist[j][2:9] == 'BME4A13':
-                        out1.writerow(df.values[j])
-                elif chamberlist[j][2:9] == 'BMG2A12':
-                        out2.writerow(df.values[j])
-                elif chamberlist[j][2:9] == 'BMG4A12':
-                        out3.writerow(df.values[j])
-                else:
-                        out4.writerow(df.values[j])
-                print(j)
-                j += 1
-        i += 1
\ No newline at end of file
+# streaming splitter of skimmed ntuple csv files into one dataConverted csv file per chamber
+# input files are read in chunks, rows are grouped by the chamber column and appended to the chamber output,
+# so memory stays bounded by chunkSize whatever the number of luminosity block files
+# an output file is only open while a chunk group is written to it (created at the first rows, appended after), so
+# the number of open files stays bounded whatever the number of chambers (~1200 for a whole run)
+# output chambers are the chambers of the splitter region (splitter_regions_Run2), no hard coded chamber names
+# files without region in the name (whole run) are sharded by region : every chamber goes to the file of its region
+#
+#  How to use:
+# import transformer
+# transformer.splitFiles(glob.glob('rootdata/skimmed_ntuple_run437124_lb*_region0051.csv'))
+#       => writes dataConverted/run437124_region0051_BME4A13.csv, ..._BMG2A12.csv, ..._BMG4A12.csv, ..._BMG6A12.csv
+# transformer.splitFiles(glob.glob('rootdata/skimmed_ntuple_run437124_lb*.csv'))
+#       => writes dataConverted/run437124_region<region of the chamber>_<chamber>.csv for all chambers of the run
+
+
+# run number and region number from a skimmed ntuple file name, None if not found
+def runRegionFromFile(file):
+    run = re.search(r'run(\d+)', os.path.basename(file))
+    region = re.search(r'region(\d+)', os.path.basename(file))
+    return run.group(1) if run else None, int(region.group(1)) if region else None
+
+
+# hardware names of all chambers in a splitter region
+def regionChambers(region):
+    return [chamberlist.mdt[ii].hardname for ii in splitter_regions_Run2.regionChamberIndex[region]]
+
+
+# hardware names of the chambers of all splitter regions
+def allRegionChambers():
+    return [chamberlist.mdt[ii].hardname for ii in range(chamberlist.MAXCHAMBERS)
+            if splitter_regions_Run2.indexRegion[ii] > 0]
+
+
+# chamber hardname of every row, from the chamber column "['BMG2A12', 'BMG2A12', ...]"
+def rowChambers(col):
+    return col.astype(str).str.strip("[]'\" ").str.split("'", n=1).str[0].str.strip()
+
+
+# split files into per chamber csv files
+# chambers : list of hardnames to keep, default is the chambers of the region in the file names, or all chambers
+# of a splitter region if the file names have no region (outputs named by the region of each chamber)
+# rows of other chambers are counted and skipped
+# run : run number of the output names, default is the run in the file names (ValueError if none)
+# returns dict hardname -> (output file, number of rows)
+def splitFiles(files, outDir='dataConverted', chambers=None, chunkSize=100000, run=None):
+    files = sorted(files)
+    if len(files) == 0:
+        return {}
+    fileRun, region = runRegionFromFile(files[0])
+    run = fileRun if run is None else run
+    if run is None:
+        raise ValueError('no run number in file name %s, give run' % files[0])
+    byRegion = chambers is None and region is None
+    if byRegion:
+        chambers = allRegionChambers()
+    elif chambers is None:
+        if not 0 < region <= splitter_regions_Run2.numregions:
+            raise ValueError('no splitter region %d in file name %s, give chambers' % (region, files[0]))
+        chambers = regionChambers(region)
+    chambers = set(chambers)
+    prefix = 'run%s_region%04d_' % (run, region) if region is not None else 'run%s_' % run
+
+    # chamber -> [number of rows written, output file], the header is written with the first rows
+    outputs = {}
+    nSkipped = 0
+    for i, file in enumerate(files):
+        print('file number: ', i, file)
+        for df in pd.read_csv(file, chunksize=chunkSize):
+            # group rows of the chunk by chamber with one vectorized pass
+            for chamber, rows in df.groupby(rowChambers(df.chamber).values).indices.items():
+                if chamber not in chambers:
+                    nSkipped += len(rows)
+                    continue
+                if chamber not in outputs:
+                    if byRegion:
+                        prefix = 'run%s_region%04d_' % (run, splitter_regions_Run2.getregion(chamber))
+                    outputs[chamber] = [0, os.path.join(outDir, prefix + chamber + '.csv')]
+                out = outputs[chamber]
+                with open(out[1], 'w' if out[0] == 0 else 'a', newline='') as f:
+                    df.iloc[rows].to_csv(f, header=(out[0] == 0), index=False)
+                out[0] += len(rows)
+
+    for chamber in sorted(outputs):
+        print(chamber, outputs[chamber][0], 'rows ->', outputs[chamber][1])
+    if nSkipped > 0:
+        print('rows of chambers outside', 'the splitter regions' if byRegion else sorted(chambers), ':', nSkipped)
+    return {chamber: (out[1], out[0]) for chamber, out in outputs.items()}
+
+
+if __name__ == '__main__':
+    data = glob.glob('rootdata/skimmed_ntuple_run437124_lb*_region0051.csv')
+    splitFiles(data)
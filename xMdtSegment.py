@@ -3,10 +3,66 @@ import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib.patches import Circle, Wedge, Polygon
 import mdtCalib_functions
+import chamberlist
 import itertools
 import xStraightLine as xSL
 
 
+# max drift radius of the chamber of the hits, tubeIds : muonfixedids (chamberlist.MDTmfidArray)
+# station of the first known tube id, of the chamber name (hardname) if no id is known (-1)
+def maxTubeRadius(tubeIds, chamber=''):
+    idx = chamberlist.MDTindexMfid(np.asarray(tubeIds))
+    idx = idx[idx >= 0]
+    station = chamberlist.mdt[idx[0]].station if len(idx) > 0 else chamber[:3]
+    if station in ['BMG', 'BME']:
+        return 7.1
+    return 14.6
+
+
+# interval product [alo, ahi] * [blo, bhi]
+def _intervalProduct(alo, ahi, blo, bhi):
+    products = np.stack([alo * blo, alo * bhi, ahi * blo, ahi * bhi])
+    return np.min(products, axis=0), np.max(products, axis=0)
+
+
+# interval square [lo, hi] ** 2
+def _intervalSquare(lo, hi):
+    low = np.where((lo <= 0) & (hi >= 0), 0., np.minimum(lo * lo, hi * hi))
+    return low, np.maximum(lo * lo, hi * hi)
+
+
+# lower bound of the chi2 of the line fitted to points whose lineSums (n, S, Sx, Sy, Sxx, Sxy, centered at the
+# hit mean) are inside [lo, hi] (rows : partial combinations, sums of the remaining pairs taken at their extremes)
+# the fitted line goes through the centroid (Sx/S, Sy/S) with direction (S*Sxx - Sx*Sx, S*Sxy - Sx*Sy), the
+# distance of every hit to all such lines is bounded by interval arithmetic, a hit whose radius is inside the
+# distance interval contributes 0; hits are (x, y) centered at the hit mean
+def _chi2LowerBound(lo, hi, x, y, radial, weight):
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        S = lo[:, 1], hi[:, 1]
+        Sx, Sy, Sxx, Sxy = (lo[:, 2], hi[:, 2]), (lo[:, 3], hi[:, 3]), (lo[:, 4], hi[:, 4]), (lo[:, 5], hi[:, 5])
+        cx = _intervalProduct(Sx[0], Sx[1], 1. / S[1], 1. / S[0])
+        cy = _intervalProduct(Sy[0], Sy[1], 1. / S[1], 1. / S[0])
+        sxx, sxy = _intervalProduct(*S, *Sxx), _intervalProduct(*S, *Sxy)
+        xx, xy = _intervalSquare(*Sx), _intervalProduct(*Sx, *Sy)
+        dx = sxx[0] - xx[1], sxx[1] - xx[0]
+        dy = sxy[0] - xy[1], sxy[1] - xy[0]
+        norm = np.sqrt(_intervalSquare(*dx)[0] + _intervalSquare(*dy)[0]), \
+            np.sqrt(_intervalSquare(*dx)[1] + _intervalSquare(*dy)[1])
+
+        # distance |(x - cx) * dy - (y - cy) * dx| / |(dx, dy)| of every hit
+        px = _intervalProduct(x[None, :] - cx[1][:, None], x[None, :] - cx[0][:, None], dy[0][:, None], dy[1][:, None])
+        py = _intervalProduct(y[None, :] - cy[1][:, None], y[None, :] - cy[0][:, None], dx[0][:, None], dx[1][:, None])
+        cross = px[0] - py[1], px[1] - py[0]
+        absLo = np.where((cross[0] <= 0) & (cross[1] >= 0), 0., np.minimum(np.abs(cross[0]), np.abs(cross[1])))
+        absHi = np.maximum(np.abs(cross[0]), np.abs(cross[1]))
+        dLo = absLo / norm[1][:, None]
+        dHi = np.where(norm[0][:, None] > 0, absHi / norm[0][:, None], np.inf)
+        miss = np.maximum(dLo - radial[None, :], 0.) + np.maximum(radial[None, :] - dHi, 0.)
+        bound = np.sum(miss ** 2 * weight[None, :], axis=1) / (len(radial) - 1)
+    # no bound if the interval arithmetic degenerates (no points yet, nan points)
+    return np.where(np.isfinite(bound) & (S[0] > 0), bound, 0.)
+
+
 class xMdtSegment:
     '''load csv pandas dataframe
     author : zhen.yan@cern.ch
@@ -365,8 +421,8 @@ class xMdtSegment:
                 unbais_rTrk.append(-99.)
             else:
                 # ax.plot(np.array(xxx), np.array(yyy),'r.',label = 'new_reconPoints')
-                m_refit, b_refit = np.polyfit(xxx, yyy, 1)
-                new_rTrk_temp = mdtCalib_functions.dist(seg[0], seg[1], m_refit, b_refit)
+                m_refit, b_refit = mdtCalib_functions.fitLines(xxx, yyy)
+                new_rTrk_temp = mdtCalib_functions.distLines(seg[0], seg[1], m_refit, b_refit)
                 # min_track_chi2_refit = sum((np.abs(seg[2])-np.abs(new_rTrk_temp))**2/resSigma**2)/(len(seg[2])-1)
                 # ax.plot(xx, m_refit*xx + b_refit,label='%s refitted segment,refit %d with new min chi2 %.3f, rTrk_unbais %.3f'%(test_df.seg_station,j, min_track_chi2_refit,new_rTrk_temp[j]))
                 unbais_rTrk.append(new_rTrk_temp[j])
@@ -397,8 +453,8 @@ class xMdtSegment:
         radial = [float(y) for y in self.df.mdt_r[q][1:-1].split(', ')]
         #rTrk = [float(y) for y in self.df.mdt_rTrk[1:-1].split(', ')]
         rTrk = [float(y) for y in self.df.mdt_rTrk[q][1:-1].split(', ')]
-        #tubeIds = [y for y in self.df.mdt_tubeInfo[2:-2].split('\', \'')]
-        tubeIds = [y for y in self.df.mdt_chamber[0][2:-2].split('\', \'')]
+        # integer tube keys (muonfixedid) of the hits
+        tubeIds = chamberlist.MDTmfidArray(self.df.mdt_tubeInfo[q][1:-1].split(', '))
 
         # construct seg and hit points
         seg = locY, locZ, radial, rTrk, tubeIds
@@ -434,9 +490,7 @@ class xMdtSegment:
 
     def reconStraightLine_minChi2(self, seg, resSigma):
         # set maxRadius
-        maxRadius = 14.6
-        if seg[4][0][:3] in ['BMG', 'BME']:
-            maxRadius = 7.1
+        maxRadius = maxTubeRadius(seg[4], self.chamber)
 
         # loop all hits and get reconPoints, make sure radius is positive and clip maxRadius at 7.1
         r = np.clip(np.abs(seg[2]), a_min=0, a_max=maxRadius)
@@ -498,21 +552,97 @@ class xMdtSegment:
             # ax.plot(np.array(xxx), np.array(yyy),'b.',label = 'new_reconPoints')
             if len(xxx) < 2 or len(yyy) < 2:
                 return 0, -999., seg[3], xSL.xStraightLine()
-            m_refit, b_refit = np.polyfit(xxx, yyy, 1)
-            new_rTrk_temp = mdtCalib_functions.dist(seg[0], seg[1], m_refit, b_refit)
+            m_refit, b_refit = mdtCalib_functions.fitLines(xxx, yyy)
+            new_rTrk_temp = mdtCalib_functions.distLines(seg[0], seg[1], m_refit, b_refit)
             min_track_chi2_refit = sum((np.abs(seg[2]) - np.abs(new_rTrk_temp)) ** 2 / resSigma ** 2) / (
                         len(seg[2]) - 1)
             xline = xSL.xStraightLine()
-            xline.setMB(m_refit, b_refit)
+            xline.setMB(float(m_refit), float(b_refit))
             # ax.plot(xx, m_refit*xx + b_refit,label='%s refitted segment with new min chi2 %.3f'%(test_df.seg_station, min_track_chi2_refit))
             return 1, min_track_chi2_refit, list(new_rTrk_temp), xline
 
-    def reconStraightLine(self, seg, resSigma):
+    # search of the best combination of sub-segment lines (one candidate line per hit pair in cand_line)
+    # replaces itertools.product over all combinations, same result : the combinations are built pair by pair, line
+    # fits are updated from the sums of the points (mdtCalib_functions.lineSums), no refit per combination
+    # up to exhaustiveLimit combinations (65536 : all 8 and 9 hit segments with 4 candidates per pair) all of them
+    # are evaluated at once; above the limit a beam search (beamWidth lowest chi2 partial combinations kept after
+    # every pair) gives a first best chi2, then a depth first branch and bound over the pairs in blocks of at most
+    # exhaustiveLimit partial combinations drops those whose chi2 lower bound (_chi2LowerBound, any choice of the
+    # remaining pairs) is above the best chi2 found, so the best combination is never dropped
+    # returns the best combination (tuple of lines) and its chi2
+    def searchCandidateLines(self, cand_line, seg, resSigma, beamWidth=256, exhaustiveLimit=65536):
+        locY, locZ = np.asarray(seg[0], dtype=float), np.asarray(seg[1], dtype=float)
+        radial = np.abs(np.asarray(seg[2], dtype=float))
+        weight = 1. / np.asarray(resSigma, dtype=float) ** 2
+        # sums centered at the mean hit position (small sums, tight lower bounds)
+        x0, y0 = np.mean(locY), np.mean(locZ)
+
+        def combinationChi2(sums):
+            m, b = mdtCalib_functions.linesFromSums(sums.T, x0, y0)
+            rTrk = mdtCalib_functions.distLines(locY[None, :], locZ[None, :], m[:, None], b[:, None])
+            chi2 = np.sum((radial - rTrk) ** 2 * weight, axis=1) / (len(radial) - 1)
+            return np.where(np.isnan(chi2), np.inf, chi2)
+
+        # line fit sums of the candidates of every pair
+        pairSums = []
+        for lines in cand_line:
+            lines = np.asarray(lines, dtype=float)
+            pairSums.append(np.stack(mdtCalib_functions.lineSums(lines[:, [0, 2]], lines[:, [1, 3]], None, x0, y0),
+                                     axis=-1))
+
+        # partial combinations extended by the candidates of pair n : candidate index per pair (combinations in
+        # itertools.product order) and line fit sums
+        def extend(choice, sums, n):
+            k = len(pairSums[n])
+            return np.concatenate([np.repeat(choice, k, axis=0), np.tile(np.arange(k), len(choice))[:, None]],
+                                  axis=1), (sums[:, None, :] + pairSums[n][None, :, :]).reshape(-1, 6)
+
+        exhaustive = np.prod([float(len(sums)) for sums in pairSums]) <= exhaustiveLimit
+        if exhaustive:
+            beamWidth = exhaustiveLimit
+
+        # beam
+        choice, sums = np.zeros((1, 0), dtype=int), np.zeros((1, 6))
+        for n in range(len(pairSums)):
+            choice, sums = extend(choice, sums, n)
+            if len(choice) > beamWidth:
+                keep = np.sort(np.argsort(combinationChi2(sums), kind='stable')[:beamWidth])
+                choice, sums = choice[keep], sums[keep]
+        chi2 = combinationChi2(sums)
+        index = np.argmin(chi2)
+        bestChoice, bestChi2 = choice[index], chi2[index]
+
+        if not exhaustive:
+            # sums of the pairs n.. at their lowest and highest values
+            restLo = np.cumsum([np.min(sums, axis=0) for sums in pairSums[::-1]], axis=0)[::-1]
+            restHi = np.cumsum([np.max(sums, axis=0) for sums in pairSums[::-1]], axis=0)[::-1]
+            restLo, restHi = np.concatenate([restLo, np.zeros((1, 6))]), np.concatenate([restHi, np.zeros((1, 6))])
+            x, y = locY - x0, locZ - y0
+            stack = [(np.zeros((1, 0), dtype=int), np.zeros((1, 6)))]
+            while stack:
+                choice, sums = stack.pop()
+                n = choice.shape[1]
+                if n == len(pairSums):
+                    chi2 = combinationChi2(sums)
+                    index = np.argmin(chi2)
+                    if chi2[index] < bestChi2:
+                        bestChoice, bestChi2 = choice[index], chi2[index]
+                    continue
+                choice, sums = extend(choice, sums, n)
+                if n + 1 < len(pairSums):
+                    bound = _chi2LowerBound(sums + restLo[n + 1], sums + restHi[n + 1], x, y, radial, weight)
+                    keep = bound <= bestChi2 * (1 + 1e-9)
+                    choice, sums = choice[keep], sums[keep]
+                # blocks in itertools.product order, first block on top
+                for start in range((len(choice) - 1) // exhaustiveLimit * exhaustiveLimit, -1, -exhaustiveLimit):
+                    stack.append((choice[start:start + exhaustiveLimit], sums[start:start + exhaustiveLimit]))
+
+        return tuple(cand_line[n][k] for n, k in enumerate(bestChoice)), bestChi2
+
+    def reconStraightLine(self, seg, resSigma, beamWidth=256, exhaustiveLimit=65536):
 
         # set maxRadius
-        maxRadius = 14.6
-        if seg[4][0][:3] in ['BMG', 'BME']:
-            maxRadius = 7.1
+        maxRadius = maxTubeRadius(seg[4], self.chamber)
 
         # loop all hits and get reconPoints, make sure radius is positive and clip maxRadius at 7.1
         r = np.clip(np.abs(seg[2]), a_min=0, a_max=maxRadius)
@@ -540,7 +670,7 @@ class xMdtSegment:
                 # a,b,c = mdtCalib_functions.twoPoints2line(line)
                 # rTrk_temp = mdtCalib_functions.dist_abc(seg[0],seg[1],a,b,c)
                 m, b = mdtCalib_functions.lineConv(line)
-                rTrk_temp = mdtCalib_functions.dist_mb(seg[0], seg[1], m, b)
+                rTrk_temp = mdtCalib_functions.distLines(seg[0], seg[1], m, b)
 
                 # residual_temp = np.abs(seg[2])- np.abs(rTrk_temp)
                 track_chi2_temp = sum((np.abs(seg[2]) - np.abs(rTrk_temp)) ** 2 / resSigma ** 2) / (len(seg[2]) - 1)
@@ -568,33 +698,12 @@ class xMdtSegment:
             # print('refit failed because of less 3 hits on reconstruction track')
             return 0, -999., seg[3], xSL.xStraightLine(), -999.
         else:
-            # create all combinations of sub-segment tracks
-            reconPoints = list(itertools.product(*cand_line))
-            # print(len(reconPoints),reconPoints)
-            cand_chi2List = []
-            cand_xlineList = []
-            cand_rTrkList = []
-
-            for reconPoint in reconPoints:
-                xline = xSL.xStraightLine()
-                xline.setPoints(reconPoint)
-                xline.points2line()
-                m_refit, b_refit = xline.mb
-                track_chi2_refit, rTrk_refit = xline.dist2line_mb(seg, resSigma)
-                # xx = np.linspace(np.min(seg[0])-20,np.max(seg[0])+20, 1000)
-                # ax.plot(xx, m_refit*xx + b_refit,label='%s refitted segment with chi2 %.3f'%(self.df.seg_station, track_chi2_refit))
-                # rTrk_refit = mdtCalib_functions.dist(locY,locZ,m_refit,b_refit)
-                # residual_new = np.abs(radial)- np.abs(rTrk_refit)
-                # track_chi2_new = sum((np.abs(radial)-np.abs(rTrk_refit))**2/resSigma**2)/(len(radial)-1)
-                cand_chi2List.append(track_chi2_refit)
-                cand_xlineList.append(xline)
-                cand_rTrkList.append(rTrk_refit)
-
-            # pick up the minimum chi2 final track
-            index = np.argmin(cand_chi2List)
-            refit_chi2 = cand_chi2List[index]
-            refit_rTrk = cand_rTrkList[index]
-            refit_line = cand_xlineList[index]
+            # best combination of sub-segment tracks, all combinations up to exhaustiveLimit, beam search above
+            reconPoint, refit_chi2 = self.searchCandidateLines(cand_line, seg, resSigma, beamWidth, exhaustiveLimit)
+            refit_line = xSL.xStraightLine()
+            refit_line.setPoints(reconPoint)
+            refit_line.points2line()
+            refit_chi2, refit_rTrk = refit_line.dist2line_mb(seg, resSigma)
             # print(refit_chi2,refit_line)
 
             return 1, refit_chi2, refit_rTrk, refit_line, min_chi2
@@ -48,38 +48,20 @@ class xStraightLine:
             return 0
         return 1
 
-    # new function to convert line (x1,y1),(x2,y2) to m,b by curved_fit with error
+    # function to convert lines (x1,y1),(x2,y2) to m,b and a,b,c by closed form least squares fit of all points
+    # vertical line : a,b,c = 1,0,-x and m,b = inf,x as mdtCalib_functions.fitLines
     def points2line(self):
         if len(self.points) > 0:
-            x = []
-            y = []
-            for point in self.points:
-                x1, y1, x2, y2 = point
-                x.append(x1)
-                x.append(x2)
-                y.append(y1)
-                y.append(y2)
-
-            m_refit, b_refit = np.polyfit(x, y, 1)
-            self.mb = m_refit, b_refit
-            return 1
-        else:
-            self.mb = 0.0, 0.0
-            return 0
-
-    # function to convert line (x1,y1),(x2,y2) to m,b
-    def points2line(self):
-        if len(self.points) > 0:
-            x = []
-            y = []
-            for point in self.points:
-                x1, y1, x2, y2 = point
-                x.append(x1)
-                x.append(x2)
-                y.append(y1)
-                y.append(y2)
-            m_refit, b_refit = np.polyfit(x, y, 1)
-            self.mb = m_refit, b_refit
+            points = np.asarray(self.points, dtype=float).reshape(-1, 4)
+            x = np.concatenate([points[:, 0], points[:, 2]])
+            y = np.concatenate([points[:, 1], points[:, 3]])
+            m_refit, b_refit = mdtCalib_functions.fitLines(x, y)
+            if np.isinf(m_refit):
+                self.abc = 1.0, 0.0, -float(b_refit)
+            else:
+                norm = np.sqrt(m_refit * m_refit + 1)
+                self.abc = float(m_refit / norm), float(-1 / norm), float(b_refit / norm)
+            self.mb = float(m_refit), float(b_refit)
             return 1
         else:
             self.mb = 0.0, 0.0
@@ -99,7 +81,7 @@ class xStraightLine:
     def dist2line_mb(self, seg, resSigma):
         locY, locZ, radial, rTrk, tubeIds = seg
         m_refit, b_refit = self.mb
-        rTrk_refit = mdtCalib_functions.dist_mb(locY, locZ, m_refit, b_refit)
+        rTrk_refit = mdtCalib_functions.distLines(locY, locZ, m_refit, b_refit)
         # residual = np.abs(radial)- np.abs(rTrk_refit)
         chi2 = sum((np.abs(radial) - np.abs(rTrk_refit)) ** 2 / resSigma ** 2) / (len(radial) - 1)
         return chi2, rTrk_refit